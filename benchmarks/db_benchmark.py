@@ -0,0 +1,321 @@
+"""Benchmark of database layer on synthetic data
+
+Generates films and subscriptions databases of the given size (once, they
+are reused while sizes match) and times database methods at every given
+concurrency. Results are printed as JSON with p50/p95/p99 latency in
+milliseconds and operations per second. With --baseline the run is compared
+with a previous result and the exit code is 1 if something got slower.
+
+Usage:
+    python -m benchmarks.db_benchmark [--films 100000] [--users 1000000]
+        [--sponsors 50] [--concurrency 1 8 32] [--ops 2000]
+        [--dir bench_data] [--output result.json]
+        [--baseline previous.json] [--tolerance 0.2]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from database import AsyncFilmDatabase, AsyncSubscribitions, Database
+
+Operation = Callable[[int], Awaitable[object]]
+
+WORDS = (
+    "night day city river dark light last first king queen love war star "
+    "dream ghost road home blood iron silent secret lost golden red blue "
+    "storm winter summer island machine heart shadow fire ocean mountain"
+).split()
+
+
+def _title(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+
+
+async def create_schema(database: Database) -> None:
+    await database.connect()  # applies migrations
+    await database.close()
+
+
+async def generate_films(path: str, count: int, rng: random.Random) -> None:
+    """Fill films database with count films coded from 1 to count"""
+    await create_schema(AsyncFilmDatabase(path))
+    with sqlite3.connect(path) as db:
+        db.execute("PRAGMA synchronous=OFF")
+        db.executemany(
+            "INSERT INTO films (code, title, director, year, description) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                (
+                    code,
+                    _title(rng),
+                    f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}son",
+                    rng.randint(1920, 2024),
+                    " ".join(rng.choice(WORDS) for _ in range(30)),
+                )
+                for code in range(1, count + 1)
+            ),
+        )
+
+
+async def generate_subscriptions(
+    path: str, users: int, sponsors: int, rng: random.Random
+) -> None:
+    """Fill subscriptions database with sponsors and users from 1 to users
+
+    Most users are verified for the current sponsor set, the rest are
+    unsubscribed or verified for an older one.
+    """
+    await create_schema(AsyncSubscribitions(path))
+    with sqlite3.connect(path) as db:
+        db.execute("PRAGMA synchronous=OFF")
+        db.executemany(
+            "INSERT INTO channels (channel_name) VALUES (?)",
+            ((f"@sponsor_{i}",) for i in range(sponsors)),
+        )
+        (generation,) = db.execute(
+            "SELECT generation FROM sponsor_generation"
+        ).fetchone()
+        db.executemany(
+            "INSERT INTO subscriptions (user_id, subscribed, generation) "
+            "VALUES (?, ?, ?)",
+            (
+                (
+                    user_id,
+                    rng.random() < 0.9,
+                    generation if rng.random() < 0.8 else generation - 1,
+                )
+                for user_id in range(1, users + 1)
+            ),
+        )
+
+
+async def prepare(
+    directory: str, films: int, users: int, sponsors: int
+) -> Dict[str, str]:
+    """Generate databases unless ones of the same size exist"""
+    os.makedirs(directory, exist_ok=True)
+    paths = {
+        "films": os.path.join(directory, f"films_{films}.db"),
+        "subscriptions": os.path.join(
+            directory, f"subscriptions_{users}_{sponsors}.db"
+        ),
+    }
+    rng = random.Random(0)
+    if not os.path.exists(paths["films"]):
+        await generate_films(paths["films"], films, rng)
+    if not os.path.exists(paths["subscriptions"]):
+        await generate_subscriptions(paths["subscriptions"], users, sponsors, rng)
+    return paths
+
+
+def percentile(quantiles: List[float], p: int) -> float:
+    return round(quantiles[p - 1] * 1000, 3)
+
+
+async def measure(
+    name: str, operation: Operation, ops: int, concurrency: int
+) -> Dict[str, float | int | str]:
+    """Run operation ops times by concurrency tasks at once"""
+    latencies: List[float] = []
+    counter = iter(range(ops))
+
+    async def worker() -> None:
+        for i in counter:
+            started = time.perf_counter()
+            await operation(i)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "name": name,
+        "concurrency": concurrency,
+        "ops": ops,
+        "ops_per_sec": round(ops / elapsed, 1),
+        "p50_ms": percentile(quantiles, 50),
+        "p95_ms": percentile(quantiles, 95),
+        "p99_ms": percentile(quantiles, 99),
+        "max_ms": round(max(latencies) * 1000, 3),
+    }
+
+
+def operations(
+    films_db: AsyncFilmDatabase,
+    cached_films_db: AsyncFilmDatabase,
+    subs_db: AsyncSubscribitions,
+    films: int,
+    users: int,
+    ops: int,
+) -> Dict[str, Tuple[Operation, int]]:
+    rng = random.Random(1)
+
+    def film_code(_: int) -> int:
+        # 5% of requests ask for codes which do not exist
+        return rng.randint(1, int(films * 1.05))
+
+    def user_id(_: int) -> int:
+        # 5% of users are new
+        return rng.randint(1, int(users * 1.05))
+
+    async def get_film(i: int) -> object:
+        return await films_db.get_film(film_code(i))
+
+    async def get_film_cached(i: int) -> object:
+        return await cached_films_db.get_film(film_code(i))
+
+    async def is_subscribed_to_all(i: int) -> object:
+        return await subs_db.is_subscribed_to_all(user_id(i))
+
+    async def update_subscription_status(i: int) -> object:
+        return await subs_db._update_subscription_status(user_id(i), i % 2 == 0)
+
+    async def get_sponsors(_: int) -> object:
+        return await subs_db.get_sponsors()
+
+    async def list_films(i: int) -> object:
+        # keyset page anywhere in the table
+        return await films_db.list_films(after=film_code(i))
+
+    async def sponsor_change(i: int) -> object:
+        # every change fires the generation trigger
+        if i % 2 == 0:
+            return await subs_db.add_sponsor(f"@bench_{i // 2}")
+        return await subs_db.remove_sponsor(f"@bench_{i // 2}")
+
+    return {
+        "get_film": (get_film, ops),
+        "get_film_cached": (get_film_cached, ops),
+        "is_subscribed_to_all": (is_subscribed_to_all, ops),
+        "_update_subscription_status": (update_subscription_status, ops),
+        "get_sponsors": (get_sponsors, ops),
+        "list_films": (list_films, ops),
+        "sponsor_change": (sponsor_change, max(ops // 10, 10)),
+    }
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """Find results which are slower than baseline by more than tolerance"""
+    previous = {(r["name"], r["concurrency"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get((result["name"], result["concurrency"]))
+        if old is None:
+            continue
+        if result["ops_per_sec"] < old["ops_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{result['name']} x{result['concurrency']}: ops/sec "
+                f"{old['ops_per_sec']} -> {result['ops_per_sec']}"
+            )
+        if result["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{result['name']} x{result['concurrency']}: p95 "
+                f"{old['p95_ms']}ms -> {result['p95_ms']}ms"
+            )
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    started = time.perf_counter()
+    paths = await prepare(args.dir, args.films, args.users, args.sponsors)
+    prepared_in = time.perf_counter() - started
+
+    films_db = AsyncFilmDatabase(paths["films"])
+    cached_films_db = AsyncFilmDatabase(paths["films"], cache=True)
+    subs_db = AsyncSubscribitions(paths["subscriptions"])
+    benchmarks = operations(
+        films_db, cached_films_db, subs_db, args.films, args.users, args.ops
+    )
+    selected = args.only or list(benchmarks)
+
+    results = []
+    try:
+        await Database.connect_all()
+        for name in selected:
+            operation, ops = benchmarks[name]
+            for concurrency in args.concurrency:
+                result = await measure(name, operation, ops, concurrency)
+                results.append(result)
+                print(
+                    f"{name} x{concurrency}: {result['ops_per_sec']} ops/s, "
+                    f"p95 {result['p95_ms']}ms",
+                    file=sys.stderr,
+                )
+    finally:
+        await Database.close_all()
+
+    return {
+        "dataset": {
+            "films": args.films,
+            "users": args.users,
+            "sponsors": args.sponsors,
+            "prepared_in_sec": round(prepared_in, 1),
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark database layer")
+    parser.add_argument("--films", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--sponsors", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument(
+        "--ops", type=int, default=2000, help="operations per benchmark"
+    )
+    parser.add_argument(
+        "--only", nargs="+", help="names of benchmarks to run, all by default"
+    )
+    parser.add_argument(
+        "--dir", default="bench_data", help="where generated databases are kept"
+    )
+    parser.add_argument("--output", help="write JSON to file instead of stdout")
+    parser.add_argument("--baseline", help="JSON result of a previous run")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed slowdown against baseline, defaults to 0.2",
+    )
+    args = parser.parse_args()
+
+    # stdout is kept for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(
+                report["results"], json.load(file)["results"], args.tolerance
+            )
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,508 @@
+"""End-to-end load test of the bot against a fake Telegram Bot API
+
+Starts benchmarks.fake_telegram on localhost, points config.bot at it and
+feeds the dispatcher of main.py with scripted sessions (film code lookups,
+/start, check_subs callbacks, /search and admin flows) arriving at a fixed
+rate. Updates are delivered by getUpdates (polling mode, processed the way
+supervisor workers do), posted to the webhook handler or received by
+supervisor.py with --workers worker processes (supervisor mode). Every step
+of a session waits for the previous one, so for every update the harness
+measures time to the first reply and time until processing is finished.
+In supervisor mode processing happens in workers, so a step is finished by
+its first reply. The report is printed as JSON.
+
+Databases are created in --dir, the current ones are never touched.
+Outbound rate limits are lifted unless --telegram-limits is given.
+
+Usage:
+    python -m benchmarks.e2e_load [--mode polling|webhook|supervisor]
+        [--workers 2] [--rate 100]
+        [--duration 30] [--users 10000] [--admins 2] [--films 10000]
+        [--sponsors 3] [--mix code=70,start=10,check_subs=10,search=6,add_film=3,sponsor=1]
+        [--member-ratio 0.9] [--latency 0.02] [--member-latency 0.05]
+        [--jitter 0.01] [--max-rate 0] [--telegram-limits]
+        [--dir e2e_data] [--output result.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict, deque
+from typing import Any, Callable, Dict, List, Tuple
+
+from .db_benchmark import WORDS, percentile
+from .fake_telegram import FakeTelegram
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_BASE = 1_000_000_000
+
+Update = Dict[str, Any]
+Script = List[Tuple[str, Update]]
+
+
+class Step:
+    __slots__ = ("kind", "sent_at", "first_reply_at", "replied")
+
+    def __init__(self, kind: str) -> None:
+        self.kind = kind
+        self.sent_at = time.perf_counter()
+        self.first_reply_at: float | None = None
+        self.replied = asyncio.Event()
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+
+def message(user_id: int, text: str) -> Update:
+    return {
+        "message": {
+            "message_id": random.randint(1, 2**31),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": text,
+        }
+    }
+
+
+def callback(user_id: int, data: str, number: int) -> Update:
+    return {
+        "callback_query": {
+            # user id is kept in the query id to find the chat of the answer
+            "id": f"{user_id}-{number}",
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bot"},
+                "text": "Press the button to update your subscriptions",
+            },
+        }
+    }
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace, fake: FakeTelegram) -> None:
+        self.args = args
+        self.fake = fake
+        self.deliver: Callable[[Update], Any] | None = None
+        self.mix = self._parse_mix(args.mix)
+        self.free_users = deque(random.sample(range(1, args.users + 1), args.users))
+        self.free_admins = deque(range(ADMIN_BASE, ADMIN_BASE + args.admins))
+        self.new_codes = itertools.count(args.films + 1)
+        self.numbers = itertools.count()
+        self.steps: Dict[int, Step] = {}
+        self.latencies: Dict[str, List[Tuple[float | None, float]]] = defaultdict(list)
+        self.timeouts: Counter = Counter()
+        self.sessions = 0
+        self.dropped = 0
+        fake.on_reply = self.on_reply
+
+    @staticmethod
+    def _parse_mix(mix: str) -> Dict[str, float]:
+        weights = {}
+        for item in mix.split(","):
+            name, _, weight = item.partition("=")
+            if name not in SCENARIOS:
+                raise SystemExit(
+                    f"Unknown scenario {name!r}, use {', '.join(SCENARIOS)}"
+                )
+            weights[name] = float(weight or 1)
+        return weights
+
+    def on_reply(self, method: str, params: Dict[str, Any]) -> None:
+        chat = (
+            params.get("chat_id") or params.get("callback_query_id", "").split("-")[0]
+        )
+        try:
+            step = self.steps.get(int(chat))
+        except ValueError:
+            return
+        if step is not None and step.first_reply_at is None:
+            step.first_reply_at = time.perf_counter()
+            step.replied.set()
+
+    async def run_step(self, kind: str, update: Update, chat_id: int) -> None:
+        step = self.steps[chat_id] = Step(kind)
+        try:
+            await asyncio.wait_for(self.deliver(update), self.args.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts[kind] += 1
+            return
+        finally:
+            del self.steps[chat_id]
+        first_reply = (
+            step.first_reply_at - step.sent_at if step.first_reply_at else None
+        )
+        self.latencies[kind].append((first_reply, time.perf_counter() - step.sent_at))
+
+    async def run_session(self, name: str) -> None:
+        admin, script = SCENARIOS[name]
+        pool = self.free_admins if admin else self.free_users
+        if not pool:
+            self.dropped += 1
+            return
+        self.sessions += 1
+        user_id = pool.popleft()
+        try:
+            for kind, update in script(self, user_id):
+                await self.run_step(kind, update, user_id)
+        finally:
+            pool.append(user_id)
+
+    async def generate(self) -> float:
+        """Start sessions at args.rate per second for args.duration seconds
+
+        :return: seconds until the last session finished
+        """
+        names, weights = list(self.mix), list(self.mix.values())
+        tasks = []
+        started = time.perf_counter()
+        for n in itertools.count():
+            if time.perf_counter() - started >= self.args.duration:
+                break
+            name = random.choices(names, weights)[0]
+            tasks.append(asyncio.create_task(self.run_session(name)))
+            delay = started + (n + 1) / self.args.rate - time.perf_counter()
+            await asyncio.sleep(max(delay, 0))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        steps = {}
+        for kind in sorted(set(self.latencies) | set(self.timeouts)):
+            samples = self.latencies[kind]
+            first = [first for first, _ in samples if first is not None]
+            done = [done for _, done in samples]
+            steps[kind] = {
+                "count": len(samples),
+                "timeouts": self.timeouts[kind],
+                "no_reply": len(samples) - len(first),
+                "first_reply": _summary(first),
+                "done": _summary(done),
+            }
+        updates = sum(len(samples) for samples in self.latencies.values())
+        return {
+            "mode": self.args.mode,
+            "offered_sessions_per_sec": self.args.rate,
+            "duration_sec": round(elapsed, 2),
+            "sessions": self.sessions,
+            "dropped_sessions": self.dropped,
+            "updates": updates,
+            "updates_per_sec": round(updates / elapsed, 1),
+            "steps": steps,
+            "api_calls": dict(self.fake.calls),
+            "flood_errors": self.fake.flood_errors,
+        }
+
+
+def _summary(latencies: List[float]) -> Dict[str, float] | None:
+    if len(latencies) < 2:
+        return None
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50_ms": percentile(quantiles, 50),
+        "p95_ms": percentile(quantiles, 95),
+        "p99_ms": percentile(quantiles, 99),
+        "max_ms": round(max(latencies) * 1000, 3),
+    }
+
+
+def _code(test: LoadTest, user_id: int) -> Script:
+    # 5% of codes do not exist
+    code = random.randint(1, int(test.args.films * 1.05) or 1)
+    return [("code", message(user_id, str(code)))]
+
+
+def _start(test: LoadTest, user_id: int) -> Script:
+    return [("start", message(user_id, "/start"))]
+
+
+def _check_subs(test: LoadTest, user_id: int) -> Script:
+    return [("check_subs", callback(user_id, "check_subs", next(test.numbers)))]
+
+
+def _search(test: LoadTest, user_id: int) -> Script:
+    return [("search", message(user_id, f"/search {random.choice(WORDS)}"))]
+
+
+def _add_film(test: LoadTest, user_id: int) -> Script:
+    steps = (
+        "/add_film",
+        str(next(test.new_codes)),
+        "Load Test",
+        "Load Director",
+        "2000",
+        "Added by the load test",
+        "skip",
+    )
+    return [(f"add_film:{i}", message(user_id, text)) for i, text in enumerate(steps)]
+
+
+def _sponsor(test: LoadTest, user_id: int) -> Script:
+    channel = f"@load_{next(test.numbers)}"
+    steps = ("/add_sponsor", channel, "q", "/remove_sponsor", channel, "q")
+    return [(f"sponsor:{i}", message(user_id, text)) for i, text in enumerate(steps)]
+
+
+def _export(test: LoadTest, user_id: int) -> Script:
+    return [("export", message(user_id, "/export_films"))]
+
+
+# name -> (sent by admin, script)
+SCENARIOS: Dict[str, Tuple[bool, Callable[[LoadTest, int], Script]]] = {
+    "code": (False, _code),
+    "start": (False, _start),
+    "check_subs": (False, _check_subs),
+    "search": (False, _search),
+    "add_film": (True, _add_film),
+    "sponsor": (True, _sponsor),
+    "export": (True, _export),
+}
+
+
+def configure(args: argparse.Namespace, base_url: str) -> None:
+    """Prepare environment and config before the bot is imported"""
+    os.makedirs(args.dir, exist_ok=True)
+    os.chdir(args.dir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.environ["TGToken"] = "123456:load-test"
+    os.environ["FSM_STORAGE"] = args.fsm_storage
+    # worker processes of supervisor mode read them on import of config
+    os.environ["TELEGRAM_API_URL"] = base_url
+    os.environ["ADMIN_IDS"] = ",".join(
+        str(user_id) for user_id in range(ADMIN_BASE, ADMIN_BASE + args.admins)
+    )
+    os.environ["WORKERS"] = str(args.workers)
+    os.environ.setdefault("METRICS_PORT", "0")
+    if not args.telegram_limits:
+        for name in ("OUTBOUND_RATE", "OUTBOUND_CHAT_RATE", "OUTBOUND_GROUP_RATE"):
+            os.environ[name] = "1000000"
+        os.environ["OUTBOUND_CHAT_BURST"] = "1000"
+
+
+async def seed(films: int, sponsors: int) -> None:
+    from handlers import film_code, subscribed
+
+    rng = random.Random(0)
+    rows = [
+        (
+            code,
+            " ".join(rng.choice(WORDS) for _ in range(3)).title(),
+            rng.choice(WORDS).title(),
+            rng.randint(1950, 2024),
+            " ".join(rng.choice(WORDS) for _ in range(20)),
+        )
+        for code in range(1, films + 1)
+    ]
+    await film_code.films_db.add_films(rows, replace=True)
+    film_code.films_db.reset_cache()
+    for i in range(sponsors):
+        if not await subscribed.db.is_in(f"@sponsor_{i}"):
+            await subscribed.db.add_sponsor(f"@sponsor_{i}")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    fake = FakeTelegram(
+        args.member_ratio, args.latency, args.member_latency, args.jitter, args.max_rate
+    )
+    base_url = await fake.start()
+    configure(args, base_url)
+    if args.mode == "supervisor":
+        return await run_supervisor(args, fake)
+
+    import main
+    from aiogram import Bot, Dispatcher, types
+    from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY, BaseResponse
+    from aiohttp import web
+
+    from config import WEBHOOK_PATH
+    from webhook import LimitedWebhookRequestHandler
+
+    dp = main.dp
+    Dispatcher.set_current(dp)
+    Bot.set_current(dp.bot)
+    await main.on_startup(dp)
+    await seed(args.films, args.sponsors)
+    test = LoadTest(args, fake)
+
+    pending: Dict[int, asyncio.Future] = {}
+    background = set()
+    runner = None
+
+    async def process(data: Update) -> None:
+        try:
+            results = await dp.updates_handler.notify(types.Update(**data))
+            for result in results:
+                for response in result or ():
+                    if isinstance(response, BaseResponse):
+                        await response.execute_response(dp.bot)
+        finally:
+            future = pending.pop(data["update_id"], None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def poll() -> None:
+        offset = 0
+        while True:
+            updates = await dp.bot.request(
+                "getUpdates", {"offset": offset, "timeout": 1}
+            )
+            for data in updates:
+                offset = data["update_id"] + 1
+                task = asyncio.create_task(process(data))
+                background.add(task)
+                task.add_done_callback(background.discard)
+
+    async def deliver_polling(update: Update) -> None:
+        future = asyncio.get_running_loop().create_future()
+        pending[fake.push_update(update)] = future
+        await future
+
+    if args.mode == "polling":
+        poller = asyncio.create_task(poll())
+        test.deliver = deliver_polling
+    else:
+        app = web.Application()
+        app.router.add_route("*", WEBHOOK_PATH, LimitedWebhookRequestHandler)
+        app[BOT_DISPATCHER_KEY] = dp
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = f"http://127.0.0.1:{runner.addresses[0][1]}{WEBHOOK_PATH}"
+        test.deliver = lambda update: fake.deliver(url, update)
+
+    try:
+        elapsed = await test.generate()
+    finally:
+        if args.mode == "polling":
+            poller.cancel()
+        elif runner is not None:
+            await runner.cleanup()
+        await asyncio.gather(*background, return_exceptions=True)
+        await main.on_shutdown(dp)
+        await dp.storage.close()
+        await (await dp.bot.get_session()).close()
+        await fake.stop()
+    return test.report(elapsed)
+
+
+async def run_supervisor(
+    args: argparse.Namespace, fake: FakeTelegram
+) -> Dict[str, Any]:
+    """Run the load against supervisor.py and its worker processes"""
+    from database import Database
+    from supervisor import Supervisor, shard_key
+
+    await Database.connect_all()
+    await seed(args.films, args.sponsors)
+    await Database.close_all()
+    test = LoadTest(args, fake)
+
+    async def deliver(update: Update) -> None:
+        step = test.steps[shard_key(update)]
+        fake.push_update(update)
+        await step.replied.wait()
+
+    test.deliver = deliver
+    supervisor = Supervisor(args.workers)
+    running = asyncio.create_task(supervisor.run())
+    try:
+        # one session per worker, so workers have started when the load does
+        spare_users = range(args.users + 1, args.users + 1 + args.workers)
+        await asyncio.gather(
+            *(
+                test.run_step("warmup", message(user_id, "/start"), user_id)
+                for user_id in spare_users
+            )
+        )
+        test.latencies.clear()
+        test.timeouts.clear()
+        elapsed = await test.generate()
+    finally:
+        supervisor._stopped.set()
+        await running
+        await fake.stop()
+    return test.report(elapsed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end load test of the bot")
+    parser.add_argument(
+        "--mode", choices=("polling", "webhook", "supervisor"), default="polling"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=2, help="worker processes of supervisor mode"
+    )
+    parser.add_argument("--rate", type=float, default=100, help="sessions per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--admins", type=int, default=2)
+    parser.add_argument("--films", type=int, default=10_000)
+    parser.add_argument("--sponsors", type=int, default=3)
+    parser.add_argument(
+        "--mix",
+        default="code=70,start=10,check_subs=10,search=6,add_film=3,sponsor=1",
+        help="scenario weights, names: " + ", ".join(SCENARIOS),
+    )
+    parser.add_argument(
+        "--member-ratio", type=float, default=0.9, help="share of channel members"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="seconds every API call takes"
+    )
+    parser.add_argument(
+        "--member-latency",
+        type=float,
+        default=0.05,
+        help="extra seconds getChatMember takes",
+    )
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument(
+        "--max-rate",
+        type=int,
+        default=0,
+        help="replies per second before the fake API floods, 0 is unlimited",
+    )
+    parser.add_argument(
+        "--telegram-limits",
+        action="store_true",
+        help="keep outbound rate limits of config",
+    )
+    parser.add_argument("--fsm-storage", choices=("memory", "sqlite"), default="sqlite")
+    parser.add_argument(
+        "--timeout", type=float, default=30, help="seconds to wait for one update"
+    )
+    parser.add_argument(
+        "--dir", default="e2e_data", help="where databases of the test are kept"
+    )
+    parser.add_argument("--output", help="write JSON to file instead of stdout")
+    args = parser.parse_args()
+    args.dir = os.path.abspath(args.dir)
+    output = os.path.abspath(args.output) if args.output else None
+
+    # stdout is kept for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = asyncio.run(run(args))
+    result = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as file:
+            file.write(result)
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""Local stand-in for the Telegram Bot API
+
+Implements the methods used by the bot well enough for load testing:
+getUpdates serves updates pushed by the test, messages get fake ids,
+getChatMember answers from a deterministic membership table, and every
+call may be delayed. Outgoing replies are reported to on_reply.
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List
+
+from aiohttp import ClientSession, web
+
+# Methods which answer to a user
+REPLY_METHODS = {
+    "sendMessage",
+    "sendDocument",
+    "sendPhoto",
+    "sendVideo",
+    "editMessageText",
+    "answerCallbackQuery",
+    "answerInlineQuery",
+}
+
+ReplyListener = Callable[[str, Dict[str, Any]], None]
+
+
+class FakeTelegram:
+    """Fake Bot API server
+
+    :param member_ratio: share of (channel, user) pairs which are members
+    :param latency: seconds every call takes
+    :param member_latency: extra seconds getChatMember takes
+    :param jitter: random extra seconds up to this value
+    :param max_rate: messages per second before answering with 429, 0 is
+        unlimited
+    """
+
+    def __init__(
+        self,
+        member_ratio: float = 0.9,
+        latency: float = 0.0,
+        member_latency: float = 0.0,
+        jitter: float = 0.0,
+        max_rate: int = 0,
+    ) -> None:
+        self.member_ratio = member_ratio
+        self.latency = latency
+        self.member_latency = member_latency
+        self.jitter = jitter
+        self.max_rate = max_rate
+        self.calls: Counter = Counter()
+        self.flood_errors = 0
+        self.on_reply: ReplyListener | None = None
+        self._updates: List[Dict[str, Any]] = []
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._second = 0
+        self._sent_in_second = 0
+        self._runner: web.AppRunner | None = None
+        self._session: ClientSession | None = None
+
+    def push_update(self, update: Dict[str, Any]) -> int:
+        """Queue update for getUpdates
+
+        :return: assigned update_id
+        """
+        update["update_id"] = next(self._update_ids)
+        self._updates.append(update)
+        self._new_updates.set()
+        return update["update_id"]
+
+    def is_member(self, chat_id: str, user_id: int) -> bool:
+        digest = hashlib.blake2s(f"{chat_id}:{user_id}".encode()).digest()
+        return int.from_bytes(digest[:4], "big") < self.member_ratio * 2**32
+
+    def _message(self, chat_id: Any, text: str = "") -> Dict[str, Any]:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "Bot"},
+            "text": text,
+        }
+
+    def _flooded(self) -> bool:
+        if not self.max_rate:
+            return False
+        second = int(time.monotonic())
+        if second != self._second:
+            self._second, self._sent_in_second = second, 0
+        self._sent_in_second += 1
+        return self._sent_in_second > self.max_rate
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(
+                    self._new_updates.wait(), float(params.get("timeout") or 0)
+                )
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bot", "username": "bot"}
+        if method == "getChatMember":
+            user_id = int(params["user_id"])
+            member = self.is_member(params["chat_id"], user_id)
+            return {
+                "status": "member" if member else "left",
+                "user": {"id": user_id, "is_bot": False, "first_name": "User"},
+            }
+        if method.startswith("send") or method == "editMessageText":
+            message = self._message(params.get("chat_id", 0), params.get("text", ""))
+            file_id = f"file_{message['message_id']}"
+            if method == "sendPhoto":
+                message["photo"] = [
+                    {
+                        "file_id": file_id,
+                        "file_unique_id": file_id,
+                        "width": 1,
+                        "height": 1,
+                    }
+                ]
+            elif method == "sendVideo":
+                message["video"] = {
+                    "file_id": file_id,
+                    "file_unique_id": file_id,
+                    "width": 1,
+                    "height": 1,
+                    "duration": 1,
+                }
+            return message
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            return web.json_response(
+                {"ok": True, "result": await self._get_updates(params)}
+            )
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if method == "getChatMember":
+            delay += self.member_latency
+        if delay:
+            await asyncio.sleep(delay)
+
+        if method in REPLY_METHODS and self._flooded():
+            self.flood_errors += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                },
+                status=429,
+            )
+        if method in REPLY_METHODS and self.on_reply is not None:
+            self.on_reply(method, params)
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving
+
+        :return: base url to pass to TelegramAPIServer.from_base
+        """
+        app = web.Application(client_max_size=64 * 1024**2)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"http://{host}:{port}"
+
+    async def deliver(self, url: str, update: Dict[str, Any]) -> None:
+        """Post update to webhook like Telegram does
+
+        A method returned in the webhook response is executed as a reply.
+        """
+        if self._session is None:
+            self._session = ClientSession()
+        update["update_id"] = next(self._update_ids)
+        async with self._session.post(url, json=update) as response:
+            body = await response.read()
+        if response.content_type != "application/json":
+            return
+        params = json.loads(body)
+        method = params.pop("method", None)
+        if method is not None:
+            self.calls[method] += 1
+            if method in REPLY_METHODS and self.on_reply is not None:
+                self.on_reply(method, params)
+
+    async def stop(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -1,10 +1,129 @@
 import os
 
-from aiogram import Bot
+from aiogram.bot.api import TELEGRAM_PRODUCTION, TelegramAPIServer
 from dotenv import load_dotenv
 
+from outbound import OutboundScheduler, ScheduledBot
+
 load_dotenv()
 DEBUG = os.getenv("DEBUG", 0)
-bot = Bot(token=os.getenv("TGToken"))
 
-ADMIN_IDS = (None,)
+# Records are written as JSON lines, the file is rotated after LOG_MAX_BYTES.
+# Every worker process writes its own file with the worker index appended
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", 5))
+# Share of records kept per level, e.g. "DEBUG=0.01,INFO=0.5"
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10_000))
+
+# Number of processes sharing the bot, set by supervisor.py for its workers.
+# Limits of the whole bot below are split between them equally
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", 1))
+
+# Limits of outgoing messages: Telegram allows about 30 per second in total,
+# about one per second in a private chat and 20 per minute in a group
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", 30)) / WORKER_PROCESSES
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", 1))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", 3))
+OUTBOUND_GROUP_RATE = float(os.getenv("OUTBOUND_GROUP_RATE", 20 / 60))
+# Number of API requests made at the same time
+OUTBOUND_CONCURRENCY = int(os.getenv("OUTBOUND_CONCURRENCY", 20))
+
+# Base url of a local Bot API server, e.g. "http://localhost:8081"
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+bot = ScheduledBot(
+    token=os.getenv("TGToken"),
+    server=(
+        TelegramAPIServer.from_base(TELEGRAM_API_URL)
+        if TELEGRAM_API_URL
+        else TELEGRAM_PRODUCTION
+    ),
+    scheduler=OutboundScheduler(
+        OUTBOUND_RATE,
+        OUTBOUND_CHAT_RATE,
+        OUTBOUND_CHAT_BURST,
+        OUTBOUND_GROUP_RATE,
+        OUTBOUND_CONCURRENCY,
+    ),
+)
+
+# Comma separated user ids
+ADMIN_IDS = tuple(
+    int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id
+) or (None,)
+
+MEMBER_CACHE_TTL = float(os.getenv("MEMBER_CACHE_TTL", 300))
+NONMEMBER_CACHE_TTL = float(os.getenv("NONMEMBER_CACHE_TTL", 15))
+MEMBER_CACHE_SIZE = int(os.getenv("MEMBER_CACHE_SIZE", 100_000))
+# Membership in sponsor channels is saved from chat_member updates and from
+# checks in Telegram. Records older than this are checked in Telegram again,
+# as updates sent while the bot was down are skipped
+MEMBER_RECORD_TTL = float(os.getenv("MEMBER_RECORD_TTL", 24 * 3600))
+
+# Events of film lookups and subscription gate are counted in hourly buckets
+ANALYTICS_DB_FILE = os.getenv("ANALYTICS_DB_FILE", "analytics.db")
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", 30))
+ANALYTICS_RETENTION_DAYS = float(os.getenv("ANALYTICS_RETENTION_DAYS", 90))
+# Windows of /stats without arguments and number of top films shown
+STATS_WINDOWS = os.getenv("STATS_WINDOWS", "24h,7d").split(",")
+STATS_TOP = int(os.getenv("STATS_TOP", 10))
+
+# Compressed snapshots of BACKUP_FILES are written to BACKUP_DIR every
+# BACKUP_INTERVAL seconds (0 disables) and by /backup, the newest BACKUP_KEEP
+# of every database are kept. BACKUP_PAGES pages are copied per step
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_FILES = os.getenv("BACKUP_FILES", "films.db,subscriptions.db").split(",")
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", 24 * 3600))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", 7))
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", 256))
+
+# Updates requested from Telegram. chat_member updates come only from chats
+# where the bot is an admin
+ALLOWED_UPDATES = ["message", "callback_query", "inline_query", "chat_member"]
+
+# "off", "lazy" or "preload"
+FILM_CACHE = os.getenv("FILM_CACHE", "lazy")
+
+# "polling" or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Public base url, e.g. "https://example.com". If empty, webhook is not
+# registered in Telegram and the server only accepts local requests
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", 8080))
+# Self-signed certificate and key. If empty, plain HTTP is served
+WEBHOOK_SSL_CERT = os.getenv("WEBHOOK_SSL_CERT", "")
+WEBHOOK_SSL_KEY = os.getenv("WEBHOOK_SSL_KEY", "")
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", 100))
+
+# "memory", "sqlite" or "redis"
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_DB_FILE = os.getenv("FSM_DB_FILE", "fsm.db")
+FSM_TTL = float(os.getenv("FSM_TTL", 3600))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", 1.0))
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_DB = int(os.getenv("REDIS_DB", 0))
+
+# Number of worker processes started by supervisor.py
+WORKERS = int(os.getenv("WORKERS", os.cpu_count() or 1))
+
+# Seconds Telegram and the bot keep inline query results
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 300))
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", 10_000))
+
+# Messages per second sent by broadcasts, the rest of OUTBOUND_RATE is left
+# for replies to users
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25)) / WORKER_PROCESSES
+
+# Default number of times one user may trigger a handler per period (seconds)
+THROTTLE_LIMIT = int(os.getenv("THROTTLE_LIMIT", 10))
+THROTTLE_PERIOD = float(os.getenv("THROTTLE_PERIOD", 10))
+
+# Prometheus metrics are served at http://METRICS_HOST:METRICS_PORT/metrics,
+# worker processes of supervisor.py use the following ports. 0 disables
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
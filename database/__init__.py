@@ -1 +1,5 @@
+from .analytics import AsyncAnalytics
+from .backup import backup_database
+from .base import Database
 from .db_utils import *
+from .fsm_storage import SQLiteStorage
@@ -0,0 +1,175 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Dict, List, Set, Tuple
+
+import aiosqlite
+
+from metrics import query_timer
+from .base import Database, Migration
+
+# (bucket start, event, key)
+EventKey = Tuple[int, str, str]
+
+# key of events over max_keys in one bucket
+OTHER = "*"
+# seconds between deletions of buckets older than retention
+PRUNE_INTERVAL = 3600
+
+
+class AsyncAnalytics(Database):
+    """Counters of bot events aggregated in time buckets
+
+    record() only increments an in-memory counter. Counters are added to
+    the stored buckets in one transaction flush_interval seconds after the
+    first event and on close, so requests never write to the database.
+    Buckets older than retention seconds are deleted by a flush once per
+    PRUNE_INTERVAL.
+    """
+
+    def __init__(
+        self,
+        db_file: str = "analytics.db",
+        name: str = "stats",
+        bucket_size: int = 3600,
+        flush_interval: float = 30.0,
+        retention: float = 90 * 24 * 3600,
+        max_keys: int = 1000,
+    ) -> None:
+        """Create analytics database object
+
+        :param db_file: path to database file, defaults to "analytics.db"
+        :type db_file: str, optional
+        :param name: table's name, defaults to "stats"
+        :type name: str, optional
+        :param bucket_size: seconds in one bucket, defaults to 3600
+        :type bucket_size: int, optional
+        :param flush_interval: max seconds an event waits, defaults to 30.0
+        :type flush_interval: float, optional
+        :param retention: seconds buckets are kept, defaults to 90 days
+        :type retention: float, optional
+        :param max_keys: distinct keys of an event in one bucket, the rest
+            are counted under "*", defaults to 1000
+        :type max_keys: int, optional
+        """
+        super().__init__(db_file, pool_size=1)
+        self.name = name
+        self.bucket_size = bucket_size
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.max_keys = max_keys
+        self.columns = {
+            "event": "TEXT NOT NULL",
+            "bucket": "INTEGER NOT NULL",
+            "key": "TEXT NOT NULL",
+            "count": "INTEGER NOT NULL",
+            "PRIMARY KEY": "(event, bucket, key)",
+        }
+        self._pending: Counter = Counter()
+        # keys counted in the current bucket by event
+        self._bucket = 0
+        self._keys: Dict[str, Set[str]] = {}
+        self._pruned_at = 0.0
+        self._flush_task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def migrations(self) -> List[Migration]:
+        return [self._create_table, self._create_bucket_index]
+
+    async def _create_table(self, db: aiosqlite.Connection) -> None:
+        await self.init_database(db, self.name, self.columns)
+
+    async def _create_bucket_index(self, db: aiosqlite.Connection) -> None:
+        # totals and retention filter by bucket only
+        await db.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.name}_bucket ON {self.name} (bucket)"
+        )
+
+    def record(self, event: str, key: str = "") -> None:
+        """Count the event, e.g. record("film_hit", "42")"""
+        bucket = int(time.time()) // self.bucket_size * self.bucket_size
+        if bucket != self._bucket:
+            self._bucket = bucket
+            self._keys.clear()
+        keys = self._keys.setdefault(event, set())
+        if key not in keys:
+            if len(keys) >= self.max_keys:
+                # e.g. someone spams random codes
+                key = OTHER
+            else:
+                keys.add(key)
+        self._pending[(bucket, event, key)] += 1
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(
+                self._delayed_flush()
+            )
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        await asyncio.shield(self.flush())
+
+    @query_timer
+    async def flush(self) -> None:
+        """Add counted events to stored buckets in one transaction"""
+        async with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, Counter()
+            try:
+                async with self._connection() as db:
+                    await db.executemany(
+                        f"INSERT INTO {self.name} (bucket, event, key, count) "
+                        "VALUES (?, ?, ?, ?) ON CONFLICT(event, bucket, key) "
+                        "DO UPDATE SET count = count + excluded.count",
+                        [(*key, count) for key, count in pending.items()],
+                    )
+                    if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL:
+                        await db.execute(
+                            f"DELETE FROM {self.name} WHERE bucket < ?",
+                            (time.time() - self.retention,),
+                        )
+                        self._pruned_at = time.monotonic()
+                    await db.commit()
+            except Exception:
+                # count them with the next flush
+                self._pending.update(pending)
+                raise
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        await super().close()
+
+    def _since(self, window: float) -> int:
+        # the bucket the window starts in is counted whole
+        return int(time.time() - window) // self.bucket_size * self.bucket_size
+
+    @query_timer
+    async def totals(self, window: float) -> Dict[str, int]:
+        """Get number of every event in the last window seconds"""
+        async with self._connection() as db:
+            async with db.execute(
+                # without the hint SQLite scans the primary key to avoid sorting
+                f"SELECT event, SUM(count) FROM {self.name} "
+                f"INDEXED BY {self.name}_bucket WHERE bucket >= ? GROUP BY event",
+                (self._since(window),),
+            ) as cursor:
+                return {event: count async for event, count in cursor}
+
+    @query_timer
+    async def top(self, event: str, window: float, limit: int = 10) -> List[Tuple]:
+        """Get the most frequent keys of the event in the last window seconds
+
+        :return: (key, count) pairs ordered by count
+        :rtype: List[Tuple]
+        """
+        async with self._connection() as db:
+            async with db.execute(
+                f"SELECT key, SUM(count) AS total FROM {self.name} "
+                "WHERE event = ? AND bucket >= ? GROUP BY key "
+                "ORDER BY total DESC LIMIT ?",
+                (event, self._since(window), limit),
+            ) as cursor:
+                return list(await cursor.fetchall())
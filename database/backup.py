@@ -0,0 +1,122 @@
+"""Online backups of SQLite databases
+
+A snapshot is copied with SQLite backup API a few pages per step in a
+worker thread, so the event loop keeps running and the source is locked
+only for the duration of one step. The copy is compressed with gzip and
+moved to its final timestamped name only when complete, so a snapshot
+file is never torn. Old snapshots beyond retention are deleted.
+"""
+import asyncio
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import List
+
+from metrics import backup_seconds
+
+# extension of complete snapshots
+SUFFIX = ".db.gz"
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy(source: str, target: str, pages: int, pause: float, restarts: int) -> None:
+    """Copy database by steps of pages, sleeping pause seconds between them
+
+    A change of the source by another connection makes SQLite restart the
+    copy. After restarts restarts the copy is done in one step, which holds
+    a read transaction only; in WAL mode that does not block writers.
+    """
+    remaining_before = None
+    restarted = 0
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal remaining_before, restarted
+        if remaining_before is not None and remaining > remaining_before:
+            restarted += 1
+            if restarted > restarts:
+                raise _TooManyRestarts
+        remaining_before = remaining
+        # source is not locked between steps
+        time.sleep(pause)
+
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.execute("PRAGMA busy_timeout=5000")
+        try:
+            src.backup(dst, pages=pages, progress=progress)
+        except _TooManyRestarts:
+            src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _compress(source: str, target: str) -> None:
+    partial = target + ".partial"
+    with open(source, "rb") as raw, gzip.open(partial, "wb", compresslevel=6) as gz:
+        shutil.copyfileobj(raw, gz, 1024 * 1024)
+    os.replace(partial, target)
+
+
+def snapshots(directory: str, db_file: str) -> List[str]:
+    """Get snapshots of the database, the oldest first"""
+    stem = os.path.splitext(os.path.basename(db_file))[0]
+    return sorted(glob.glob(os.path.join(directory, f"{stem}-*{SUFFIX}")))
+
+
+def _prune(directory: str, db_file: str, keep: int) -> None:
+    for path in snapshots(directory, db_file)[:-keep] if keep > 0 else []:
+        os.remove(path)
+
+
+async def backup_database(
+    db_file: str,
+    directory: str,
+    keep: int = 7,
+    pages: int = 256,
+    pause: float = 0.005,
+    restarts: int = 3,
+) -> str:
+    """Write compressed snapshot of the database
+
+    :param db_file: path to database file
+    :type db_file: str
+    :param directory: where snapshots are kept, created if missing
+    :type directory: str
+    :param keep: number of the newest snapshots kept, defaults to 7
+    :type keep: int, optional
+    :param pages: pages copied per step, defaults to 256
+    :type pages: int, optional
+    :param pause: seconds between steps, defaults to 0.005
+    :type pause: float, optional
+    :param restarts: restarts of paged copy before copying in one step,
+        defaults to 3
+    :type restarts: int, optional
+    :return: path to the snapshot
+    :rtype: str
+    """
+    started = time.perf_counter()
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(db_file))[0]
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    target = os.path.join(directory, f"{stem}-{stamp}{SUFFIX}")
+    copy = os.path.join(directory, f".{stem}-{stamp}.db.tmp")
+
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, _copy, db_file, copy, pages, pause, restarts)
+        await loop.run_in_executor(None, _compress, copy, target)
+    finally:
+        if os.path.exists(copy):
+            os.remove(copy)
+    await loop.run_in_executor(None, _prune, directory, db_file, keep)
+    backup_seconds.observe(time.perf_counter() - started, stem)
+    return target
@@ -1,37 +1,188 @@
-import sqlite3
-from typing import Any, Dict, List
+import asyncio
+import functools
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
 
 import aiosqlite
 
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -16000,
+    "mmap_size": 64 * 1024 * 1024,
+    "busy_timeout": 5000,
+}
+
+# Schema change applied inside a transaction, see Database.migrations
+Migration = Callable[[aiosqlite.Connection], Awaitable[None]]
+
+
+@functools.lru_cache(maxsize=256)
+def _row_type(columns: Tuple[str, ...]) -> type:
+    """Get namedtuple class for rows with the columns"""
+    return namedtuple("Row", columns, rename=True)
+
 
 class Database:
     """
     Parent class for all databases
 
-    Call init.database() in class __init__ function initialize databases.
-    That function will create new tables with their columns and column
-    types if they are not exist.
+    Constructors do not touch the disk. Schema is created and upgraded by
+    migrations() when the connection pool is opened: every migration is
+    applied once, and the version reached is kept per table in
+    schema_migrations table.
+
+    Every database owns a pool of long-lived connections. Call
+    ``await Database.connect_all()`` on startup and
+    ``await Database.close_all()`` on shutdown; a pool that was not opened
+    explicitly is opened on first use.
+
+    Use Database.shared() to get the object of a database which is used
+    by the whole process, so handlers share its connections and caches.
     """
 
-    def __init__(self, db_file: str) -> None:
+    _instances: List["Database"] = []
+    _shared: Dict[Tuple[type, str, Tuple], "Database"] = {}
+
+    def __init__(self, db_file: str, pool_size: int = 2) -> None:
         self._db_file = db_file
+        self._pool_size = pool_size
+        self._pool: asyncio.Queue | None = None
+        self._connections: List[aiosqlite.Connection] = []
+        self._pool_lock = asyncio.Lock()
+        Database._instances.append(self)
+
+    @classmethod
+    def shared(cls, db_file: str, **kwargs):
+        """Get process-wide object of the database
+
+        Object is created on the first call, later calls with the same
+        arguments return it.
+
+        :param db_file: path to database file
+        :type db_file: str
+        """
+        key = (cls, db_file, tuple(sorted(kwargs.items())))
+        database = Database._shared.get(key)
+        if database is None:
+            database = Database._shared[key] = cls(db_file, **kwargs)
+        return database
+
+    @classmethod
+    async def connect_all(cls) -> None:
+        """Open connection pools and migrate schema of all created databases"""
+        for database in cls._instances:
+            await database.connect()
+
+    @classmethod
+    async def close_all(cls) -> None:
+        """Close connection pools of all created databases"""
+        for database in cls._instances:
+            await database.close()
+
+    async def connect(self) -> None:
+        """Open connection pool, apply pragmas and pending migrations"""
+        async with self._pool_lock:
+            if self._pool is not None:
+                return
+            pool = asyncio.Queue()
+            for _ in range(self._pool_size):
+                db = await aiosqlite.connect(self._db_file, cached_statements=256)
+                for pragma, value in PRAGMAS.items():
+                    await db.execute(f"PRAGMA {pragma}={value}")
+                self._connections.append(db)
+                pool.put_nowait(db)
+            await self._migrate(self._connections[0])
+            self._pool = pool
+
+    async def close(self) -> None:
+        """Close all pooled connections"""
+        async with self._pool_lock:
+            for db in self._connections:
+                await db.close()
+            self._connections.clear()
+            self._pool = None
+
+    @asynccontextmanager
+    async def _connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrow a warm connection from the pool
+
+        Uncommitted transaction is rolled back before the connection
+        goes back to the pool.
+        """
+        if self._pool is None:
+            await self.connect()
+        pool = self._pool
+        db = await pool.get()
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                await db.rollback()
+            pool.put_nowait(db)
+
+    def migrations(self) -> List[Migration]:
+        """Schema changes in order, version of a migration is its position
+
+        Append new migrations to the end and never change applied ones.
+        """
+        return []
+
+    async def _migrate(self, db: aiosqlite.Connection) -> None:
+        """Apply migrations newer than the version stored for self.name
+
+        Runs in one immediate transaction, so processes starting at the same
+        time wait for each other and a failed migration leaves no changes.
+        """
+        migrations = self.migrations()
+        if not migrations:
+            return
+        await db.execute(
+            "CREATE TABLE IF NOT EXISTS schema_migrations "
+            "(name TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            async with db.execute(
+                "SELECT version FROM schema_migrations WHERE name=?", (self.name,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            version = row[0] if row else 0
+            for migration in migrations[version:]:
+                await migration(db)
+            if len(migrations) > version:
+                await db.execute(
+                    "INSERT INTO schema_migrations (name, version) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET version=excluded.version",
+                    (self.name, len(migrations)),
+                )
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
 
-    def init_database(self, table_name: str, columns: dict) -> None:
+    @staticmethod
+    async def init_database(
+        db: aiosqlite.Connection, table_name: str, columns: dict
+    ) -> None:
         """Creates needed table if not exists
 
+        :param db: connection the migration runs in
+        :type db: aiosqlite.Connection
         :param table_name: name of table
         :type table_name: str
         :param columns: creates columns with their names and types
         :type columns: dict
         """
-        with sqlite3.connect(self._db_file) as db:
-            column_defs = ", ".join(
-                f"{col_name} {col_type}" for col_name, col_type in columns.items()
-            )
-            db.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({column_defs})")
+        column_defs = ", ".join(
+            f"{col_name} {col_type}" for col_name, col_type in columns.items()
+        )
+        await db.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({column_defs})")
 
     async def create_indexes(self, table_name: str, indexes: list) -> None:
-        async with aiosqlite.connect(self._db_file) as db:
+        async with self._connection() as db:
             for index_def in indexes:
                 await db.execute(
                     f"CREATE INDEX IF NOT EXISTS {table_name}_{index_def} ON {table_name} ({index_def})"
@@ -40,18 +191,17 @@ class Database:
             await db.commit()
 
     async def add_values(self, table_name: str, values: dict) -> None:
-        async with aiosqlite.connect(self._db_file) as db:
+        async with self._connection() as db:
             placeholders = ", ".join("?" for _ in values.values())
             columns = ", ".join(values.keys())
             query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-            print(query, tuple(values.values()))
             await db.execute(query, tuple(values.values()))
             await db.commit()
 
     async def remove_values(
         self, table_name: str, condition: str, values: tuple = None
     ) -> None:
-        async with aiosqlite.connect(self._db_file) as db:
+        async with self._connection() as db:
             query = f"DELETE FROM {table_name} WHERE {condition}"
             await db.execute(query, values)
             await db.commit()
@@ -63,12 +213,9 @@ class Database:
         values: tuple = None,
         target: str = "*",
     ) -> Dict[str, Any] | None:
-        async with aiosqlite.connect(self._db_file) as db:
-            query = (
-                f"SELECT {target} FROM {table_name}" + f" WHERE {condition}"
-                if condition
-                else ""
-            )
+        async with self._connection() as db:
+            query = f"SELECT {target} FROM {table_name}"
+            query += f" WHERE {condition}" if condition else ""
             async with db.execute(query, values) as cursor:
                 result = await cursor.fetchone()
                 if result is not None:
@@ -84,12 +231,97 @@ class Database:
         values: tuple = None,
         target: str = "*",
     ) -> List[Dict[str, Any]] | None:
-        async with aiosqlite.connect(self._db_file) as db:
+        async with self._connection() as db:
             query = f"SELECT {target} FROM {table_name}"
-            query += f"WHERE {condition}" if condition else ""
+            query += f" WHERE {condition}" if condition else ""
             async with db.execute(query, values) as cursor:
                 result = await cursor.fetchall()
                 if not result:
                     return None
                 columns = [description[0] for description in cursor.description]
                 return [dict(zip(columns, row)) for row in result]
+
+    async def get_page(
+        self,
+        table_name: str,
+        key: str,
+        after: Any = None,
+        before: Any = None,
+        limit: int = 100,
+        target: str = "*",
+        condition: str = None,
+        values: tuple = (),
+    ) -> List[Tuple]:
+        """Get rows ordered by key with keyset pagination
+
+        Query seeks to the key through its index, so every page costs the
+        same however far it is, unlike OFFSET.
+
+        :param table_name: name of table
+        :type table_name: str
+        :param key: unique indexed column, e.g. "code" or "user_id"
+        :type key: str
+        :param after: get rows with greater key, defaults to None
+        :type after: Any, optional
+        :param before: get the nearest rows with less key if after is None,
+            defaults to None
+        :type before: Any, optional
+        :param limit: max number of rows, defaults to 100
+        :type limit: int, optional
+        :param target: columns, key should be among them, defaults to "*"
+        :type target: str, optional
+        :param condition: extra WHERE condition, defaults to None
+        :type condition: str, optional
+        :param values: parameters of condition, defaults to ()
+        :type values: tuple, optional
+        :return: rows as namedtuples in ascending key order
+        :rtype: List[Tuple]
+        """
+        conditions = [f"({condition})"] if condition else []
+        params = list(values or ())
+        if after is not None:
+            conditions.append(f"{key} > ?")
+            params.append(after)
+        elif before is not None:
+            conditions.append(f"{key} < ?")
+            params.append(before)
+        backwards = after is None and before is not None
+        query = f"SELECT {target} FROM {table_name}"
+        query += f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        query += f" ORDER BY {key} {'DESC' if backwards else 'ASC'} LIMIT ?"
+        params.append(limit)
+        async with self._connection() as db:
+            async with db.execute(query, params) as cursor:
+                row_type = _row_type(tuple(d[0] for d in cursor.description))
+                rows = [row_type._make(row) for row in await cursor.fetchall()]
+        return rows[::-1] if backwards else rows
+
+    async def iter_items(
+        self,
+        table_name: str,
+        key: str,
+        target: str = "*",
+        condition: str = None,
+        values: tuple = (),
+        after: Any = None,
+        chunk_size: int = 1000,
+    ) -> AsyncIterator[List[Tuple]]:
+        """Stream rows ordered by key in chunks
+
+        Every chunk is a separate keyset query (see get_page), so memory use
+        does not depend on table size, no connection is held between chunks
+        and iteration can be resumed from any key.
+
+        :param after: skip rows with less or equal key, defaults to None
+        :type after: Any, optional
+        :param chunk_size: rows per chunk, defaults to 1000
+        :type chunk_size: int, optional
+        """
+        while True:
+            rows = await self.get_page(
+                table_name, key, after, None, chunk_size, target, condition, values
+            )
+            if not rows:
+                return
+            yield rows
+            after = getattr(rows[-1], key)
@@ -1,9 +1,86 @@
-import sqlite3
-from typing import Dict, List
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from typing import Any, AsyncIterator, Dict, Iterable, List, Tuple
 
 import aiosqlite
 
-from .base import Database
+from metrics import cache_requests_total, query_timer
+from .base import Database, Migration
+
+
+@dataclass(slots=True, frozen=True)
+class Film:
+    code: int
+    title: str
+    director: str
+    year: int
+    description: str
+    # "photo" or "video"
+    media_type: str | None = None
+    # Telegram file_id, known after the first upload
+    media_file_id: str | None = None
+    # url or local path to upload from
+    media_source: str | None = None
+
+
+FILM_COLUMNS = tuple(field.name for field in fields(Film))
+
+
+class FilmCatalog:
+    """In-process copy of films table
+
+    One catalog is shared by all AsyncFilmDatabase objects of the same table,
+    so invalidation from the admin handlers is seen by the lookup handlers.
+    Unknown codes are remembered in a bounded LRU to keep code spam cheap.
+    They expire after missing_ttl seconds, as a film may be added by another
+    process, and are never taken for granted even after preload.
+    """
+
+    def __init__(self, max_missing: int = 10_000, missing_ttl: float = 60) -> None:
+        self.films: Dict[int, Film] = {}
+        # code -> monotonic time when the miss expires
+        self.missing: OrderedDict[int, float] = OrderedDict()
+        self.max_missing = max_missing
+        self.missing_ttl = missing_ttl
+
+    def get(self, code: int) -> Tuple[bool, Film | None]:
+        """Look the code up
+
+        :return: (found in cache, film or None)
+        :rtype: Tuple[bool, Film | None]
+        """
+        film = self.films.get(code)
+        if film is not None:
+            return True, film
+        expires = self.missing.get(code)
+        if expires is None:
+            return False, None
+        if expires <= time.monotonic():
+            del self.missing[code]
+            return False, None
+        self.missing.move_to_end(code)
+        return True, None
+
+    def put(self, code: int, film: Film | None) -> None:
+        if film is not None:
+            self.films[code] = film
+            self.missing.pop(code, None)
+            return
+        self.missing[code] = time.monotonic() + self.missing_ttl
+        self.missing.move_to_end(code)
+        while len(self.missing) > self.max_missing:
+            self.missing.popitem(last=False)
+
+    def invalidate(self, code: int) -> None:
+        self.films.pop(code, None)
+        self.missing.pop(code, None)
+
+    def clear(self) -> None:
+        self.films.clear()
+        self.missing.clear()
 
 
 class AsyncFilmDatabase(Database):
@@ -13,15 +90,24 @@ class AsyncFilmDatabase(Database):
     :type Database: Database
     """
 
-    def __init__(self, db_file: str = "films.db", name: str = "films") -> None:
+    _catalogs: Dict[Tuple[str, str], FilmCatalog] = {}
+
+    def __init__(
+        self, db_file: str = "films.db", name: str = "films", cache: bool = False
+    ) -> None:
         """Create films database object
 
         :param db_file: path to database, defaults to "films.db"
         :type db_file: str, optional
         :param name: table's name, defaults to "films"
         :type name: str, optional
+        :param cache: keep films in memory, defaults to False
+        :type cache: bool, optional
         """
         super().__init__(db_file)
+        self._catalog = (
+            self._catalogs.setdefault((db_file, name), FilmCatalog()) if cache else None
+        )
         self.name = name
         self.columns = {
             "code": "INT PRIMARY KEY UNIQUE NOT NULL",
@@ -30,13 +116,134 @@ class AsyncFilmDatabase(Database):
             "year": "INT NOT NULL",
             "description": "TEXT NOT NULL",
         }
-        self.init_database(self.name, self.columns)
+        self.media_columns = {
+            "media_type": "TEXT",
+            "media_file_id": "TEXT",
+            "media_source": "TEXT",
+        }
+        self.search_table = f"{name}_fts"
+
+    def migrations(self) -> List[Migration]:
+        return [self._create_table, self._create_search_index, self._add_media]
+
+    async def _create_table(self, db: aiosqlite.Connection) -> None:
+        await self.init_database(db, self.name, self.columns)
+
+    async def _create_search_index(self, db: aiosqlite.Connection) -> None:
+        """Create FTS5 index over title, director and description
+
+        The index stores no copy of the text and is kept in sync with films
+        table by triggers.
+        """
+        fts, films = self.search_table, self.name
+        columns = "title, director, description"
+        await db.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5 \
+            ({columns}, content='{films}', \
+            tokenize='unicode61 remove_diacritics 2')"
+        )
+        await db.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {films} \
+            BEGIN \
+                INSERT INTO {fts} (rowid, {columns}) \
+                VALUES (new.rowid, new.title, new.director, new.description); \
+            END"
+        )
+        await db.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {films} \
+            BEGIN \
+                INSERT INTO {fts} ({fts}, rowid, {columns}) \
+                VALUES ('delete', old.rowid, old.title, old.director, old.description); \
+            END"
+        )
+        await db.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE ON {films} \
+            BEGIN \
+                INSERT INTO {fts} ({fts}, rowid, {columns}) \
+                VALUES ('delete', old.rowid, old.title, old.director, old.description); \
+                INSERT INTO {fts} (rowid, {columns}) \
+                VALUES (new.rowid, new.title, new.director, new.description); \
+            END"
+        )
+        await db.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+    async def _add_media(self, db: aiosqlite.Connection) -> None:
+        """Add poster or trailer columns
+
+        Search index is updated only when indexed columns change, so saving
+        a file_id does not rewrite it.
+        """
+        for column, column_type in self.media_columns.items():
+            await db.execute(
+                f"ALTER TABLE {self.name} ADD COLUMN {column} {column_type}"
+            )
+        fts, films = self.search_table, self.name
+        columns = "title, director, description"
+        await db.execute(f"DROP TRIGGER IF EXISTS {fts}_update")
+        await db.execute(
+            f"CREATE TRIGGER {fts}_update AFTER UPDATE OF {columns} ON {films} \
+            BEGIN \
+                INSERT INTO {fts} ({fts}, rowid, {columns}) \
+                VALUES ('delete', old.rowid, old.title, old.director, old.description); \
+                INSERT INTO {fts} (rowid, {columns}) \
+                VALUES (new.rowid, new.title, new.director, new.description); \
+            END"
+        )
+
+    async def get_film(self, code: int | str) -> Film | None:
+        try:
+            code = int(code)
+        except ValueError:
+            return None
+        if self._catalog is None:
+            return await self._fetch_film(code)
+
+        cached, film = self._catalog.get(code)
+        cache_requests_total.inc("films", "hit" if cached else "miss")
+        if not cached:
+            film = await self._fetch_film(code)
+            self._catalog.put(code, film)
+        return film
+
+    @query_timer
+    async def _fetch_film(self, code: int) -> Film | None:
+        row = await self.get_item(self.name, "code=?", (code,))
+        return Film(**row) if row else None
+
+    async def preload(self) -> None:
+        """Load the whole table into the catalog"""
+        if self._catalog is None:
+            return
+        films = {}
+        async for film in self.iter_films():
+            films[film.code] = film
+        self._catalog.films = films
+        self._catalog.missing.clear()
 
-    async def get_film(self, code: int) -> Dict[int, str | int]:
-        return await self.get_item(self.name, "code=?", (code,))
+    async def refresh(self, code: int | str) -> None:
+        """Replace cached entry of the code with the current row"""
+        if self._catalog is None:
+            return
+        try:
+            code = int(code)
+        except ValueError:
+            return
+        self._catalog.invalidate(code)
+        film = await self._fetch_film(code)
+        if film is not None:
+            self._catalog.put(code, film)
 
+    @query_timer
     async def add_film(
-        self, code: int, title: str, director: str, year: int, description: str
+        self,
+        code: int,
+        title: str,
+        director: str,
+        year: int,
+        description: str,
+        media_type: str | None = None,
+        media_file_id: str | None = None,
+        media_source: str | None = None,
     ) -> None:
         await self.add_values(
             self.name,
@@ -46,63 +253,349 @@ class AsyncFilmDatabase(Database):
                 "director": director,
                 "year": year,
                 "description": description,
+                "media_type": media_type,
+                "media_file_id": media_file_id,
+                "media_source": media_source,
             },
         )
+        await self.refresh(code)
 
+    @query_timer
+    async def set_media_file_id(self, code: int, file_id: str | None) -> None:
+        """Save file_id of uploaded media, so it is never uploaded again"""
+        async with self._connection() as db:
+            await db.execute(
+                f"UPDATE {self.name} SET media_file_id=? WHERE code=?", (file_id, code)
+            )
+            await db.commit()
+        await self.refresh(code)
+
+    @query_timer
+    async def clear_media(self, code: int) -> None:
+        """Detach media which cannot be sent, the film is sent as text"""
+        async with self._connection() as db:
+            await db.execute(
+                f"UPDATE {self.name} SET media_type=NULL, media_file_id=NULL, "
+                "media_source=NULL WHERE code=?",
+                (code,),
+            )
+            await db.commit()
+        await self.refresh(code)
+
+    @query_timer
+    async def add_films(self, films: Iterable[Tuple], replace: bool = False) -> int:
+        """Insert many films in one transaction
+
+        :param films: rows of FILM_COLUMNS values, media values may be left out
+        :type films: Iterable[Tuple]
+        :param replace: overwrite films with the same code, otherwise skip them.
+            Media of a film is kept if the row has no media_type,
+            defaults to False
+        :type replace: bool, optional
+        :return: number of written rows
+        :rtype: int
+        """
+        width = len(FILM_COLUMNS)
+        rows = ((*film, *(None,) * (width - len(film))) for film in films)
+        conflict = (
+            "DO UPDATE SET title=excluded.title, director=excluded.director, "
+            "year=excluded.year, description=excluded.description, "
+            + ", ".join(
+                f"{column}=CASE WHEN excluded.media_type IS NULL "
+                f"THEN {column} ELSE excluded.{column} END"
+                for column in ("media_type", "media_file_id", "media_source")
+            )
+            if replace
+            else "DO NOTHING"
+        )
+        async with self._connection() as db:
+            cursor = await db.executemany(
+                f"INSERT INTO {self.name} ({', '.join(FILM_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * width)}) ON CONFLICT(code) {conflict}",
+                rows,
+            )
+            await db.commit()
+            return cursor.rowcount
+
+    async def iter_films(self, chunk_size: int = 1000) -> AsyncIterator[Film]:
+        """Stream all films ordered by code without loading the whole table"""
+        async for rows in self.iter_items(
+            self.name, "code", ", ".join(FILM_COLUMNS), chunk_size=chunk_size
+        ):
+            for row in rows:
+                yield Film(*row)
+
+    @query_timer
+    async def search_films(
+        self, query: str, limit: int = 10, offset: int = 0
+    ) -> Tuple[List[Film], bool]:
+        """Full-text search by title, director and description
+
+        Every word of the query is matched as a prefix. Matches in title
+        rank higher than in director and description.
+
+        :param query: words to search
+        :type query: str
+        :param limit: page size, defaults to 10
+        :type limit: int, optional
+        :param offset: number of skipped results, defaults to 0
+        :type offset: int, optional
+        :return: found films and True if there are more results
+        :rtype: Tuple[List[Film], bool]
+        """
+        words = re.findall(r"\w+", query)
+        if not words:
+            return [], False
+        match = " ".join(f'"{word}"*' for word in words)
+        async with self._connection() as db:
+            async with db.execute(
+                f"SELECT f.code, f.title, f.director, f.year, f.description "
+                f"FROM {self.search_table} JOIN {self.name} AS f "
+                f"ON f.rowid = {self.search_table}.rowid "
+                f"WHERE {self.search_table} MATCH ? "
+                f"ORDER BY bm25({self.search_table}, 10.0, 5.0, 1.0) "
+                "LIMIT ? OFFSET ?",
+                (match, limit + 1, offset),
+            ) as cursor:
+                rows = await cursor.fetchall()
+        return [Film(*row) for row in rows[:limit]], len(rows) > limit
+
+    def reset_cache(self) -> None:
+        """Drop cached films after bulk changes"""
+        if self._catalog is not None:
+            self._catalog.clear()
+
+    @query_timer
     async def remove_film(self, code: int) -> None:
-        await self.remove_values(self.name, f"code={code}")
+        await self.remove_values(self.name, "code=?", (code,))
+        await self.refresh(code)
+
+    @query_timer
+    async def list_films(
+        self, after: int | None = None, before: int | None = None, limit: int = 20
+    ) -> List[Tuple]:
+        """Get a page of films ordered by code, see Database.get_page
+
+        :return: rows with code, title and year
+        :rtype: List[Tuple]
+        """
+        return await self.get_page(
+            self.name, "code", after, before, limit, "code, title, year"
+        )
+
+
+class StatusBuffer:
+    """Subscription statuses which are not written yet
+
+    One buffer is shared by all AsyncSubscribitions objects of the same
+    table. Every user has at most one buffered status, the last one.
+    """
 
-    async def list_films(self) -> List[int | str]:
-        async with aiosqlite.connect(self._db_file) as db:
-            async with db.execute("SELECT code FROM films") as cursor:
-                return [row[0] for row in await cursor.fetchall()]
+    def __init__(self, flush_interval: float, flush_size: int) -> None:
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        # user_id -> (subscribed, generation)
+        self.pending: Dict[int, Tuple[bool, int]] = {}
+        # statuses of the transaction in progress
+        self.flushing: Dict[int, Tuple[bool, int]] = {}
+        self.flush_task: asyncio.Task | None = None
+        self.lock = asyncio.Lock()
+
+    def get(self, user_id: int) -> Tuple[bool, int] | None:
+        status = self.pending.get(user_id)
+        return status if status is not None else self.flushing.get(user_id)
 
 
 class AsyncSubscribitions(Database):
+    _buffers: Dict[Tuple[str, str], StatusBuffer] = {}
+
     def __init__(
-        self, db_file: str = "subscriptions.db", name: str = "subscriptions"
+        self,
+        db_file: str = "subscriptions.db",
+        name: str = "subscriptions",
+        flush_interval: float = 1.0,
+        flush_size: int = 500,
     ) -> None:
         """Class for working with sponsors' channels
 
+        Status updates are written behind: they are kept in a buffer and
+        written in one transaction when flush_size users are buffered or
+        flush_interval seconds after the first update. Lookups see buffered
+        statuses. Call flush() or close() to write them right away.
+
         :param db_file: path to database file, defaults to "subscriptions.db"
         :type db_file: str, optional
         :param name: main table's name, defaults to "subscriptions"
         :type name: str, optional
+        :param flush_interval: max seconds a status waits, defaults to 1.0
+        :type flush_interval: float, optional
+        :param flush_size: buffered users to write at once, defaults to 500
+        :type flush_size: int, optional
         """
         super().__init__(db_file)
         self.name = name
+        self._buffer = self._buffers.setdefault(
+            (db_file, name), StatusBuffer(flush_interval, flush_size)
+        )
         self.columns = {
             "user_id": "INTEGER NOT NULL PRIMARY KEY",
             "subscribed": "BOOLEAN DEFAULT 0",
+            "generation": "INTEGER NOT NULL DEFAULT 0",
         }
         self.channel_table = "channels"
         self.channel_columns = {
             "channel_name": "TEXT NOT NULL",
         }
-        self.init_database(self.name, self.columns)
-        self.init_database(self.channel_table, self.channel_columns)
-        self._create_subscription_triggers()
-
-    def _create_subscription_triggers(self) -> None:
-        with sqlite3.connect(self._db_file) as db:
-            for action in ("INSERT", "UPDATE"):
-                db.execute(
-                    f"CREATE TRIGGER IF NOT EXISTS insert_subscription_trigger \
-                    AFTER {action} ON channels \
-                    BEGIN \
-                        UPDATE subscriptions SET subscribed = 0; \
-                    END"
-                )
-            db.commit()
-
-    async def _update_subscription_status(self, user_id: int, subscribed: bool) -> None:
-        async with aiosqlite.connect(self._db_file) as db:
+        self.generation_table = "sponsor_generation"
+        self.generation_columns = {
+            "id": "INTEGER PRIMARY KEY CHECK (id = 0)",
+            "generation": "INTEGER NOT NULL",
+        }
+        self.member_table = "members"
+        self.member_columns = {
+            "user_id": "INTEGER NOT NULL",
+            "channel": "TEXT NOT NULL",
+            "is_member": "BOOLEAN NOT NULL",
+            "updated_at": "REAL NOT NULL",
+            "PRIMARY KEY": "(user_id, channel)",
+        }
+
+    def migrations(self) -> List[Migration]:
+        return [
+            self._create_tables,
+            self._add_sponsor_generation,
+            self._create_member_table,
+        ]
+
+    async def _create_tables(self, db: aiosqlite.Connection) -> None:
+        columns = {
+            key: value for key, value in self.columns.items() if key != "generation"
+        }
+        await self.init_database(db, self.name, columns)
+        await self.init_database(db, self.channel_table, self.channel_columns)
+
+    async def _add_sponsor_generation(self, db: aiosqlite.Connection) -> None:
+        """Bump sponsor set generation on every change of channels table
+
+        User's verified status is valid only while its generation equals the
+        current one, so a sponsor change invalidates every user in O(1).
+        """
+        async with db.execute(f"PRAGMA table_info({self.name})") as cursor:
+            user_columns = {row[1] async for row in cursor}
+        # databases created before migrations may have the column already
+        if "generation" not in user_columns:
             await db.execute(
-                "INSERT OR REPLACE INTO subscriptions (user_id, subscribed) VALUES (?, ?)",
-                (user_id, subscribed),
+                f"ALTER TABLE {self.name} "
+                f"ADD COLUMN generation {self.columns['generation']}"
             )
-            await db.commit()
+        await self.init_database(db, self.generation_table, self.generation_columns)
+        await db.execute(
+            f"INSERT OR IGNORE INTO {self.generation_table} (id, generation) "
+            "VALUES (0, 1)"
+        )
+        # the old triggers reset subscribed on every sponsor change, so users
+        # still marked subscribed were verified against the current sponsors
+        await db.execute(
+            f"UPDATE {self.name} SET generation = "
+            f"(SELECT generation FROM {self.generation_table}) "
+            "WHERE subscribed = 1 AND generation = 0"
+        )
+        await db.execute("DROP TRIGGER IF EXISTS insert_subscription_trigger")
+        await db.execute("DROP TRIGGER IF EXISTS update_subscription_trigger")
+        for action in ("INSERT", "UPDATE", "DELETE"):
+            await db.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {action.lower()}_sponsor_generation_trigger \
+                AFTER {action} ON {self.channel_table} \
+                BEGIN \
+                    UPDATE {self.generation_table} SET generation = generation + 1; \
+                END"
+            )
+
+    async def _create_member_table(self, db: aiosqlite.Connection) -> None:
+        await self.init_database(db, self.member_table, self.member_columns)
+
+    async def get_generation(self) -> int:
+        """Get current generation of the sponsor set
+
+        Read it before checking memberships and pass it to
+        _update_subscription_status, so a check which overlaps a change of
+        sponsors is saved as stale.
+        """
+        async with self._connection() as db:
+            async with db.execute(
+                f"SELECT generation FROM {self.generation_table}"
+            ) as cursor:
+                return (await cursor.fetchone())[0]
+
+    @query_timer
+    async def _update_subscription_status(
+        self, user_id: int, subscribed: bool, generation: int | None = None
+    ) -> None:
+        """Buffer user's status
+
+        :param user_id: telegram user id
+        :type user_id: int
+        :param subscribed: True if user is a member of all sponsor channels
+        :type subscribed: bool
+        :param generation: generation of the sponsor set read before the
+            check, defaults to the current one
+        :type generation: int | None, optional
+        """
+        # verified status is bound to the sponsor set it was checked against
+        if not subscribed:
+            generation = 0
+        elif generation is None:
+            generation = await self.get_generation()
+        self._buffer.pending[user_id] = (subscribed, generation)
+        if len(self._buffer.pending) >= self._buffer.flush_size:
+            await self.flush()
+        elif self._buffer.flush_task is None or self._buffer.flush_task.done():
+            self._buffer.flush_task = asyncio.get_running_loop().create_task(
+                self._delayed_flush()
+            )
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self._buffer.flush_interval)
+        self._buffer.flush_task = None
+        await asyncio.shield(self.flush())
 
+    @query_timer
+    async def flush(self) -> None:
+        """Write buffered statuses in one transaction"""
+        buffer = self._buffer
+        async with buffer.lock:
+            if not buffer.pending:
+                return
+            buffer.flushing, buffer.pending = buffer.pending, {}
+            try:
+                async with self._connection() as db:
+                    await db.executemany(
+                        f"INSERT INTO {self.name} (user_id, subscribed, generation) "
+                        "VALUES (?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET "
+                        "subscribed = excluded.subscribed, "
+                        "generation = excluded.generation",
+                        [
+                            (user_id, subscribed, generation)
+                            for user_id, (subscribed, generation) in (
+                                buffer.flushing.items()
+                            )
+                        ],
+                    )
+                    await db.commit()
+            except Exception:
+                # keep statuses for the next flush, newer ones win
+                buffer.pending = {**buffer.flushing, **buffer.pending}
+                raise
+            finally:
+                buffer.flushing = {}
+
+    async def close(self) -> None:
+        if self._buffer.flush_task is not None and not self._buffer.flush_task.done():
+            self._buffer.flush_task.cancel()
+        await self.flush()
+        await super().close()
+
+    @query_timer
     async def is_subscribed_to_all(self, user_id: int) -> bool:
         """Checks if user is subscribed to all sponsors' channels in database
 
@@ -111,12 +604,24 @@ class AsyncSubscribitions(Database):
         :return: True if subscribed otherwise False
         :rtype: bool
         """
-        result = await self.get_item(self.name, "user_id=?", (user_id,), "subscribed")
+        buffered = self._buffer.get(user_id)
+        if buffered is not None:
+            subscribed, generation = buffered
+            return subscribed and generation == await self.get_generation()
+
+        result = await self.get_item(
+            self.name,
+            "user_id=?",
+            (user_id,),
+            f"subscribed AND generation = "
+            f"(SELECT generation FROM {self.generation_table}) AS subscribed",
+        )
         if not result:
             await self._update_subscription_status(user_id, False)
             return False
         return not not result.get("subscribed")
 
+    @query_timer
     async def get_sponsors(self) -> List[str]:
         """Get sponsor list from database
 
@@ -128,12 +633,66 @@ class AsyncSubscribitions(Database):
             return ["There is no sponsors"]
         return [sponsor["channel_name"] for sponsor in db_result]
 
+    @query_timer
     async def add_sponsor(self, channel_name: str) -> None:
         await self.add_values(self.channel_table, {"channel_name": channel_name})
 
+    @query_timer
     async def remove_sponsor(self, channel_name: str) -> None:
         await self.remove_values(self.channel_table, "channel_name=?", (channel_name,))
+        await self.remove_values(
+            self.member_table, "channel=?", (channel_name.lower(),)
+        )
+
+    @query_timer
+    async def get_memberships(
+        self, user_id: int, channels: List[str], max_age: float
+    ) -> Dict[str, bool]:
+        """Get locally known membership of the user in the channels
 
+        :param user_id: telegram user id
+        :type user_id: int
+        :param channels: channel names
+        :type channels: List[str]
+        :param max_age: seconds after which a record is not trusted
+        :type max_age: float
+        :return: membership by channel name, channels without fresh record
+            are missed
+        :rtype: Dict[str, bool]
+        """
+        async with self._connection() as db:
+            async with db.execute(
+                f"SELECT channel, is_member FROM {self.member_table} "
+                "WHERE user_id=? AND updated_at>=?",
+                (user_id, time.time() - max_age),
+            ) as cursor:
+                known = {
+                    channel: bool(is_member) async for channel, is_member in cursor
+                }
+        return {
+            channel: known[channel.lower()]
+            for channel in channels
+            if channel.lower() in known
+        }
+
+    @query_timer
+    async def set_memberships(self, user_id: int, memberships: Dict[str, bool]) -> None:
+        """Save membership of the user by channel name"""
+        now = time.time()
+        async with self._connection() as db:
+            await db.executemany(
+                f"INSERT INTO {self.member_table} "
+                "(user_id, channel, is_member, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id, channel) DO UPDATE SET "
+                "is_member=excluded.is_member, updated_at=excluded.updated_at",
+                [
+                    (user_id, channel.lower(), is_member, now)
+                    for channel, is_member in memberships.items()
+                ],
+            )
+            await db.commit()
+
+    @query_timer
     async def is_in(self, channel_name: str) -> bool:
         """Check if sponsor is in database
 
@@ -145,3 +704,126 @@ class AsyncSubscribitions(Database):
         return not not await self.get_item(
             self.channel_table, "channel_name=?", (channel_name,)
         )
+
+    async def iter_user_ids(
+        self, after: int = 0, chunk_size: int = 1000
+    ) -> AsyncIterator[List[int]]:
+        """Stream ids of all users in ascending order by chunks
+
+        Every chunk is a separate keyset query, so no connection is held
+        between chunks and iteration can be resumed from any id.
+
+        :param after: skip users with id less or equal, defaults to 0
+        :type after: int, optional
+        :param chunk_size: ids per chunk, defaults to 1000
+        :type chunk_size: int, optional
+        """
+        async for rows in self.iter_items(
+            self.name, "user_id", "user_id", after=after, chunk_size=chunk_size
+        ):
+            yield [row.user_id for row in rows]
+
+
+# statuses of broadcast jobs which are still sending
+UNFINISHED = ("running", "cancelling")
+
+
+class AsyncBroadcasts(Database):
+    def __init__(
+        self, db_file: str = "subscriptions.db", name: str = "broadcasts"
+    ) -> None:
+        """Class for storing broadcast jobs and their progress
+
+        :param db_file: path to database file, defaults to "subscriptions.db"
+        :type db_file: str, optional
+        :param name: table's name, defaults to "broadcasts"
+        :type name: str, optional
+        """
+        super().__init__(db_file, pool_size=1)
+        self.name = name
+        self.columns = {
+            "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+            "text": "TEXT NOT NULL",
+            "admin_chat": "INTEGER NOT NULL",
+            "last_user_id": "INTEGER NOT NULL DEFAULT 0",
+            "sent": "INTEGER NOT NULL DEFAULT 0",
+            "failed": "INTEGER NOT NULL DEFAULT 0",
+            "status": "TEXT NOT NULL DEFAULT 'running'",
+        }
+
+    def migrations(self) -> List[Migration]:
+        return [self._create_table]
+
+    async def _create_table(self, db: aiosqlite.Connection) -> None:
+        await self.init_database(db, self.name, self.columns)
+
+    async def create_job(self, text: str, admin_chat: int) -> int | None:
+        """Create a job unless another one is unfinished
+
+        The check and the insert are one statement, so two workers never
+        start two jobs.
+
+        :return: id of the job or None if another job is unfinished
+        :rtype: int | None
+        """
+        async with self._connection() as db:
+            cursor = await db.execute(
+                f"INSERT INTO {self.name} (text, admin_chat) SELECT ?, ? "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {self.name} "
+                f"WHERE status IN {UNFINISHED})",
+                (text, admin_chat),
+            )
+            await db.commit()
+            return cursor.lastrowid if cursor.rowcount else None
+
+    @query_timer
+    async def save_progress(
+        self, job_id: int, last_user_id: int, sent: int, failed: int
+    ) -> None:
+        async with self._connection() as db:
+            await db.execute(
+                f"UPDATE {self.name} SET last_user_id=?, sent=?, failed=? WHERE id=?",
+                (last_user_id, sent, failed, job_id),
+            )
+            await db.commit()
+
+    async def set_status(self, job_id: int, status: str) -> None:
+        async with self._connection() as db:
+            await db.execute(
+                f"UPDATE {self.name} SET status=? WHERE id=?", (status, job_id)
+            )
+            await db.commit()
+
+    async def request_cancel(self) -> int | None:
+        """Ask the worker sending the unfinished job to stop it
+
+        :return: id of the job or None if there is no running job
+        :rtype: int | None
+        """
+        async with self._connection() as db:
+            async with db.execute(
+                f"UPDATE {self.name} SET status='cancelling' "
+                "WHERE status='running' RETURNING id"
+            ) as cursor:
+                row = await cursor.fetchone()
+            await db.commit()
+            return row[0] if row else None
+
+    @query_timer
+    async def get_job(self, job_id: int) -> Dict[str, Any] | None:
+        jobs = await self._select_jobs("id=?", (job_id,))
+        return jobs[0] if jobs else None
+
+    async def get_running(self) -> List[Dict[str, Any]]:
+        """Get jobs which were not finished, e.g. because of a crash"""
+        return await self._select_jobs(f"status IN {UNFINISHED}")
+
+    async def _select_jobs(
+        self, condition: str, values: Tuple = ()
+    ) -> List[Dict[str, Any]]:
+        async with self._connection() as db:
+            async with db.execute(
+                f"SELECT * FROM {self.name} WHERE {condition} ORDER BY id", values
+            ) as cursor:
+                columns = [description[0] for description in cursor.description]
+                return [dict(zip(columns, row)) for row in await cursor.fetchall()]
@@ -0,0 +1,235 @@
+"""Bulk import and export of films in CSV or JSON Lines format
+
+CSV files must have a header with code, title, director, year and
+description columns. JSON Lines files hold one object with the same keys
+per line. Optional media_type ("photo" or "video"), media_file_id and
+media_source columns attach a poster or trailer, export writes them too.
+
+Usage:
+    python -m database.film_io import films.csv [--replace] [--db films.db]
+    python -m database.film_io export films.jsonl [--db films.db]
+"""
+import argparse
+import asyncio
+import csv
+import json
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Iterable, Iterator, List, Tuple
+
+from .db_utils import FILM_COLUMNS, AsyncFilmDatabase
+
+# required fields
+FIELDS = ("code", "title", "director", "year", "description")
+MEDIA_FIELDS = ("media_type", "media_file_id", "media_source")
+MEDIA_TYPES = ("photo", "video")
+FilmRow = Tuple[int, str, str, int, str, str | None, str | None, str | None]
+Progress = Callable[["ImportResult"], Awaitable[None]]
+
+
+MAX_ERRORS = 20
+
+
+@dataclass(slots=True)
+class ImportResult:
+    processed: int = 0
+    written: int = 0
+    failed: int = 0
+    # first MAX_ERRORS error messages
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def skipped(self) -> int:
+        return self.processed - self.written - self.failed
+
+
+def get_format(path: str) -> str:
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def validate_row(row: dict) -> FilmRow:
+    """Convert parsed row to database values
+
+    :raises ValueError: if row has missed or invalid values
+    """
+    missing = [
+        name for name in FIELDS if row.get(name) is None or not str(row[name]).strip()
+    ]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    try:
+        code, year = int(row["code"]), int(row["year"])
+    except (TypeError, ValueError):
+        raise ValueError("code and year should be integers")
+    if code < 0:
+        raise ValueError("code should not be negative")
+    media_type, file_id, source = (
+        str(row[name]).strip() or None if row.get(name) is not None else None
+        for name in MEDIA_FIELDS
+    )
+    if media_type is not None and media_type not in MEDIA_TYPES:
+        raise ValueError(f"media_type should be {' or '.join(MEDIA_TYPES)}")
+    if media_type is None and (file_id or source):
+        raise ValueError("media_type is missing")
+    if media_type is not None and not (file_id or source):
+        raise ValueError("media_file_id or media_source is missing")
+    return (
+        code,
+        str(row["title"]).strip(),
+        str(row["director"]).strip(),
+        year,
+        str(row["description"]).strip(),
+        media_type,
+        file_id,
+        source,
+    )
+
+
+def parse_films(lines: Iterable[str], fmt: str) -> Iterator[Tuple[int, dict | str]]:
+    """Lazily parse lines of a file
+
+    :return: pairs of (line number, parsed row or error message)
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, f"invalid JSON: {e.msg}"
+            continue
+        yield line_no, row if isinstance(row, dict) else "not an object"
+
+
+async def import_films(
+    films_db: AsyncFilmDatabase,
+    path: str,
+    fmt: str | None = None,
+    replace: bool = False,
+    chunk_size: int = 1000,
+    progress: Progress | None = None,
+    result: ImportResult | None = None,
+) -> ImportResult:
+    """Stream films from file into database
+
+    Valid rows are written by chunk_size rows per transaction. Films with
+    already used codes are skipped unless replace is True. If the file
+    cannot be read, chunks written before stay and the error is raised.
+
+    :param films_db: target database
+    :type films_db: AsyncFilmDatabase
+    :param path: path to CSV or JSON Lines file
+    :type path: str
+    :param fmt: "csv" or "jsonl", detected by extension by default
+    :type fmt: str | None, optional
+    :param replace: overwrite films with the same code, defaults to False
+    :type replace: bool, optional
+    :param chunk_size: rows per transaction, defaults to 1000
+    :type chunk_size: int, optional
+    :param progress: coroutine called after every chunk, defaults to None
+    :type progress: Progress | None, optional
+    :param result: object to collect statistics in, it is up to date when
+        the file cannot be read, defaults to a new one
+    :type result: ImportResult | None, optional
+    :return: import statistics
+    :rtype: ImportResult
+    :raises UnicodeDecodeError: if the file is not UTF-8
+    :raises csv.Error: if CSV file is malformed
+    """
+    result = result if result is not None else ImportResult()
+    chunk: List[FilmRow] = []
+
+    async def write_chunk() -> None:
+        result.written += await films_db.add_films(chunk, replace)
+        chunk.clear()
+        if progress is not None:
+            await progress(result)
+
+    try:
+        with open(path, encoding="utf-8-sig", newline="") as file:
+            for line_no, row in parse_films(file, fmt or get_format(path)):
+                result.processed += 1
+                try:
+                    if isinstance(row, str):
+                        raise ValueError(row)
+                    chunk.append(validate_row(row))
+                except ValueError as e:
+                    result.failed += 1
+                    if len(result.errors) < MAX_ERRORS:
+                        result.errors.append(f"line {line_no}: {e}")
+                if len(chunk) >= chunk_size:
+                    await write_chunk()
+        if chunk:
+            await write_chunk()
+    finally:
+        # written chunks should be visible even if the rest failed
+        films_db.reset_cache()
+    return result
+
+
+async def export_films(
+    films_db: AsyncFilmDatabase, path: str, fmt: str | None = None
+) -> int:
+    """Stream all films into file
+
+    :return: number of exported films
+    :rtype: int
+    """
+    fmt = fmt or get_format(path)
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file) if fmt == "csv" else None
+        if writer is not None:
+            writer.writerow(FILM_COLUMNS)
+        async for film in films_db.iter_films():
+            values = tuple(getattr(film, name) for name in FILM_COLUMNS)
+            if writer is not None:
+                writer.writerow(values)
+            else:
+                file.write(
+                    json.dumps(dict(zip(FILM_COLUMNS, values)), ensure_ascii=False)
+                )
+                file.write("\n")
+            count += 1
+    return count
+
+
+async def _main(args: argparse.Namespace) -> None:
+    films_db = AsyncFilmDatabase(args.db)
+
+    async def report(result: ImportResult) -> None:
+        print(
+            f"processed {result.processed}, written {result.written}, "
+            f"failed {result.failed}"
+        )
+
+    try:
+        if args.command == "import":
+            result = await import_films(
+                films_db, args.path, replace=args.replace, progress=report
+            )
+            for error in result.errors:
+                print(error)
+            print(
+                f"Done: {result.written} written, {result.skipped} skipped, "
+                f"{result.failed} failed"
+            )
+        else:
+            print(f"Done: {await export_films(films_db, args.path)} films exported")
+    finally:
+        await films_db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import/export of films")
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("path", help="CSV or JSON Lines file")
+    parser.add_argument("--db", default="films.db", help="path to films database")
+    parser.add_argument(
+        "--replace", action="store_true", help="overwrite films with the same code"
+    )
+    asyncio.run(_main(parser.parse_args()))
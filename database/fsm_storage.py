@@ -0,0 +1,246 @@
+import asyncio
+import copy
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiosqlite
+from aiogram.dispatcher.storage import BaseStorage
+
+from metrics import query_timer
+from .base import Database, Migration
+
+
+class FSMRecord:
+    __slots__ = ("state", "data", "updated_at", "dirty")
+
+    def __init__(
+        self, state: str | None = None, data: dict | None = None, updated_at: float = 0
+    ) -> None:
+        self.state = state
+        self.data = data or {}
+        self.updated_at = updated_at
+        self.dirty = False
+
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(Database, BaseStorage):
+    """FSM storage persisted in SQLite
+
+    All live records are kept in memory (there are only a few admin sessions
+    at a time), so reads never touch the disk. Changes are written behind in
+    one transaction every flush_interval seconds and on close. Sessions that
+    were not touched for ttl seconds are expired.
+
+    Records are cached per process, so every chat has to be served by the
+    same worker process.
+    """
+
+    def __init__(
+        self,
+        db_file: str = "fsm.db",
+        name: str = "fsm_state",
+        ttl: float = 3600,
+        flush_interval: float = 1.0,
+    ) -> None:
+        """Create storage object
+
+        :param db_file: path to database file, defaults to "fsm.db"
+        :type db_file: str, optional
+        :param name: table's name, defaults to "fsm_state"
+        :type name: str, optional
+        :param ttl: seconds after which untouched session expires, defaults to 3600
+        :type ttl: float, optional
+        :param flush_interval: seconds between writes, defaults to 1.0
+        :type flush_interval: float, optional
+        """
+        super().__init__(db_file, pool_size=1)
+        self.name = name
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.columns = {
+            "chat": "INTEGER NOT NULL",
+            "user": "INTEGER NOT NULL",
+            "state": "TEXT",
+            "data": "TEXT NOT NULL",
+            "updated_at": "REAL NOT NULL",
+            "PRIMARY KEY": "(chat, user)",
+        }
+        self._records: Dict[Tuple[int, int], FSMRecord] = {}
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+
+    def migrations(self) -> List[Migration]:
+        return [self._create_table]
+
+    async def _create_table(self, db: aiosqlite.Connection) -> None:
+        await self.init_database(db, self.name, self.columns)
+
+    @query_timer
+    async def _load(self) -> None:
+        async with self._load_lock:
+            if self._loaded:
+                return
+            expire_before = time.time() - self.ttl
+            async with self._connection() as db:
+                await db.execute(
+                    f"DELETE FROM {self.name} WHERE updated_at < ?", (expire_before,)
+                )
+                await db.commit()
+                async with db.execute(
+                    f"SELECT chat, user, state, data, updated_at FROM {self.name}"
+                ) as cursor:
+                    async for chat, user, state, data, updated_at in cursor:
+                        self._records[(chat, user)] = FSMRecord(
+                            state, json.loads(data), updated_at
+                        )
+            self._loaded = True
+
+    async def _get_record(self, chat, user, create: bool = False) -> FSMRecord | None:
+        if not self._loaded:
+            await self._load()
+        key = tuple(map(int, self.check_address(chat=chat, user=user)))
+        record = self._records.get(key)
+        if record is not None and record.updated_at + self.ttl < time.time():
+            # the row is deleted by flush() unless another worker updated it
+            del self._records[key]
+            record = None
+        if record is None and create:
+            record = self._records[key] = FSMRecord()
+        return record
+
+    def _touch(self, record: FSMRecord) -> None:
+        record.updated_at = time.time()
+        record.dirty = True
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(
+                self._delayed_flush()
+            )
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        await asyncio.shield(self.flush())
+
+    @query_timer
+    async def flush(self) -> None:
+        """Write all changed records in one transaction
+
+        Rows are written and deleted only if they are not newer than the
+        record, so a stale copy never overwrites a row of another worker.
+        Expired rows are deleted by their own updated_at.
+        """
+        async with self._flush_lock:
+            expire_before = time.time() - self.ttl
+            upserts, deletes, written = [], [], []
+            for key, record in list(self._records.items()):
+                if record.updated_at < expire_before:
+                    del self._records[key]
+                    continue
+                if not record.dirty:
+                    continue
+                record.dirty = False
+                written.append(record)
+                if record.is_empty():
+                    deletes.append((*key, record.updated_at))
+                else:
+                    upserts.append(
+                        (*key, record.state, json.dumps(record.data), record.updated_at)
+                    )
+
+            try:
+                async with self._connection() as db:
+                    await db.executemany(
+                        f"INSERT INTO {self.name} "
+                        "(chat, user, state, data, updated_at) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT(chat, user) DO UPDATE SET state = excluded.state, "
+                        "data = excluded.data, updated_at = excluded.updated_at "
+                        "WHERE excluded.updated_at >= updated_at",
+                        upserts,
+                    )
+                    await db.executemany(
+                        f"DELETE FROM {self.name} "
+                        "WHERE chat=? AND user=? AND updated_at <= ?",
+                        deletes,
+                    )
+                    await db.execute(
+                        f"DELETE FROM {self.name} WHERE updated_at < ?",
+                        (expire_before,),
+                    )
+                    await db.commit()
+            except Exception:
+                # write them with the next flush
+                for record in written:
+                    record.dirty = True
+                self._schedule_flush()
+                raise
+
+            for key, record in list(self._records.items()):
+                if record.is_empty() and not record.dirty:
+                    del self._records[key]
+
+    async def close(self) -> None:
+        # executor closes the storage again after Database.close_all(),
+        # which must not open the pool for nothing
+        if self._pool is None and not any(
+            record.dirty for record in self._records.values()
+        ):
+            return
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        await super().close()
+
+    async def wait_closed(self) -> None:
+        pass
+
+    async def get_state(
+        self, *, chat=None, user=None, default: Optional[str] = None
+    ) -> Optional[str]:
+        record = await self._get_record(chat, user)
+        if record is None or record.state is None:
+            return default
+        return record.state
+
+    async def get_data(self, *, chat=None, user=None, default=None) -> Dict:
+        record = await self._get_record(chat, user)
+        if record is None:
+            return copy.deepcopy(default or {})
+        return copy.deepcopy(record.data)
+
+    async def set_state(self, *, chat=None, user=None, state=None) -> None:
+        record = await self._get_record(chat, user, create=True)
+        record.state = self.resolve_state(state)
+        self._touch(record)
+
+    async def set_data(self, *, chat=None, user=None, data: Dict = None) -> None:
+        record = await self._get_record(chat, user, create=True)
+        record.data = copy.deepcopy(data) if data else {}
+        self._touch(record)
+
+    async def update_data(
+        self, *, chat=None, user=None, data: Dict = None, **kwargs
+    ) -> None:
+        record = await self._get_record(chat, user, create=True)
+        record.data.update(data or {}, **kwargs)
+        self._touch(record)
+
+    async def reset_all(self, full: bool = True) -> None:
+        if not self._loaded:
+            await self._load()
+        if full:
+            self._records.clear()
+            async with self._connection() as db:
+                await db.execute(f"DELETE FROM {self.name}")
+                await db.commit()
+            return
+        for record in self._records.values():
+            record.state = None
+            self._touch(record)
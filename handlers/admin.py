@@ -1,13 +1,50 @@
+import csv
+import html
+import io
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Tuple
+
 from aiogram import types
 from aiogram.dispatcher import FSMContext
+from aiogram.utils.callback_data import CallbackData
 
 
+from config import FILM_CACHE
 from database import AsyncFilmDatabase, AsyncSubscribitions
-from .states import FilmState, AddingState
+from database.film_io import ImportResult, export_films, get_format, import_films
+from metrics import profile_report, profiler
+from .events import publish, subscribe
+from .film_code import media_type_of
+from .inline import clear_pages
+from .states import FilmState, AddingState, ImportState
+from .tg_utils import membership_cache
+
+
+films_db = AsyncFilmDatabase.shared("films.db", cache=FILM_CACHE != "off")
+sponsor_db = AsyncSubscribitions.shared("subscriptions.db")
+
+LIST_PAGE_SIZE = 20
+films_cb = CallbackData("films", "direction", "code")
+# message limit is 4096 characters, the rest is for <pre> tags
+REPORT_LIMIT = 4000
+
+
+@subscribe("film")
+async def _refresh_film(code: str) -> None:
+    await films_db.refresh(code)
+
 
+@subscribe("films")
+async def _reset_films(_: None) -> None:
+    films_db.reset_cache()
 
-films_db = AsyncFilmDatabase("films.db")
-sponsor_db = AsyncSubscribitions("subscriptions.db")
+
+@subscribe("sponsor")
+async def _invalidate_sponsor(channel_name: str) -> None:
+    membership_cache.invalidate_channel(channel_name)
 
 
 async def cancel_handler(message: types.Message, state: FSMContext) -> None:
@@ -71,13 +108,179 @@ class FilmProcess:
         film_state = await state.get_data()
         film_state["description"] = message.text
         await state.set_data(film_state)
+        await FilmState.media.set()
+        await message.answer(
+            "Send a poster photo or a trailer video, or a link to one of them. "
+            'Send "skip" to add the film without media'
+        )
 
+    @staticmethod
+    async def process_film_media(message: types.Message, state: FSMContext) -> None:
         film_state = await state.get_data()
+        if message.photo:
+            film_state["media_type"] = "photo"
+            film_state["media_file_id"] = message.photo[-1].file_id
+        elif message.video:
+            film_state["media_type"] = "video"
+            film_state["media_file_id"] = message.video.file_id
+        elif message.text and message.text.startswith(("http://", "https://")):
+            # uploaded from the link on the first lookup
+            film_state["media_type"] = media_type_of(message.text)
+            film_state["media_source"] = message.text
+        elif (message.text or "").lower() != "skip":
+            await message.reply('Send a photo, a video, a link or "skip"')
+            return
+
         await state.reset_state()
-        await films_db.add_film(*film_state.values())
+        try:
+            await films_db.add_film(**film_state)
+        except sqlite3.IntegrityError:
+            # the code was taken after it was checked, e.g. by an import
+            await message.answer(
+                f"Film with code {film_state['code']} already exists, "
+                "the film is not added. Please start again."
+            )
+            return
+        clear_pages()
+        publish("film", film_state["code"])
         await message.answer("✅ Film added")
 
 
+class FilmList:
+    @staticmethod
+    async def _render_page(
+        after: int | None = None, before: int | None = None
+    ) -> Tuple[str, types.InlineKeyboardMarkup | None]:
+        # one extra row tells whether there is a page further
+        films = await films_db.list_films(after, before, LIST_PAGE_SIZE + 1)
+        backwards = after is None and before is not None
+        has_more = len(films) > LIST_PAGE_SIZE
+        if has_more:
+            films = films[1:] if backwards else films[:-1]
+        if not films:
+            return "There are no films", None
+
+        has_previous = has_more if backwards else after is not None
+        has_next = True if backwards else has_more
+        text = "Films by code:\n\n" + "\n".join(
+            f"{film.code} — {film.title} ({film.year})" for film in films
+        )
+        buttons = []
+        if has_previous:
+            buttons.append(
+                types.InlineKeyboardButton(
+                    "⬅️ Previous",
+                    callback_data=films_cb.new(direction="prev", code=films[0].code),
+                )
+            )
+        if has_next:
+            buttons.append(
+                types.InlineKeyboardButton(
+                    "Next ➡️",
+                    callback_data=films_cb.new(direction="next", code=films[-1].code),
+                )
+            )
+        keyboard = types.InlineKeyboardMarkup().row(*buttons) if buttons else None
+        return text, keyboard
+
+    @staticmethod
+    async def list_films(message: types.Message) -> None:
+        text, keyboard = await FilmList._render_page()
+        await message.answer(text, reply_markup=keyboard)
+
+    @staticmethod
+    async def page_handler(
+        callback_query: types.CallbackQuery, callback_data: dict
+    ) -> None:
+        code = int(callback_data["code"])
+        if callback_data["direction"] == "next":
+            text, keyboard = await FilmList._render_page(after=code)
+        else:
+            text, keyboard = await FilmList._render_page(before=code)
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
+        await callback_query.answer()
+
+
+class FilmImport:
+    @staticmethod
+    async def import_state(message: types.Message) -> None:
+        await message.answer(
+            "Send a .csv or .jsonl file with films. To cancel, send 'q'\n\n"
+            "CSV should have a header: code,title,director,year,description\n"
+            "JSON Lines should have one object with the same keys per line\n"
+            "Optional media_type, media_file_id and media_source columns "
+            "attach a poster or trailer\n\n"
+            "Films with already used codes are skipped. "
+            'Add "replace" to the file caption to overwrite them'
+        )
+        await ImportState.document.set()
+
+    @staticmethod
+    async def process_document(message: types.Message, state: FSMContext) -> None:
+        name = message.document.file_name or ""
+        if not name.lower().endswith((".csv", ".jsonl")):
+            await message.reply("Only .csv and .jsonl files are supported")
+            return
+        await state.reset_state()
+
+        status = await message.answer("Importing films...")
+        last_report = time.monotonic()
+
+        async def report(result: ImportResult) -> None:
+            nonlocal last_report
+            if time.monotonic() - last_report < 3:
+                return
+            last_report = time.monotonic()
+            await status.edit_text(
+                f"Importing films... {result.processed} rows processed, "
+                f"{result.written} written"
+            )
+
+        replace = "replace" in (message.caption or "").lower()
+        result = ImportResult()
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, name)
+                await message.document.download(destination_file=path)
+                await import_films(
+                    films_db,
+                    path,
+                    get_format(name),
+                    replace,
+                    progress=report,
+                    result=result,
+                )
+        except (UnicodeDecodeError, csv.Error) as e:
+            await message.answer(
+                f"❌ Import stopped after {result.processed} rows: {e}\n\n"
+                f"Written before the error: {result.written}"
+            )
+            return
+        finally:
+            clear_pages()
+            publish("films", None)
+
+        answer = (
+            f"✅ Import finished\n\n"
+            f"Written: {result.written}\n"
+            f"Skipped: {result.skipped}\n"
+            f"Failed: {result.failed}"
+        )
+        if result.errors:
+            answer += "\n\n" + "\n".join(result.errors)
+        await message.answer(answer)
+
+    @staticmethod
+    async def export(message: types.Message) -> None:
+        fmt = "csv" if "csv" in (message.get_args() or "") else "jsonl"
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"films.{fmt}")
+            count = await export_films(films_db, path, fmt)
+            await message.answer_document(
+                types.InputFile(path), caption=f"{count} films exported"
+            )
+
+
 class AsyncSponsor:
     @staticmethod
     async def add_state(message: types.Message) -> None:
@@ -100,6 +303,8 @@ class AsyncSponsor:
             return
 
         await sponsor_db.add_sponsor(sponsor_name)
+        membership_cache.invalidate_channel(sponsor_name)
+        publish("sponsor", sponsor_name)
         await message.answer(
             f'Channel "{sponsor_name}" has been *added*', parse_mode="Markdown"
         )
@@ -128,6 +333,35 @@ class AsyncSponsor:
             return
 
         await sponsor_db.remove_sponsor(message.text)
+        membership_cache.invalidate_channel(message.text)
+        publish("sponsor", message.text)
         await message.answer(
             f'Channel "{message.text}" has been *removed*', parse_mode="Markdown"
         )
+
+
+class Profiling:
+    @staticmethod
+    async def profile(message: types.Message) -> None:
+        """Start sampling profiler or stop it and send the results"""
+        if not profiler.running:
+            try:
+                profiler.start()
+            except RuntimeError as e:
+                await message.answer(str(e))
+                return
+            await message.answer("Profiler started. Send /profile again to stop it")
+            return
+
+        profiler.stop()
+        # frames like <module> should not be parsed as tags
+        report = html.escape(profile_report())
+        if len(report) > REPORT_LIMIT:
+            report = report[: report.rfind("\n", 0, REPORT_LIMIT)]
+        await message.answer(f"<pre>{report}</pre>", parse_mode="HTML")
+        await message.answer_document(
+            types.InputFile(
+                io.BytesIO(profiler.folded().encode()), filename="profile.folded"
+            ),
+            caption="Stacks in folded format for flame graph tools",
+        )
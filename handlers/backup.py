@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import os
+from typing import List
+
+from aiogram import types
+
+from config import BACKUP_DIR, BACKUP_FILES, BACKUP_INTERVAL, BACKUP_KEEP, BACKUP_PAGES
+from database import backup_database
+
+log = logging.getLogger(__name__)
+
+
+class Backup:
+    _task: asyncio.Task | None = None
+    # a scheduled backup and /backup never copy at the same time
+    _lock = asyncio.Lock()
+
+    @classmethod
+    async def run(cls) -> List[str]:
+        """Write snapshots of all BACKUP_FILES
+
+        :return: paths to the snapshots
+        :rtype: List[str]
+        """
+        async with cls._lock:
+            return [
+                await backup_database(
+                    db_file, BACKUP_DIR, keep=BACKUP_KEEP, pages=BACKUP_PAGES
+                )
+                for db_file in BACKUP_FILES
+            ]
+
+    @classmethod
+    async def _periodic(cls) -> None:
+        while True:
+            await asyncio.sleep(BACKUP_INTERVAL)
+            try:
+                await cls.run()
+            except Exception:
+                log.exception("Backup failed")
+
+    @classmethod
+    def start(cls) -> None:
+        if BACKUP_INTERVAL > 0 and cls._task is None:
+            cls._task = asyncio.create_task(cls._periodic())
+
+    @classmethod
+    def stop(cls) -> None:
+        if cls._task is not None:
+            cls._task.cancel()
+            cls._task = None
+
+    @staticmethod
+    async def backup(message: types.Message) -> None:
+        if Backup._lock.locked():
+            await message.answer("Backup is already running")
+            return
+        await message.answer("Backup started")
+        try:
+            paths = await Backup.run()
+        except Exception as e:
+            log.exception("Backup failed")
+            await message.answer(f"Backup failed: {e}")
+            return
+        lines = [
+            f"{os.path.basename(path)} - {os.path.getsize(path) / 1024:.0f} KB"
+            for path in paths
+        ]
+        await message.answer("Backup done:\n" + "\n".join(lines))
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import time
+from typing import Dict
+
+from aiogram import types
+from aiogram.utils.exceptions import (
+    MessageNotModified,
+    RetryAfter,
+    TelegramAPIError,
+)
+
+from config import BROADCAST_RATE, bot
+from database import AsyncBroadcasts, AsyncSubscribitions
+from outbound import Priority, TokenBucket, outbound_priority
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 100
+REPORT_INTERVAL = 5
+
+users_db = AsyncSubscribitions.shared("subscriptions.db")
+jobs_db = AsyncBroadcasts.shared("subscriptions.db")
+
+
+class BroadcastJob:
+    """Sends text to every user from subscriptions table
+
+    Users are read by chunks in user_id order. Chunk is sent concurrently at
+    BROADCAST_RATE messages per second, then progress is saved, so after a
+    crash the job is resumed from the last saved chunk. Messages are sent
+    with the lowest outbound priority, so replies to users go first. Flood
+    errors left after retries of the scheduler pause the whole job.
+
+    The job is sent by one worker, but its status lives in jobs_db, so
+    /broadcast_cancel sent to any worker is noticed after the current chunk.
+    """
+
+    def __init__(self, job: Dict) -> None:
+        self.id = job["id"]
+        self.text = job["text"]
+        self.admin_chat = job["admin_chat"]
+        self.last_user_id = job["last_user_id"]
+        self.sent = job["sent"]
+        self.failed = job["failed"]
+        self.bucket = TokenBucket(BROADCAST_RATE)
+        self.started_at = time.monotonic()
+        self._sent_on_start = self.sent + self.failed
+        self._report: types.Message | None = None
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return (self.sent + self.failed - self._sent_on_start) / max(elapsed, 1e-9)
+
+    def status(self) -> str:
+        return (
+            f"Broadcast #{self.id}: {self.sent} sent, {self.failed} failed, "
+            f"{self.rate:.1f} msg/s"
+        )
+
+    async def _send(self, user_id: int) -> bool:
+        while True:
+            await self.bucket.acquire()
+            try:
+                with outbound_priority(Priority.BROADCAST):
+                    await bot.send_message(user_id, self.text)
+                return True
+            except RetryAfter as e:
+                log.warning(
+                    "Broadcast #%s: flood control, waiting %ss", self.id, e.timeout
+                )
+                self.bucket.pause(e.timeout)
+            except TelegramAPIError:
+                # blocked the bot, deleted account and so on
+                return False
+
+    async def report(self, text: str) -> None:
+        """Send or update progress message, the job goes on if it fails"""
+        try:
+            if self._report is None:
+                self._report = await bot.send_message(self.admin_chat, text)
+            else:
+                await self._report.edit_text(text)
+        except MessageNotModified:
+            pass
+        except TelegramAPIError:
+            log.warning(
+                "Broadcast #%s: progress is not reported", self.id, exc_info=True
+            )
+
+    async def run(self) -> None:
+        await self.report(self.status())
+        reported_at = time.monotonic()
+
+        cancelled = False
+        async for user_ids in users_db.iter_user_ids(self.last_user_id, CHUNK_SIZE):
+            job = await jobs_db.get_job(self.id)
+            cancelled = job is None or job["status"] == "cancelling"
+            if cancelled:
+                break
+            results = await asyncio.gather(*map(self._send, user_ids))
+            self.sent += sum(results)
+            self.failed += len(results) - sum(results)
+            self.last_user_id = user_ids[-1]
+            await jobs_db.save_progress(
+                self.id, self.last_user_id, self.sent, self.failed
+            )
+            if time.monotonic() - reported_at > REPORT_INTERVAL:
+                reported_at = time.monotonic()
+                await self.report(self.status())
+
+        status = "cancelled" if cancelled else "done"
+        await jobs_db.set_status(self.id, status)
+        await self.report(f"{self.status()}\n\nStatus: {status}")
+
+
+class Broadcaster:
+    current: BroadcastJob | None = None
+    _task: asyncio.Task | None = None
+
+    @classmethod
+    def _start(cls, job: Dict) -> None:
+        cls.current = BroadcastJob(job)
+        cls._task = asyncio.create_task(cls.current.run())
+        cls._task.add_done_callback(cls._finished)
+
+    @classmethod
+    def _finished(cls, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Broadcast failed", exc_info=task.exception())
+            # otherwise the job blocks new ones and is resumed on restart
+            cls._task = asyncio.create_task(
+                jobs_db.set_status(cls.current.id, "failed")
+            )
+        cls.current = None
+
+    @classmethod
+    async def resume(cls) -> None:
+        """Continue a job interrupted by restart"""
+        jobs = await jobs_db.get_running()
+        if jobs and cls.current is None:
+            cls._start(jobs[0])
+
+    @staticmethod
+    async def broadcast(message: types.Message) -> None:
+        text = message.get_args()
+        if not text:
+            await message.answer("Write message text after command: /broadcast Hello!")
+            return
+        job_id = await jobs_db.create_job(text, message.chat.id)
+        if job_id is None:
+            await message.answer("Another broadcast is running: /broadcast_status")
+            return
+        Broadcaster._start(
+            {
+                "id": job_id,
+                "text": text,
+                "admin_chat": message.chat.id,
+                "last_user_id": 0,
+                "sent": 0,
+                "failed": 0,
+            }
+        )
+
+    @staticmethod
+    async def broadcast_status(message: types.Message) -> None:
+        jobs = await jobs_db.get_running()
+        if not jobs:
+            await message.answer("There is no running broadcast")
+            return
+        job, current = jobs[0], Broadcaster.current
+        if current is not None and current.id == job["id"]:
+            # sent by this worker, so the rate is known
+            await message.answer(current.status())
+            return
+        await message.answer(
+            f"Broadcast #{job['id']}: {job['sent']} sent, {job['failed']} failed, "
+            f"{job['status']}"
+        )
+
+    @staticmethod
+    async def cancel_broadcast(message: types.Message) -> None:
+        job_id = await jobs_db.request_cancel()
+        if job_id is None:
+            await message.answer("There is no running broadcast")
+            return
+        await message.answer(f"Broadcast #{job_id} will stop after current chunk")
@@ -0,0 +1,37 @@
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List
+
+Subscriber = Callable[[Any], Awaitable[None]]
+
+_subscribers: Dict[str, List[Subscriber]] = defaultdict(list)
+_transport: Callable[[str, Any], None] | None = None
+
+
+def subscribe(topic: str) -> Callable[[Subscriber], Subscriber]:
+    """Register a coroutine called when another worker publishes the topic"""
+
+    def decorator(callback: Subscriber) -> Subscriber:
+        _subscribers[topic].append(callback)
+        return callback
+
+    return decorator
+
+
+def set_transport(transport: Callable[[str, Any], None] | None) -> None:
+    """Set function which delivers published events to other workers"""
+    global _transport
+    _transport = transport
+
+
+def publish(topic: str, payload: Any) -> None:
+    """Notify other worker processes. Does nothing in single process mode
+
+    Publisher is expected to have already applied the change locally.
+    """
+    if _transport is not None:
+        _transport(topic, payload)
+
+
+async def dispatch_event(topic: str, payload: Any) -> None:
+    for callback in _subscribers[topic]:
+        await callback(payload)
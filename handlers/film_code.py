@@ -1,41 +1,172 @@
+import asyncio
+import logging
+from typing import Dict
+
 from aiogram import types
-from config import ADMIN_IDS
-from database import AsyncFilmDatabase, AsyncSubscribitions
-from .subscribed import check_subscriptions, unsubscribed
+from aiogram.dispatcher.webhook import SendMessage
+from aiogram.utils.exceptions import (
+    CantParseUrl,
+    FileIsTooBig,
+    InvalidHTTPUrlContent,
+    PhotoDimensions,
+    TelegramAPIError,
+    TypeOfFileMismatch,
+    UnsupportedUrlProtocol,
+    WrongFileIdentifier,
+    WrongRemoteFileIdSpecified,
+)
+from config import FILM_CACHE
+from database import AsyncFilmDatabase, Film
+from database.analytics import OTHER
+from .events import publish
+from .stats import analytics
+from .subscribed import has_access, unsubscribed
+from .throttling import rate_limit
+
+log = logging.getLogger(__name__)
+
+films_db = AsyncFilmDatabase.shared("films.db", cache=FILM_CACHE != "off")
+
+CAPTION_LIMIT = 1024
+# longer unknown codes are counted under one key
+MAX_CODE_LENGTH = 10
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".webm", ".mkv")
+# errors after which media of the film is detached
+FILE_ERRORS = (
+    CantParseUrl,
+    FileIsTooBig,
+    InvalidHTTPUrlContent,
+    PhotoDimensions,
+    TypeOfFileMismatch,
+    UnsupportedUrlProtocol,
+    WrongFileIdentifier,
+    WrongRemoteFileIdSpecified,
+)
+# the same errors without their own exception class
+FILE_ERROR_TEXTS = ("invalid file_id", "wrong type of the web page content")
+
+# film code -> file_id of the upload in progress, None if it fails
+_uploads: Dict[int, asyncio.Future] = {}
+
+
+def film_card(film: Film) -> str:
+    return (
+        f"🎞️ Title: {film.title} ({film.year})\n"
+        f"🎬 Director: {film.director}\n"
+        f"📃 Description:\n{film.description}"
+    )
+
+
+def miss_key(code: str) -> str:
+    """Normalize unknown code for analytics, so "007" and "7" are one key"""
+    code = code.strip()
+    if code.isascii() and code.isdigit() and len(code) <= MAX_CODE_LENGTH:
+        return str(int(code))
+    # e.g. digits inside a sentence
+    return OTHER
+
+
+def media_type_of(source: str) -> str:
+    """Guess media type of a link or path by its extension"""
+    return "video" if source.lower().endswith(VIDEO_EXTENSIONS) else "photo"
 
 
-films_db = AsyncFilmDatabase("films.db")
-spons_db = AsyncSubscribitions("subscriptions.db")
+def is_file_error(error: TelegramAPIError) -> bool:
+    """Whether Telegram rejected the file itself, not the request"""
+    return isinstance(error, FILE_ERRORS) or any(
+        text in str(error).lower() for text in FILE_ERROR_TEXTS
+    )
 
 
-async def find_film_code(message: types.Message) -> None:
-    user_id = message.from_id
-    if not (user_id in ADMIN_IDS):
-        subscribed = (
-            True
-            if all(
-                (
-                    await spons_db.is_subscribed_to_all(user_id),
-                    await check_subscriptions(user_id),
-                )
+async def send_media(
+    message: types.Message, film: Film, caption: str | None = None
+) -> bool:
+    """Reply with poster or trailer of the film
+
+    Media is uploaded from media_source only once: file_id of the upload is
+    saved and later replies refer to it, which costs a single API call.
+    Lookups which come while the film is uploaded wait for its file_id.
+    Media which Telegram rejects or a missing file is detached from the
+    film, so it is not uploaded again on every lookup. Other errors, e.g.
+    a deleted message to reply to, leave the media as it is.
+
+    :return: False if the film has no media which can be sent
+    :rtype: bool
+    """
+    send = message.reply_photo if film.media_type == "photo" else message.reply_video
+    file_id = film.media_file_id
+    if file_id is None and film.code in _uploads:
+        file_id = await asyncio.shield(_uploads[film.code])
+        if file_id is None:
+            return False
+    if file_id:
+        try:
+            await send(file_id, caption=caption)
+            return True
+        except TelegramAPIError as e:
+            log.warning("Cannot send media of film %s: %s", film.code, e)
+            if not is_file_error(e):
+                # e.g. network error, try again on the next lookup
+                return False
+            # e.g. file_id of another bot, upload it again if possible
+
+    if film.media_source:
+        upload = _uploads[film.code] = asyncio.get_running_loop().create_future()
+        try:
+            source = film.media_source
+            if not source.startswith(("http://", "https://")):
+                source = types.InputFile(source)
+            sent = await send(source, caption=caption)
+        except (TelegramAPIError, OSError) as e:
+            log.warning(
+                "Cannot upload media of film %s from %s: %s",
+                film.code,
+                film.media_source,
+                e,
             )
-            else False
-        )
+            if isinstance(e, TelegramAPIError) and not is_file_error(e):
+                return False
+            # dead link, missing file or a file Telegram does not accept
+        else:
+            file_id = sent.photo[-1].file_id if sent.photo else sent.video.file_id
+            upload.set_result(file_id)
+            await films_db.set_media_file_id(film.code, file_id)
+            publish("film", film.code)
+            return True
+        finally:
+            if not upload.done():
+                upload.set_result(None)
+            if _uploads.get(film.code) is upload:
+                del _uploads[film.code]
+
+    await films_db.clear_media(film.code)
+    publish("film", film.code)
+    return False
 
-        if not subscribed:
-            await unsubscribed(message)
-            return
+
+@rate_limit(5)
+async def find_film_code(message: types.Message) -> SendMessage | None:
+    if not await has_access(message.from_id):
+        return await unsubscribed(message)
 
     code = message.text
     film = await films_db.get_film(code)
     if film:
-        await message.reply(
-            f"Here is the information for the film with code {code}:\n\n"
-            f"🎞️ Title: {film['title']} ({film['year']})\n"
-            f"🎬 Director: {film['director']}\n"
-            f"📃 Description:\n{film['description']}"
-        )
+        analytics.record("film_hit", str(film.code))
     else:
-        await message.reply(
-            f"Sorry, I couldn't find any information for the film with code {code}."
+        analytics.record("film_miss", miss_key(code))
+    if film:
+        text = (
+            f"Here is the information for the film with code {code}:\n\n"
+            + film_card(film)
         )
+        if film.media_type:
+            # card goes to the caption if it fits, otherwise after the media
+            caption = text if len(text) <= CAPTION_LIMIT else None
+            if await send_media(message, film, caption) and caption:
+                return None
+        return SendMessage(message.chat.id, text).reply(message)
+    return SendMessage(
+        message.chat.id,
+        f"Sorry, I couldn't find any information for the film with code {code}.",
+    ).reply(message)
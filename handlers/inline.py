@@ -0,0 +1,107 @@
+import time
+from collections import OrderedDict
+from typing import List, Tuple
+
+from aiogram import types
+from aiogram.dispatcher.webhook import AnswerInlineQuery
+
+from config import FILM_CACHE, INLINE_CACHE_SIZE, INLINE_CACHE_TIME
+from database import AsyncFilmDatabase, Film
+from .events import subscribe
+from .film_code import film_card
+from .subscribed import has_access
+from .throttling import rate_limit
+
+PAGE_SIZE = 20
+
+films_db = AsyncFilmDatabase.shared("films.db", cache=FILM_CACHE != "off")
+
+Page = Tuple[List[types.InlineQueryResultArticle], str]
+# (normalized query, offset) -> (expiration time, results, next offset)
+_pages: OrderedDict[Tuple[str, int], Tuple[float, Page]] = OrderedDict()
+
+
+def clear_pages() -> None:
+    """Forget rendered results, call it after films are changed"""
+    _pages.clear()
+
+
+@subscribe("film")
+async def _film_changed(_: str) -> None:
+    # a page of any query may contain the film
+    clear_pages()
+
+
+@subscribe("films")
+async def _films_changed(_: None) -> None:
+    clear_pages()
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _article(film: Film) -> types.InlineQueryResultArticle:
+    return types.InlineQueryResultArticle(
+        id=str(film.code),
+        title=f"{film.title} ({film.year})",
+        description=f"Code {film.code}, {film.director}",
+        input_message_content=types.InputTextMessageContent(film_card(film)),
+    )
+
+
+async def _build_page(query: str, offset: int) -> Page:
+    if query.isdigit():
+        film = await films_db.get_film(query)
+        return ([_article(film)] if film else []), ""
+
+    films, has_more = await films_db.search_films(query, PAGE_SIZE, offset)
+    return [_article(film) for film in films], (
+        str(offset + PAGE_SIZE) if has_more else ""
+    )
+
+
+async def _get_page(query: str, offset: int) -> Page:
+    """Get rendered results from LRU or build them"""
+    key = (query, offset)
+    cached = _pages.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        _pages.move_to_end(key)
+        return cached[1]
+
+    page = await _build_page(query, offset)
+    _pages[key] = (time.monotonic() + INLINE_CACHE_TIME, page)
+    _pages.move_to_end(key)
+    while len(_pages) > INLINE_CACHE_SIZE:
+        _pages.popitem(last=False)
+    return page
+
+
+@rate_limit(5)
+async def inline_films(inline_query: types.InlineQuery) -> AnswerInlineQuery:
+    if not await has_access(inline_query.from_user.id):
+        return AnswerInlineQuery(
+            inline_query.id,
+            [],
+            cache_time=10,
+            is_personal=True,
+            switch_pm_text="Subscribe to sponsor channels first",
+            switch_pm_parameter="subscribe",
+        )
+
+    query = normalize_query(inline_query.query)
+    if not query:
+        return AnswerInlineQuery(
+            inline_query.id, [], cache_time=INLINE_CACHE_TIME, is_personal=True
+        )
+
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    results, next_offset = await _get_page(query, offset)
+    # results are personal because access depends on user's subscriptions
+    return AnswerInlineQuery(
+        inline_query.id,
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=True,
+        next_offset=next_offset,
+    )
@@ -0,0 +1,91 @@
+import contextvars
+import time
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from metrics import (
+    handler_errors_total,
+    handler_seconds,
+    update_seconds,
+    updates_total,
+)
+
+# Handler of the update processed in current task, errors are handled after
+# current_handler is reset
+_handler: contextvars.ContextVar = contextvars.ContextVar(
+    "metrics_handler", default=None
+)
+
+
+def handler_name(handler) -> str:
+    return f"{handler.__module__}.{handler.__qualname__}"
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Observes processing time of every update and every handler
+
+    Handlers which raised are observed too and counted in
+    handler_errors_total. Should be set up after ThrottlingMiddleware, so
+    dropped events are not counted as handler calls.
+    """
+
+    async def on_pre_process_update(self, update: types.Update, data: dict) -> None:
+        data["metrics_started"] = time.perf_counter()
+
+    async def on_post_process_update(
+        self, update: types.Update, results: list, data: dict
+    ) -> None:
+        kind = next((key for key in update.values if key != "update_id"), "unknown")
+        updates_total.inc(kind)
+        update_seconds.observe(time.perf_counter() - data["metrics_started"], kind)
+
+    async def on_pre_process_error(
+        self, update: types.Update, exception: Exception, data: dict
+    ) -> None:
+        handler = _handler.get()
+        if handler is not None:
+            handler_errors_total.inc(handler_name(handler))
+
+    @staticmethod
+    def _start(data: dict) -> None:
+        data["metrics_handler"] = current_handler.get()
+        data["metrics_started"] = time.perf_counter()
+        _handler.set(data["metrics_handler"])
+
+    @staticmethod
+    def _finish(data: dict) -> None:
+        handler = data.get("metrics_handler")
+        if handler is not None:
+            handler_seconds.observe(
+                time.perf_counter() - data["metrics_started"], handler_name(handler)
+            )
+
+    async def on_process_message(self, message: types.Message, data: dict) -> None:
+        self._start(data)
+
+    async def on_post_process_message(
+        self, message: types.Message, results: list, data: dict
+    ) -> None:
+        self._finish(data)
+
+    async def on_process_callback_query(
+        self, callback_query: types.CallbackQuery, data: dict
+    ) -> None:
+        self._start(data)
+
+    async def on_post_process_callback_query(
+        self, callback_query: types.CallbackQuery, results: list, data: dict
+    ) -> None:
+        self._finish(data)
+
+    async def on_process_inline_query(
+        self, inline_query: types.InlineQuery, data: dict
+    ) -> None:
+        self._start(data)
+
+    async def on_post_process_inline_query(
+        self, inline_query: types.InlineQuery, results: list, data: dict
+    ) -> None:
+        self._finish(data)
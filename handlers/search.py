@@ -0,0 +1,98 @@
+import hashlib
+from collections import OrderedDict
+from typing import Tuple
+
+from aiogram import types
+from aiogram.dispatcher.webhook import AnswerCallbackQuery, SendMessage
+from aiogram.utils.callback_data import CallbackData
+
+from config import FILM_CACHE
+from database import AsyncFilmDatabase
+from .subscribed import has_access, unsubscribed
+from .throttling import rate_limit
+
+PAGE_SIZE = 10
+MAX_QUERIES = 10_000
+
+films_db = AsyncFilmDatabase.shared("films.db", cache=FILM_CACHE != "off")
+
+search_cb = CallbackData("search", "query", "page")
+# Callback data is limited to 64 bytes, so buttons carry a short key of the query
+_queries: OrderedDict[str, str] = OrderedDict()
+
+
+def _remember_query(query: str) -> str:
+    key = hashlib.blake2s(query.encode(), digest_size=6).hexdigest()
+    _queries[key] = query
+    _queries.move_to_end(key)
+    while len(_queries) > MAX_QUERIES:
+        _queries.popitem(last=False)
+    return key
+
+
+async def _render_page(
+    query: str, page: int
+) -> Tuple[str, types.InlineKeyboardMarkup | None]:
+    films, has_more = await films_db.search_films(query, PAGE_SIZE, page * PAGE_SIZE)
+    if not films:
+        return f'Nothing was found for "{query}"', None
+
+    lines = [
+        f"{film.code} — {film.title} ({film.year}), {film.director}" for film in films
+    ]
+    text = (
+        f'Results for "{query}", page {page + 1}:\n\n'
+        + "\n".join(lines)
+        + "\n\nSend a film code to get its details"
+    )
+    key = _remember_query(query)
+    buttons = []
+    if page > 0:
+        buttons.append(
+            types.InlineKeyboardButton(
+                "⬅️ Previous", callback_data=search_cb.new(query=key, page=page - 1)
+            )
+        )
+    if has_more:
+        buttons.append(
+            types.InlineKeyboardButton(
+                "Next ➡️", callback_data=search_cb.new(query=key, page=page + 1)
+            )
+        )
+    keyboard = types.InlineKeyboardMarkup().row(*buttons) if buttons else None
+    return text, keyboard
+
+
+@rate_limit(5)
+async def search_films(message: types.Message) -> SendMessage:
+    if not await has_access(message.from_id):
+        return await unsubscribed(message)
+
+    query = " ".join(message.get_args().split())
+    if not query:
+        return SendMessage(
+            message.chat.id, "Send words to search after command: /search matrix"
+        )
+
+    text, keyboard = await _render_page(query, 0)
+    return SendMessage(message.chat.id, text, reply_markup=keyboard)
+
+
+@rate_limit(10)
+async def search_page_handler(
+    callback_query: types.CallbackQuery, callback_data: dict
+) -> AnswerCallbackQuery:
+    if not await has_access(callback_query.from_user.id):
+        return AnswerCallbackQuery(
+            callback_query.id, "You have not subscribed to all channels!"
+        )
+
+    query = _queries.get(callback_data["query"])
+    if query is None:
+        return AnswerCallbackQuery(
+            callback_query.id, "Search is outdated, please send /search again"
+        )
+
+    text, keyboard = await _render_page(query, int(callback_data["page"]))
+    await callback_query.message.edit_text(text, reply_markup=keyboard)
+    return AnswerCallbackQuery(callback_query.id)
@@ -1,40 +1,42 @@
 from aiogram import types
+from aiogram.dispatcher.webhook import SendMessage
 from config import ADMIN_IDS
-from database import AsyncSubscribitions
 
-from handlers.subscribed import check_subscriptions, unsubscribed
+from handlers.subscribed import has_access, unsubscribed
+from handlers.throttling import rate_limit
 
-spons_db = AsyncSubscribitions()
 
-
-async def send_welcome(message: types.Message) -> None:
+@rate_limit(3)
+async def send_welcome(message: types.Message) -> SendMessage:
     user_id = message.from_id
-    if user_id not in ADMIN_IDS:
-        subscribed = (
-            True
-            if all(
-                (
-                    await spons_db.is_subscribed_to_all(user_id),
-                    await check_subscriptions(user_id),
-                )
-            )
-            else False
-        )
+    if not await has_access(user_id):
+        return await unsubscribed(message)
 
-        if not subscribed:
-            await unsubscribed(message)
-            return
-
-        await message.answer(
-            "Hi there! Send me a film code and I'll look up its details."
+    if user_id not in ADMIN_IDS:
+        return SendMessage(
+            message.chat.id,
+            "Hi there! Send me a film code and I'll look up its details.\n"
+            "To find a film by its title, director or description, "
+            "use /search and a few words.",
         )
-        return
 
-    await message.answer(
+    return SendMessage(
+        message.chat.id,
         "Welcome! Here are admin commands:\n\n"
         "*/add_film* - _add new film to bot's database_\n"
+        "*/import_films* - _add films from a CSV or JSON Lines file_\n"
+        "*/export_films* - _download all films, add csv for CSV format_\n"
+        "*/list_films* - _browse all films by code_\n"
         "*/add_sponsor* - _add new sponsor to bot's database_\n"
         "*/get_sponsors* - _get list of all sponsors_\n"
-        "*/remove_sponsor* - _remove a certain sponsor from bot's database_",
+        "*/remove_sponsor* - _remove a certain sponsor from bot's database_\n"
+        "*/search* - _find films by title, director or description_\n"
+        "*/broadcast* - _send a message to all users_\n"
+        "*/broadcast_status* - _show progress of current broadcast_\n"
+        "*/broadcast_cancel* - _stop current broadcast_\n"
+        "*/stats* - _popular films, unknown codes and subscription gate, "
+        "e.g. /stats 24h 7d_\n"
+        "*/backup* - _write compressed snapshots of films and subscriptions_\n"
+        "*/profile* - _start or stop sampling profiler_",
         parse_mode="Markdown",
     )
@@ -7,8 +7,13 @@ class FilmState(StatesGroup):
     director = State()
     year = State()
     description = State()
+    media = State()
 
 
 class AddingState(StatesGroup):
     add_sponsor = State()
     remove_sponsor = State()
+
+
+class ImportState(StatesGroup):
+    document = State()
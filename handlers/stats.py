@@ -0,0 +1,89 @@
+import re
+
+from aiogram import types
+
+from config import (
+    ANALYTICS_DB_FILE,
+    ANALYTICS_FLUSH_INTERVAL,
+    ANALYTICS_RETENTION_DAYS,
+    FILM_CACHE,
+    STATS_TOP,
+    STATS_WINDOWS,
+)
+from database import AsyncAnalytics, AsyncFilmDatabase
+
+analytics = AsyncAnalytics.shared(
+    ANALYTICS_DB_FILE,
+    flush_interval=ANALYTICS_FLUSH_INTERVAL,
+    retention=ANALYTICS_RETENTION_DAYS * 24 * 3600,
+)
+films_db = AsyncFilmDatabase.shared("films.db", cache=FILM_CACHE != "off")
+
+UNITS = {"h": 3600, "d": 24 * 3600}
+MESSAGE_LIMIT = 4096
+
+
+def parse_window(window: str) -> float | None:
+    """Convert "12h" or "7d" to seconds
+
+    :return: seconds or None if window is invalid
+    :rtype: float | None
+    """
+    match = re.fullmatch(r"(\d+)([hd])", window.strip().lower())
+    if not match:
+        return None
+    return int(match[1]) * UNITS[match[2]]
+
+
+def percent(part: int, total: int) -> str:
+    return f"{100 * part / total:.1f}%" if total else "-"
+
+
+def truncate(text: str, limit: int = MESSAGE_LIMIT) -> str:
+    """Cut text at the last whole line which fits into one message"""
+    if len(text) <= limit:
+        return text
+    return text[: text.rfind("\n", 0, limit - 2)] + "\n…"
+
+
+class Stats:
+    @staticmethod
+    async def stats(message: types.Message) -> None:
+        windows = (message.get_args() or "").split() or STATS_WINDOWS
+        seconds = [parse_window(window) for window in windows]
+        if None in seconds:
+            await message.reply('Windows should look like "24h" or "7d"')
+            return
+
+        await analytics.flush()
+        sections = []
+        for window, window_seconds in zip(windows, seconds):
+            totals = await analytics.totals(window_seconds)
+            hits, misses = totals.get("film_hit", 0), totals.get("film_miss", 0)
+            blocked = totals.get("gate_blocked", 0)
+            passed = totals.get("gate_passed", 0)
+            failed = totals.get("gate_failed", 0)
+            lines = [
+                f"📊 Last {window}",
+                f"Lookups: {hits + misses}, unknown codes: "
+                f"{percent(misses, hits + misses)}",
+                f"Gate: {blocked} blocked, {passed} passed the check "
+                f"({percent(passed, blocked)}), {failed} failed it",
+            ]
+
+            top_films = await analytics.top("film_hit", window_seconds, STATS_TOP)
+            if top_films:
+                lines.append("Top films:")
+            for place, (code, count) in enumerate(top_films, 1):
+                film = await films_db.get_film(code)
+                title = film.title if film else "deleted"
+                lines.append(f"{place}. {code} {title} - {count}")
+
+            top_missed = await analytics.top("film_miss", window_seconds, STATS_TOP)
+            if top_missed:
+                lines.append("Top unknown codes:")
+            for place, (code, count) in enumerate(top_missed, 1):
+                lines.append(f"{place}. {code} - {count}")
+            sections.append("\n".join(lines))
+
+        await message.answer(truncate("\n\n".join(sections)))
@@ -1,33 +1,121 @@
+import asyncio
+from typing import Tuple
+
 from aiogram import types
+from aiogram.dispatcher.webhook import AnswerCallbackQuery, SendMessage
 
-from config import bot
+from config import ADMIN_IDS, MEMBER_RECORD_TTL
 from database import AsyncSubscribitions
-from .tg_utils import TelegramUtils
+from .events import publish, subscribe
+from .stats import analytics
+from .tg_utils import TelegramUtils, membership_cache
+from .throttling import rate_limit
+
+db = AsyncSubscribitions.shared("subscriptions.db")
 
-db = AsyncSubscribitions()
 
+async def check_subscriptions(user_id: int, recheck: bool = False) -> bool:
+    """Check user's membership in every sponsor channel
 
-async def check_subscriptions(user_id: int) -> bool:
+    Cached answers are used first, then membership saved from chat_member
+    updates, and only the rest channels are checked in Telegram concurrently.
+
+    :param user_id: telegram user id
+    :type user_id: int
+    :param recheck: ignore cached and saved negative answers, defaults to False
+    :type recheck: bool, optional
+    :return: True if user is a member of all channels otherwise False
+    :rtype: bool
+    """
+    missed = []
     for channel in await db.get_sponsors():
-        if not await TelegramUtils.is_member(channel, user_id):
+        cached = membership_cache.get(channel, user_id, allow_negative=not recheck)
+        if cached is None:
+            missed.append(channel)
+        elif not cached:
+            return False
+    if not missed:
+        return True
+
+    saved = await db.get_memberships(user_id, missed, MEMBER_RECORD_TTL)
+    for channel, is_member in saved.items():
+        if not is_member and recheck:
+            continue
+        membership_cache.set(channel, user_id, is_member)
+        if not is_member:
             return False
+        missed.remove(channel)
+
+    results = await asyncio.gather(
+        *(TelegramUtils.is_member(channel, user_id) for channel in missed)
+    )
+    checked = {
+        channel: result
+        for channel, result in zip(missed, results)
+        if result is not None
+    }
+    for channel, is_member in checked.items():
+        membership_cache.set(channel, user_id, is_member)
+    if checked:
+        # later changes come with chat_member updates
+        await db.set_memberships(user_id, checked)
+    return all(results)
+
 
-    return True
+async def has_access(user_id: int) -> bool:
+    """Check if user may look films up
 
+    Admins always have access, other users should be subscribed to all sponsors.
+    """
+    if user_id in ADMIN_IDS:
+        return True
+    # users not verified with the button are refused without asking Telegram
+    return await db.is_subscribed_to_all(user_id) and await check_subscriptions(user_id)
 
-async def check_subs_handler(callback_query: types.CallbackQuery) -> None:
+
+@rate_limit(3)
+async def check_subs_handler(
+    callback_query: types.CallbackQuery,
+) -> AnswerCallbackQuery:
     user_id = callback_query.from_user.id
 
-    subscribed = await check_subscriptions(user_id)
+    # read before the check, a sponsor added meanwhile makes the result stale
+    generation = await db.get_generation()
+    subscribed = await check_subscriptions(user_id, recheck=True)
 
     answer = "You have not subscribed to all channels!"
     if subscribed:
         answer = "Have a great day!"
-        await db._update_subscription_status(user_id, True)
-    await bot.answer_callback_query(callback_query.id, answer)
+        await db._update_subscription_status(user_id, True, generation)
+    analytics.record("gate_passed" if subscribed else "gate_failed")
+    return AnswerCallbackQuery(callback_query.id, answer)
+
+
+async def track_membership(update: types.ChatMemberUpdated) -> None:
+    """Save joins and leaves of sponsor channels"""
+    if not update.chat.username:
+        return
+    sponsors = {name.lower(): name for name in await db.get_sponsors()}
+    channel = sponsors.get(f"@{update.chat.username}".lower())
+    if channel is None:
+        return
+
+    user_id = update.new_chat_member.user.id
+    is_member = update.new_chat_member.is_chat_member()
+    await db.set_memberships(user_id, {channel: is_member})
+    membership_cache.set(channel, user_id, is_member)
+    publish("member", (channel, user_id, is_member))
+    if not is_member:
+        await db._update_subscription_status(user_id, False)
 
 
-async def unsubscribed(message: types.Message) -> None:
+@subscribe("member")
+async def _update_member(payload: Tuple[str, int, bool]) -> None:
+    membership_cache.set(*payload)
+
+
+async def unsubscribed(message: types.Message) -> SendMessage:
+    analytics.record("gate_blocked")
     sponsor_list = await db.get_sponsors()
     await message.answer(
         "You have not subscribed to all sponsor channels. Please subscribe:\n"
@@ -38,6 +126,8 @@ async def unsubscribed(message: types.Message) -> None:
         text="✅ Check subscriptions", callback_data="check_subs"
     )
     keyboard.add(check_button)
-    await message.answer(
-        "Press the button to update your subscriptions", reply_markup=keyboard
+    return SendMessage(
+        message.chat.id,
+        "Press the button to update your subscriptions",
+        reply_markup=keyboard,
     )
@@ -1,17 +1,130 @@
-from config import bot
-from aiogram.utils.exceptions import BadRequest
+import logging
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+from config import (
+    MEMBER_CACHE_SIZE,
+    MEMBER_CACHE_TTL,
+    NONMEMBER_CACHE_TTL,
+    bot,
+)
+from aiogram.utils.exceptions import BadRequest, TelegramAPIError
+from metrics import (
+    cache_requests_total,
+    membership_check_seconds,
+    membership_checks_total,
+)
+
+log = logging.getLogger(__name__)
+
+
+class MembershipCache:
+    """LRU cache of channel membership keyed by (channel, user_id)
+
+    Positive and negative answers have their own TTL, so a user who has
+    just joined a channel is not locked out for long.
+    """
+
+    def __init__(
+        self,
+        positive_ttl: float = MEMBER_CACHE_TTL,
+        negative_ttl: float = NONMEMBER_CACHE_TTL,
+        max_size: int = MEMBER_CACHE_SIZE,
+    ) -> None:
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries: OrderedDict[Tuple[str, int], Tuple[bool, float]] = OrderedDict()
+
+    def get(
+        self, channel_name: str, user_id: int, allow_negative: bool = True
+    ) -> bool | None:
+        """Get cached membership
+
+        :return: cached answer or None if there is no fresh entry
+        :rtype: bool | None
+        """
+        key = (channel_name, user_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            cache_requests_total.inc("membership", "miss")
+            return None
+        is_member, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            cache_requests_total.inc("membership", "miss")
+            return None
+        if not is_member and not allow_negative:
+            cache_requests_total.inc("membership", "miss")
+            return None
+        self._entries.move_to_end(key)
+        cache_requests_total.inc("membership", "hit")
+        return is_member
+
+    def set(self, channel_name: str, user_id: int, is_member: bool) -> None:
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        if ttl <= 0:
+            return
+        key = (channel_name, user_id)
+        self._entries[key] = (is_member, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate_channel(self, channel_name: str) -> None:
+        """Drop every cached entry of the channel"""
+        for key in [key for key in self._entries if key[0] == channel_name]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+membership_cache = MembershipCache()
 
 
 class TelegramUtils:
     @staticmethod
-    async def is_member(channel_name: str, user_id: int) -> bool:
+    @membership_check_seconds.time()
+    async def is_member(channel_name: str, user_id: int) -> bool | None:
+        """Ask Telegram whether user is a member of the channel
+
+        Flood and network errors are retried by the outbound scheduler.
+
+        :return: membership or None if it is unknown, e.g. bot is not an
+            admin of the channel or Telegram keeps failing
+        :rtype: bool | None
+        """
         try:
             result = await bot.get_chat_member(channel_name, user_id)
-            if result.status == "left":
-                return False
         except BadRequest as e:
-            error_message = e.args[0]
-            if error_message.lower() == "invalid user_id specified":
+            if e.args[0].lower() == "invalid user_id specified":
+                membership_checks_total.inc("not_member")
                 return False
-        else:
-            return True
+            log.warning("Can't check membership in %s: %s", channel_name, e)
+            membership_checks_total.inc("unknown")
+            return None
+        except TelegramAPIError as e:
+            log.warning("Can't check membership in %s: %s", channel_name, e)
+            membership_checks_total.inc("unknown")
+            return None
+        is_member = result.status not in ("left", "kicked")
+        membership_checks_total.inc("member" if is_member else "not_member")
+        return is_member
+
+    @staticmethod
+    async def is_member_cached(
+        channel_name: str, user_id: int, allow_negative: bool = True
+    ) -> bool | None:
+        """Same as is_member but answers from membership_cache when possible
+
+        Errors (None result) are not cached.
+        """
+        cached = membership_cache.get(channel_name, user_id, allow_negative)
+        if cached is not None:
+            return cached
+        result = await TelegramUtils.is_member(channel_name, user_id)
+        if result is not None:
+            membership_cache.set(channel_name, user_id, result)
+        return result
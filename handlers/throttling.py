@@ -0,0 +1,129 @@
+import time
+from typing import Callable, Dict, Tuple
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from config import ADMIN_IDS, THROTTLE_LIMIT, THROTTLE_PERIOD
+from metrics import throttled_total
+
+EVICTION_INTERVAL = 60
+
+
+def rate_limit(limit: int, period: float = THROTTLE_PERIOD) -> Callable:
+    """Set how many times per period one user may trigger the handler"""
+
+    def decorator(handler: Callable) -> Callable:
+        handler.throttling_limit = limit
+        handler.throttling_period = period
+        return handler
+
+    return decorator
+
+
+class Window:
+    """Two adjacent fixed windows which approximate a sliding window"""
+
+    __slots__ = ("start", "previous", "current", "warned")
+
+    def __init__(self, start: float) -> None:
+        self.start = start
+        self.previous = 0
+        self.current = 0
+        self.warned = False
+
+    def hit(self, now: float, period: float) -> float:
+        """Count the event and get approximate number of events in last period"""
+        elapsed = now - self.start
+        if elapsed >= period:
+            windows = int(elapsed // period)
+            self.previous = self.current if windows == 1 else 0
+            self.current = 0
+            self.start += windows * period
+            self.warned = False
+            elapsed = now - self.start
+        self.current += 1
+        return self.previous * (1 - elapsed / period) + self.current
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Per-user sliding window rate limit for every handler
+
+    Limits are set by rate_limit decorator, THROTTLE_LIMIT per
+    THROTTLE_PERIOD seconds by default. The first throttled event in a window
+    gets a short answer, the rest are dropped silently. Admins are not limited.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._windows: Dict[Tuple[int, str], Window] = {}
+        self._evicted_at = time.monotonic()
+
+    def _evict(self, now: float) -> None:
+        if now - self._evicted_at < EVICTION_INTERVAL:
+            return
+        self._evicted_at = now
+        # a window older than its two periods counts nothing
+        max_age = 2 * max(THROTTLE_PERIOD, EVICTION_INTERVAL)
+        self._windows = {
+            key: window
+            for key, window in self._windows.items()
+            if now - window.start < max_age
+        }
+
+    def _throttle(self, user_id: int) -> Window | None:
+        """Count the event and get its window if limit is exceeded"""
+        if user_id in ADMIN_IDS:
+            return None
+        handler = current_handler.get()
+        limit = getattr(handler, "throttling_limit", THROTTLE_LIMIT)
+        period = getattr(handler, "throttling_period", THROTTLE_PERIOD)
+
+        now = time.monotonic()
+        self._evict(now)
+        key = (user_id, handler.__qualname__)
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = Window(now)
+        if window.hit(now, period) <= limit:
+            return None
+        throttled_total.inc(f"{handler.__module__}.{handler.__qualname__}")
+        return window
+
+    async def on_process_message(self, message: types.Message, data: dict) -> None:
+        window = self._throttle(message.from_id)
+        if window is None:
+            return
+        if not window.warned:
+            window.warned = True
+            await message.answer("Too many requests! Please slow down")
+        raise CancelHandler()
+
+    async def on_process_callback_query(
+        self, callback_query: types.CallbackQuery, data: dict
+    ) -> None:
+        window = self._throttle(callback_query.from_user.id)
+        if window is None:
+            return
+        if not window.warned:
+            window.warned = True
+            await callback_query.answer("Too many requests! Please slow down")
+        raise CancelHandler()
+
+    async def on_process_inline_query(
+        self, inline_query: types.InlineQuery, data: dict
+    ) -> None:
+        window = self._throttle(inline_query.from_user.id)
+        if window is None:
+            return
+        if not window.warned:
+            window.warned = True
+            await inline_query.answer(
+                [],
+                cache_time=1,
+                is_personal=True,
+                switch_pm_text="Too many requests! Please slow down",
+                switch_pm_parameter="throttled",
+            )
+        raise CancelHandler()
@@ -0,0 +1,169 @@
+"""Logging which never writes to disk from the event loop
+
+Records are put to a bounded queue and written by a listener thread as
+JSON lines to a size-rotated file. Every record carries update id, user id
+and handler name of the update being processed. High-volume levels can be
+sampled, and records which do not fit in the queue are dropped, so logging
+never stalls update processing.
+"""
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+
+from metrics import log_records_dropped_total
+
+CONTEXT_FIELDS = ("update_id", "user_id", "handler")
+
+
+def parse_sampling(spec: str) -> Dict[int, float]:
+    """Parse share of records kept per level
+
+    :param spec: e.g. "DEBUG=0.01,INFO=0.5", levels not listed are kept
+    :type spec: str
+    """
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        level, rate = item.split("=")
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """Adds update id, user id and handler name of current update"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        update = types.Update.get_current()
+        user = types.User.get_current()
+        handler = current_handler.get(None)
+        record.update_id = update.update_id if update is not None else None
+        record.user_id = user.id if user is not None else None
+        record.handler = (
+            f"{handler.__module__}.{handler.__qualname__}"
+            if handler is not None
+            else None
+        )
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a share of records of the given levels"""
+
+    def __init__(self, rates: Dict[int, float]) -> None:
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno)
+        if rate is None or random.random() < rate:
+            return True
+        log_records_dropped_total.inc(record.levelname, "sampled")
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # arguments may change after the call, so the message is rendered
+        # now; formatting of the record and its traceback is left to the
+        # listener thread
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped_total.inc(record.levelname, "overflow")
+
+
+class Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # queue may be full on stop, wait for the thread to take records
+        self.queue.put(self._sentinel)
+
+
+_listener: Listener | None = None
+
+
+def setup_logging(
+    level: int,
+    filename: str,
+    max_bytes: int,
+    backups: int,
+    sampling: str = "",
+    queue_size: int = 10_000,
+) -> None:
+    """Send records of root logger to the file through a listener thread
+
+    :param level: minimal level of records
+    :type level: int
+    :param filename: path to log file
+    :type filename: str
+    :param max_bytes: size of file after which it is rotated
+    :type max_bytes: int
+    :param backups: number of rotated files kept
+    :type backups: int
+    :param sampling: share of records kept per level, see parse_sampling
+    :type sampling: str, optional
+    :param queue_size: records waiting for the listener, defaults to 10_000
+    :type queue_size: int, optional
+    """
+    global _listener
+    if _listener is not None:
+        return
+    file_handler = RotatingFileHandler(
+        filename, maxBytes=max_bytes, backupCount=backups, encoding="utf-8"
+    )
+    file_handler.setFormatter(JsonFormatter())
+    records: queue.Queue = queue.Queue(queue_size)
+    handler = NonBlockingQueueHandler(records)
+    handler.addFilter(SamplingFilter(parse_sampling(sampling)))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = Listener(records, file_handler)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Write records left in the queue and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
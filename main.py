@@ -1,65 +1,180 @@
 import logging
+import os
 
 from aiogram import Dispatcher
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher.filters import Text
+from aiogram.dispatcher.storage import BaseStorage
 from aiogram.utils import executor
 
-from config import ADMIN_IDS, DEBUG, bot
-from handlers import film_code, start, subscribed
-from handlers.admin import AsyncSponsor, FilmProcess, cancel_handler
-from handlers.states import AddingState, FilmState
+from config import (
+    ADMIN_IDS,
+    ALLOWED_UPDATES,
+    BOT_MODE,
+    DEBUG,
+    FILM_CACHE,
+    FSM_DB_FILE,
+    FSM_FLUSH_INTERVAL,
+    FSM_STORAGE,
+    FSM_TTL,
+    LOG_BACKUPS,
+    LOG_FILE,
+    LOG_MAX_BYTES,
+    LOG_QUEUE_SIZE,
+    LOG_SAMPLING,
+    METRICS_HOST,
+    METRICS_PORT,
+    REDIS_DB,
+    REDIS_HOST,
+    REDIS_PORT,
+    bot,
+)
+from database import Database, SQLiteStorage
+from handlers import film_code, inline, search, start, subscribed
+from handlers.admin import (
+    AsyncSponsor,
+    FilmImport,
+    FilmList,
+    FilmProcess,
+    Profiling,
+    cancel_handler,
+    films_cb,
+)
+from handlers.backup import Backup
+from handlers.broadcast import Broadcaster
+from handlers.instrumentation import MetricsMiddleware
+from handlers.stats import Stats
+from handlers.states import AddingState, FilmState, ImportState
+from handlers.throttling import ThrottlingMiddleware
+from logs import setup_logging
+import metrics
+from webhook import start_webhook
+
+
+def worker_log_file(filename: str) -> str:
+    """Append worker index to file name, rotation is not safe across processes"""
+    index = os.getenv("WORKER_INDEX")
+    if index is None:
+        return filename
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{index}{ext}"
+
+
+def get_storage() -> BaseStorage:
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if FSM_STORAGE == "redis":
+        from aiogram.contrib.fsm_storage.redis import RedisStorage2
+
+        return RedisStorage2(
+            REDIS_HOST,
+            REDIS_PORT,
+            db=REDIS_DB,
+            state_ttl=int(FSM_TTL),
+            data_ttl=int(FSM_TTL),
+        )
+    return SQLiteStorage(FSM_DB_FILE, ttl=FSM_TTL, flush_interval=FSM_FLUSH_INTERVAL)
 
-storage = MemoryStorage()
+
+storage = get_storage()
 dp = Dispatcher(bot, storage=storage)
-logging.basicConfig(
-    level=logging.DEBUG if DEBUG else logging.INFO,
-    filename="app.log",
-    filemode="a",
-    format="%(asctime)s %(levelname)s %(message)s",
+setup_logging(
+    logging.DEBUG if DEBUG else logging.INFO,
+    worker_log_file(LOG_FILE),
+    LOG_MAX_BYTES,
+    LOG_BACKUPS,
+    LOG_SAMPLING,
+    LOG_QUEUE_SIZE,
 )
 
 
+dp.middleware.setup(ThrottlingMiddleware())
+dp.middleware.setup(MetricsMiddleware())
+
+dp.register_message_handler(start.send_welcome, commands=["start"])
+dp.register_message_handler(search.search_films, commands=["search"])
+dp.register_message_handler(
+    Broadcaster.broadcast,
+    lambda message: message.from_id in ADMIN_IDS,
+    commands=["broadcast"],
+)
+dp.register_message_handler(
+    Broadcaster.broadcast_status,
+    lambda message: message.from_id in ADMIN_IDS,
+    commands=["broadcast_status"],
+)
 dp.register_message_handler(
-    lambda message: start.send_welcome(message),
-    commands=["start"],
+    Broadcaster.cancel_broadcast,
+    lambda message: message.from_id in ADMIN_IDS,
+    commands=["broadcast_cancel"],
+)
+# before film codes, as its arguments contain digits
+dp.register_message_handler(
+    Stats.stats,
+    lambda message: message.from_id in ADMIN_IDS,
+    commands=["stats"],
 )
 dp.register_message_handler(
     film_code.find_film_code,
     regexp=r"\d+",
 )
 dp.register_message_handler(
-    lambda message: message.from_id in AsyncSponsor,
     FilmProcess.add_new_film,
+    lambda message: message.from_id in ADMIN_IDS,
     commands=["add_film"],
 )
 dp.register_message_handler(
-    lambda message: message.from_id in ADMIN_IDS,
     AsyncSponsor.add_state,
+    lambda message: message.from_id in ADMIN_IDS,
     commands=["add_sponsor"],
 )
 dp.register_message_handler(
-    lambda message: message.from_id in ADMIN_IDS,
     AsyncSponsor.add_sponsor,
+    lambda message: message.from_id in ADMIN_IDS,
     regexp=r"@(\w+)",
     state=AddingState.add_sponsor,
 )
 dp.register_message_handler(
-    lambda message: message.from_id in ADMIN_IDS,
     AsyncSponsor.get_sponsors,
+    lambda message: message.from_id in ADMIN_IDS,
     commands=["get_sponsors"],
 )
 dp.register_message_handler(
-    lambda message: message.from_id in ADMIN_IDS,
     AsyncSponsor.remove_state,
+    lambda message: message.from_id in ADMIN_IDS,
     commands=["remove_sponsor"],
 )
 dp.register_message_handler(
-    lambda message: message.from_id in ADMIN_IDS,
     AsyncSponsor.remove_sponsor,
+    lambda message: message.from_id in ADMIN_IDS,
     regexp=r"@(\w+)",
     state=AddingState.remove_sponsor,
 )
+dp.register_message_handler(
+    FilmImport.import_state,
+    lambda message: message.from_id in ADMIN_IDS,
+    commands=["import_films"],
+)
+dp.register_message_handler(
+    FilmImport.export,
+    lambda message: message.from_id in ADMIN_IDS,
+    commands=["export_films"],
+)
+dp.register_message_handler(
+    FilmList.list_films,
+    lambda message: message.from_id in ADMIN_IDS,
+    commands=["list_films"],
+)
+dp.register_message_handler(
+    Backup.backup,
+    lambda message: message.from_id in ADMIN_IDS,
+    commands=["backup"],
+)
+dp.register_message_handler(
+    Profiling.profile,
+    lambda message: message.from_id in ADMIN_IDS,
+    commands=["profile"],
+)
 dp.register_message_handler(
     lambda message: cancel_handler(message, dp.current_state()),
     Text("q"),
@@ -72,12 +187,59 @@ dp.register_message_handler(FilmProcess.process_film_year, state=FilmState.year)
 dp.register_message_handler(
     FilmProcess.process_film_description, state=FilmState.description
 )
+dp.register_message_handler(
+    FilmProcess.process_film_media,
+    content_types=["text", "photo", "video"],
+    state=FilmState.media,
+)
+dp.register_message_handler(
+    FilmImport.process_document,
+    lambda message: message.from_id in ADMIN_IDS,
+    content_types=["document"],
+    state=ImportState.document,
+)
 
+dp.register_callback_query_handler(subscribed.check_subs_handler, text="check_subs")
+dp.register_callback_query_handler(
+    search.search_page_handler, search.search_cb.filter()
+)
 dp.register_callback_query_handler(
-    lambda callback_query: subscribed.check_subs_handler(callback_query),
-    text="check_subs",
+    FilmList.page_handler,
+    films_cb.filter(),
+    lambda callback_query: callback_query.from_user.id in ADMIN_IDS,
 )
+dp.register_inline_handler(inline.inline_films)
+dp.register_chat_member_handler(subscribed.track_membership)
+
+
+async def on_startup(dispatcher: Dispatcher) -> None:
+    await Database.connect_all()
+    if METRICS_PORT:
+        port = METRICS_PORT + int(os.getenv("WORKER_INDEX", "0"))
+        await metrics.start_server(METRICS_HOST, port)
+    if FILM_CACHE == "preload":
+        await film_code.films_db.preload()
+    # with several workers only the first one resumes broadcasts and backups
+    if os.getenv("WORKER_INDEX", "0") == "0":
+        await Broadcaster.resume()
+        Backup.start()
+
+
+async def on_shutdown(dispatcher: Dispatcher) -> None:
+    Backup.stop()
+    await Database.close_all()
+    await bot.scheduler.close()
+    await metrics.stop_server()
 
 
 if __name__ == "__main__":
-    executor.start_polling(dp, skip_updates=True)
+    if BOT_MODE == "webhook":
+        start_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(
+            dp,
+            skip_updates=True,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown,
+            allowed_updates=ALLOWED_UPDATES,
+        )
@@ -0,0 +1,305 @@
+"""Counters and histograms exposed in Prometheus text format
+
+Metrics are plain in-process objects: updating one is a dict lookup and
+a few additions, so they are cheap enough for every handler call and
+database query. ``start_server`` serves them over HTTP at /metrics.
+"""
+import bisect
+import functools
+import os
+import signal
+import time
+from collections import Counter as _Counter
+from types import FrameType
+from typing import Callable, Dict, List, Tuple
+
+from aiohttp import web
+
+# seconds
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Labels = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        registry.append(self)
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Labels = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Labels = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # labels -> [count per bucket..., count over the last bucket, sum]
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self._values.get(labels)
+        if counts is None:
+            counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, *labels: str) -> Callable:
+        """Decorator observing duration of a coroutine function"""
+
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, *labels)
+
+            return wrapper
+
+        return decorator
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, counts in self._values.items():
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                le = _format_labels(self.labels, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {total}")
+            suffix = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{suffix} {counts[-1]}")
+            lines.append(f"{self.name}_count{suffix} {total}")
+        return lines
+
+
+registry: List[Metric] = []
+
+
+def render() -> str:
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+
+def query_timer(func: Callable) -> Callable:
+    """Observe duration of a database query method in db_query_seconds
+
+    Only methods of concrete databases are timed, helpers of Database they
+    are built on are not, so a query is observed once.
+    """
+    return db_query_seconds.time(func.__qualname__)(func)
+
+
+updates_total = Counter("bot_updates_total", "Received updates", ("type",))
+update_seconds = Histogram("bot_update_seconds", "Time to process an update", ("type",))
+handler_seconds = Histogram(
+    "bot_handler_seconds", "Time spent in a handler", ("handler",)
+)
+throttled_total = Counter(
+    "bot_throttled_total", "Events dropped by throttling", ("handler",)
+)
+handler_errors_total = Counter(
+    "bot_handler_errors_total", "Handler calls which raised", ("handler",)
+)
+db_query_seconds = Histogram(
+    "bot_db_query_seconds", "Duration of database queries", ("query",)
+)
+cache_requests_total = Counter(
+    "bot_cache_requests_total", "Cache lookups", ("cache", "result")
+)
+membership_checks_total = Counter(
+    "bot_membership_checks_total",
+    "Membership checks in Telegram by result",
+    ("result",),
+)
+membership_check_seconds = Histogram(
+    "bot_membership_check_seconds", "Duration of membership checks in Telegram"
+)
+telegram_requests_total = Counter(
+    "bot_telegram_requests_total",
+    "Telegram API requests by method and result",
+    ("method", "result"),
+)
+telegram_request_seconds = Histogram(
+    "bot_telegram_request_seconds",
+    "Duration of Telegram API requests including time in queue",
+    ("method",),
+)
+telegram_retries_total = Counter(
+    "bot_telegram_retries_total", "Retried Telegram API requests", ("reason",)
+)
+backup_seconds = Histogram(
+    "bot_backup_seconds",
+    "Duration of database backups",
+    ("database",),
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+log_records_dropped_total = Counter(
+    "bot_log_records_dropped_total",
+    "Log records not written because of sampling or full queue",
+    ("level", "reason"),
+)
+
+
+_runner: web.AppRunner | None = None
+
+
+async def _metrics(_: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host: str, port: int) -> None:
+    """Serve metrics at http://host:port/metrics"""
+    global _runner
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+
+
+async def stop_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
+
+
+class SamplingProfiler:
+    """Samples the stack of the main thread on SIGPROF
+
+    The timer counts CPU time of the process, so idle waiting for events is
+    not sampled. Stacks are counted in folded format ("outer;inner count"
+    lines), which flame graph tools read as is. Works on Unix only and has
+    to be started and stopped from the main thread.
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.samples: _Counter = _Counter()
+        self.started_at = 0.0
+        self.running = False
+
+    def start(self) -> None:
+        """
+        :raises RuntimeError: if the platform has no SIGPROF
+        """
+        if self.running:
+            return
+        if not hasattr(signal, "SIGPROF"):
+            raise RuntimeError("Sampling profiler is supported on Unix only")
+        self.samples.clear()
+        self.started_at = time.monotonic()
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self.running = True
+
+    def stop(self) -> None:
+        if not self.running:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_IGN)
+        self.running = False
+
+    def _sample(self, signum: int, frame: FrameType | None) -> None:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.items())
+
+    def top(self, limit: int = 15) -> List[Tuple[str, int, int]]:
+        """Get functions which were on top of the stack most often
+
+        :return: (function, samples on top of stack, samples anywhere in stack)
+        """
+        own: _Counter = _Counter()
+        total: _Counter = _Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        return [(name, count, total[name]) for name, count in own.most_common(limit)]
+
+
+profiler = SamplingProfiler()
+
+
+def profile_report(limit: int = 15) -> str:
+    samples = sum(profiler.samples.values())
+    lines = [
+        f"{samples} samples in {time.monotonic() - profiler.started_at:.1f}s",
+        "  total    own function",
+    ]
+    for name, own, total in profiler.top(limit):
+        lines.append(
+            f"{100 * total / max(samples, 1):6.1f}% "
+            f"{100 * own / max(samples, 1):5.1f}% {name}"
+        )
+    return "\n".join(lines)
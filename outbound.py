@@ -0,0 +1,321 @@
+"""Scheduling of outgoing Telegram API requests
+
+Every request made by ScheduledBot goes through one OutboundScheduler:
+requests wait in a priority queue (replies to users first, then membership
+checks, then broadcasts), messages are sent within global and per-chat rate
+limits, and flood and network errors are retried with backoff instead of
+failing the handler.
+"""
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import logging
+import time
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Iterator, Tuple
+
+from aiogram import Bot
+from aiogram.utils.exceptions import NetworkError, RetryAfter
+
+from metrics import (
+    telegram_request_seconds,
+    telegram_requests_total,
+    telegram_retries_total,
+)
+
+log = logging.getLogger(__name__)
+
+MAX_CHATS = 10_000
+
+
+class Priority(IntEnum):
+    REPLY = 0
+    MEMBERSHIP = 1
+    BROADCAST = 2
+
+
+# Priority of requests made in current task, see outbound_priority
+_priority: contextvars.ContextVar[Priority | None] = contextvars.ContextVar(
+    "outbound_priority", default=None
+)
+
+
+@contextlib.contextmanager
+def outbound_priority(priority: Priority) -> Iterator[None]:
+    """Make requests of current task with given priority"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def is_message_method(method: str) -> bool:
+    """Whether the method posts to a chat and counts against message limits"""
+    return method.startswith("send") or method in ("copyMessage", "forwardMessage")
+
+
+class TokenBucket:
+    """Allows rate acquisitions per second on average with bursts up to capacity"""
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def try_acquire(self) -> float:
+        """Take a token without waiting
+
+        :return: 0 on success, otherwise seconds until a token is available
+        :rtype: float
+        """
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while (delay := self.try_acquire()) > 0:
+                await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """Hold all acquisitions back for seconds, e.g. after flood error"""
+        self._refill()
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+
+class Request:
+    __slots__ = ("priority", "chat_id", "call", "future", "attempt")
+
+    def __init__(
+        self,
+        priority: Priority,
+        chat_id: int | str | None,
+        call: Callable[[], Awaitable[Any]],
+        future: asyncio.Future,
+    ) -> None:
+        self.priority = priority
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.attempt = 0
+
+
+class OutboundScheduler:
+    """Priority queue of API requests served by a fixed number of workers
+
+    Requests with chat_id are messages: they take a token from the global
+    bucket and from the bucket of their chat. A message to a chat which is
+    out of tokens is put aside until the chat is ready, so it does not hold
+    a worker. Flood errors pause the chat (or all messages if the error is
+    not bound to a chat) and the request is retried after the timeout;
+    network errors are retried with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        chat_rate: float,
+        chat_burst: float,
+        group_rate: float,
+        concurrency: int = 10,
+        retries: int = 3,
+    ) -> None:
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.concurrency = concurrency
+        self.retries = retries
+        self._bucket = TokenBucket(rate)
+        self._chats: Dict[int | str, TokenBucket] = {}
+        self._counter = itertools.count()
+        self._queue: asyncio.PriorityQueue | None = None
+        self._workers: list[asyncio.Task] = []
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHATS:
+                self._chats = {
+                    key: value for key, value in self._chats.items() if not value.idle
+                }
+            # groups and channels have negative ids or @usernames
+            private = isinstance(chat_id, int) and chat_id > 0
+            rate = self.chat_rate if private else self.group_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._workers and self._workers[0].get_loop() is loop:
+            return
+        self._queue = asyncio.PriorityQueue()
+        # workers serve every update, so they must not inherit the context
+        # (e.g. log fields) of the update which happened to start them
+        self._workers = [
+            contextvars.Context().run(loop.create_task, self._worker())
+            for _ in range(self.concurrency)
+        ]
+
+    def _put(self, request: Request) -> None:
+        self._queue.put_nowait(
+            (request.priority, next(self._counter), request)  # FIFO within priority
+        )
+
+    def _put_later(self, delay: float, request: Request) -> None:
+        asyncio.get_running_loop().call_later(delay, self._put, request)
+
+    async def submit(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        priority: Priority,
+        chat_id: int | str | None = None,
+    ) -> Any:
+        """Queue the request and wait for its result
+
+        :param call: function making the request, it may be called again on retry
+        :type call: Callable[[], Awaitable[Any]]
+        :param priority: requests with lower value are served first
+        :type priority: Priority
+        :param chat_id: target chat if request is a message, defaults to None
+        :type chat_id: int | str | None, optional
+        """
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        self._put(Request(priority, chat_id, call, future))
+        return await future
+
+    async def close(self) -> None:
+        """Stop workers, requests left in the queue are not sent"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, request = await self._queue.get()
+            if request.future.done():  # caller was cancelled
+                continue
+            if request.chat_id is not None:
+                delay = self._chat_bucket(request.chat_id).try_acquire()
+                if delay > 0:
+                    self._put_later(delay, request)
+                    continue
+                await self._bucket.acquire()
+            await self._execute(request)
+
+    async def _execute(self, request: Request) -> None:
+        try:
+            result = await request.call()
+        except RetryAfter as e:
+            if request.future.done():
+                return
+            if request.attempt >= self.retries:
+                request.future.set_exception(e)
+                return
+            log.warning("Flood control, retrying in %ss", e.timeout)
+            telegram_retries_total.inc("flood")
+            if request.chat_id is not None:
+                self._chat_bucket(request.chat_id).pause(e.timeout)
+            else:
+                self._bucket.pause(e.timeout)
+            request.attempt += 1
+            self._put_later(e.timeout, request)
+        except (NetworkError, asyncio.TimeoutError) as e:
+            if request.future.done():
+                return
+            if request.attempt >= self.retries:
+                request.future.set_exception(e)
+                return
+            delay = 0.5 * 2**request.attempt
+            log.warning("%s, retrying in %ss", e, delay)
+            telegram_retries_total.inc("network")
+            request.attempt += 1
+            self._put_later(delay, request)
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            if not request.future.done():
+                request.future.set_result(result)
+
+
+class ScheduledBot(Bot):
+    """Bot which sends every API request through OutboundScheduler
+
+    Requests get Priority.MEMBERSHIP for getChatMember and Priority.REPLY
+    for everything else unless outbound_priority says otherwise. Concurrent
+    getChatMember calls with the same arguments share one request.
+    """
+
+    def __init__(self, *args, scheduler: OutboundScheduler, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler
+        self._members: Dict[Tuple[Any, Any], asyncio.Future] = {}
+
+    def _forget_member(self, key: Tuple[Any, Any], future: asyncio.Future) -> None:
+        self._members.pop(key, None)
+        if not future.cancelled():
+            future.exception()  # retrieved even if every caller has gone
+
+    @staticmethod
+    async def _observe(method: str, request: Awaitable[Any]) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await request
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            telegram_requests_total.inc(method, type(e).__name__)
+            raise
+        finally:
+            telegram_request_seconds.observe(time.perf_counter() - started, method)
+        telegram_requests_total.inc(method, "ok")
+        return result
+
+    async def request(self, method: str, data: Dict | None = None, *args, **kwargs):
+        data = data or {}
+        priority = _priority.get()
+        if priority is None:
+            priority = (
+                Priority.MEMBERSHIP if method == "getChatMember" else Priority.REPLY
+            )
+        chat_id = data.get("chat_id") if is_message_method(method) else None
+
+        def call() -> Awaitable[Any]:
+            return Bot.request(self, method, data, *args, **kwargs)
+
+        if method != "getChatMember":
+            return await self._observe(
+                method, self.scheduler.submit(call, priority, chat_id)
+            )
+
+        key = (data.get("chat_id"), data.get("user_id"))
+        future = self._members.get(key)
+        if future is None:
+            future = asyncio.ensure_future(
+                self._observe(method, self.scheduler.submit(call, priority))
+            )
+            self._members[key] = future
+            future.add_done_callback(lambda f: self._forget_member(key, f))
+        # one cancelled caller should not cancel the request of the others
+        return await asyncio.shield(future)
@@ -0,0 +1,265 @@
+"""Run the bot in several worker processes
+
+Supervisor receives updates (long polling or webhook, see BOT_MODE) and
+routes every update to a worker by its user id (chat id if there is no
+user), so updates of one user are handled in order by the same process and
+its FSM records stay consistent. On SIGINT/SIGTERM supervisor stops
+receiving updates, lets workers finish queued ones and waits for them.
+Every worker sends through its own scheduler, so OUTBOUND_RATE and
+BROADCAST_RATE are split between workers.
+
+Usage: WORKERS=4 python supervisor.py
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+from typing import Any, Dict
+
+from aiohttp import web
+
+from config import (
+    ALLOWED_UPDATES,
+    BOT_MODE,
+    LOG_BACKUPS,
+    LOG_FILE,
+    LOG_MAX_BYTES,
+    LOG_QUEUE_SIZE,
+    LOG_SAMPLING,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WORKERS,
+    bot,
+)
+from logs import setup_logging
+
+log = logging.getLogger(__name__)
+
+# Seconds to wait after a failed getUpdates, as Dispatcher.start_polling does
+POLL_ERROR_SLEEP = 5
+# Seconds between checks that worker processes are alive
+WATCH_INTERVAL = 1
+
+
+def shard_key(update: Dict[str, Any]) -> int:
+    """Get id which decides worker for the update"""
+    for key, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+        chat = value.get("chat")
+        if chat:
+            return chat["id"]
+    return 0
+
+
+class Worker:
+    """Consumes updates of its shard in a separate process"""
+
+    def __init__(self, index: int, inbox, outbox) -> None:
+        self.index = index
+        self.inbox = inbox
+        self.outbox = outbox
+        self._tails: Dict[int, asyncio.Task] = {}
+
+    def run(self) -> None:
+        # a signal sent to the process group is handled by supervisor,
+        # which drains workers so on_shutdown writes buffered data
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        os.environ["WORKER_INDEX"] = str(self.index)
+        asyncio.run(self.serve())
+
+    async def serve(self) -> None:
+        import main
+        from aiogram import Bot, Dispatcher
+
+        from handlers.events import dispatch_event, set_transport
+
+        dp = main.dp
+        Dispatcher.set_current(dp)
+        Bot.set_current(dp.bot)
+        set_transport(
+            lambda topic, payload: self.outbox.put(
+                ("event", self.index, topic, payload)
+            )
+        )
+        await main.on_startup(dp)
+
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, self.inbox.get)
+            if item is None:
+                break
+            kind, *args = item
+            if kind == "event":
+                await dispatch_event(*args)
+            else:
+                self._schedule(dp, *args)
+
+        await asyncio.gather(*self._tails.values(), return_exceptions=True)
+        await main.on_shutdown(dp)
+        await dp.storage.close()
+        session = await dp.bot.get_session()
+        await session.close()
+
+    def _schedule(self, dp, key: int, data: Dict[str, Any]) -> None:
+        """Process update after previous update of the same user"""
+        previous = self._tails.get(key)
+        task = asyncio.create_task(self._process(dp, previous, data))
+        self._tails[key] = task
+
+        def _cleanup(_: asyncio.Task) -> None:
+            if self._tails.get(key) is task:
+                del self._tails[key]
+
+        task.add_done_callback(_cleanup)
+
+    @staticmethod
+    async def _process(dp, previous: asyncio.Task | None, data: Dict[str, Any]):
+        from aiogram import types
+        from aiogram.dispatcher.webhook import BaseResponse
+
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            results = await dp.updates_handler.notify(types.Update(**data))
+            for result in results:
+                for response in result or ():
+                    if isinstance(response, BaseResponse):
+                        await response.execute_response(dp.bot)
+        except Exception:
+            log.exception("Cause exception while processing update")
+
+
+class Supervisor:
+    def __init__(self, workers: int = WORKERS) -> None:
+        # workers read it on import of config to split rate limits
+        os.environ["WORKER_PROCESSES"] = str(workers)
+        self._context = multiprocessing.get_context("spawn")
+        self.outbox = self._context.Queue()
+        self.inboxes = [self._context.Queue() for _ in range(workers)]
+        self.processes = [self._spawn(index) for index in range(workers)]
+        self._stopped = asyncio.Event()
+
+    def _spawn(self, index: int) -> multiprocessing.Process:
+        return self._context.Process(
+            target=Worker(index, self.inboxes[index], self.outbox).run,
+            name=f"worker-{index}",
+        )
+
+    def route(self, update: Dict[str, Any]) -> None:
+        key = shard_key(update)
+        self.inboxes[key % len(self.inboxes)].put(("update", key, update))
+
+    async def _forward_events(self) -> None:
+        """Fan events published by one worker out to the others"""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, self.outbox.get)
+            if item is None:
+                return
+            _, sender, topic, payload = item
+            for index, inbox in enumerate(self.inboxes):
+                if index != sender:
+                    inbox.put(("event", topic, payload))
+
+    async def _watch_workers(self) -> None:
+        """Restart workers which died, their inboxes would grow forever"""
+        while not self._stopped.is_set():
+            await asyncio.sleep(WATCH_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if process.is_alive() or self._stopped.is_set():
+                    continue
+                log.error(
+                    "Worker %s exited with code %s, restarting",
+                    index,
+                    process.exitcode,
+                )
+                process.close()
+                self.processes[index] = self._spawn(index)
+                self.processes[index].start()
+
+    async def _poll(self) -> None:
+        await bot.delete_webhook(drop_pending_updates=True)
+        offset = None
+        try:
+            while not self._stopped.is_set():
+                try:
+                    updates = await bot.get_updates(
+                        offset=offset, timeout=20, allowed_updates=ALLOWED_UPDATES
+                    )
+                except Exception:
+                    log.exception("Cause exception while getting updates")
+                    await asyncio.sleep(POLL_ERROR_SLEEP)
+                    continue
+                for update in updates:
+                    offset = update.update_id + 1
+                    self.route(update.to_python())
+        finally:
+            if offset is not None:
+                # confirm routed updates so they are not received again
+                try:
+                    await bot.get_updates(offset=offset, timeout=0)
+                except Exception:
+                    log.exception("Cause exception while confirming updates")
+
+    async def _serve_webhook(self) -> None:
+        from webhook import get_ssl_context, register_webhook
+
+        async def handle(request: web.Request) -> web.Response:
+            self.route(await request.json())
+            return web.Response(text="ok")
+
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(
+            runner, WEBAPP_HOST, WEBAPP_PORT, ssl_context=get_ssl_context()
+        )
+        await site.start()
+        if WEBHOOK_HOST:
+            await register_webhook(bot)
+        await self._stopped.wait()
+        await runner.cleanup()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stopped.set)
+
+        for process in self.processes:
+            process.start()
+        forwarder = asyncio.create_task(self._forward_events())
+        watcher = asyncio.create_task(self._watch_workers())
+
+        receive = self._serve_webhook if BOT_MODE == "webhook" else self._poll
+        receiver = asyncio.create_task(receive())
+        await self._stopped.wait()
+        log.info("Draining workers")
+        if BOT_MODE != "webhook":
+            receiver.cancel()
+        watcher.cancel()
+        await asyncio.gather(receiver, watcher, return_exceptions=True)
+
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join)
+        self.outbox.put(None)
+        await forwarder
+        session = await bot.get_session()
+        await session.close()
+
+
+if __name__ == "__main__":
+    setup_logging(
+        logging.INFO, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUPS, LOG_SAMPLING, LOG_QUEUE_SIZE
+    )
+    asyncio.run(Supervisor().run())
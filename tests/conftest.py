@@ -0,0 +1,45 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from aiogram import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# config creates the bot on import, no request is sent with this token
+os.environ.setdefault("TGToken", "123456:test")
+os.environ.setdefault("METRICS_PORT", "0")
+
+from database.base import Database  # noqa: E402
+
+
+@pytest.fixture
+def run():
+    """Run a coroutine in a fresh event loop
+
+    Databases created by the test are closed afterwards and forgotten, so
+    the next test opens its own pools.
+    """
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.run_until_complete(Database.close_all())
+    loop.close()
+    Database._instances.clear()
+    Database._shared.clear()
+
+
+class FakeMessage:
+    """Message which records replies instead of sending them"""
+
+    def __init__(self, text=None, photo=None, video=None, user_id=1) -> None:
+        self.text = text
+        self.photo = photo or []
+        self.video = video
+        self.from_user = types.User(id=user_id, is_bot=False, first_name="User")
+        self.chat = types.Chat(id=user_id, type="private")
+        self.answers = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+    reply = answer
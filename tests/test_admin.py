@@ -0,0 +1,47 @@
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher import FSMContext
+
+from conftest import FakeMessage
+from database import AsyncFilmDatabase
+from handlers import admin
+from handlers.states import FilmState
+
+FILM = {
+    "code": "7",
+    "title": "Stalker",
+    "director": "Tarkovsky",
+    "year": "1979",
+    "description": "Zone",
+}
+
+
+async def add_with_media(message: FakeMessage) -> FSMContext:
+    state = FSMContext(MemoryStorage(), chat=1, user=1)
+    await state.set_state(FilmState.media)
+    await state.set_data(dict(FILM))
+    await admin.FilmProcess.process_film_media(message, state)
+    return state
+
+
+def test_film_is_added(run, tmp_path, monkeypatch):
+    films_db = AsyncFilmDatabase(str(tmp_path / "films.db"))
+    monkeypatch.setattr(admin, "films_db", films_db)
+    message = FakeMessage("skip")
+
+    state = run(add_with_media(message))
+    assert message.answers == ["✅ Film added"]
+    assert run(films_db.get_film(7)).title == "Stalker"
+    assert run(state.get_state()) is None
+
+
+def test_taken_code_is_reported(run, tmp_path, monkeypatch):
+    films_db = AsyncFilmDatabase(str(tmp_path / "films.db"))
+    monkeypatch.setattr(admin, "films_db", films_db)
+    run(films_db.add_film(7, "Solaris", "Tarkovsky", 1972, "Ocean"))
+    message = FakeMessage("skip")
+
+    state = run(add_with_media(message))
+    assert "already exists" in message.answers[0]
+    assert run(films_db.get_film(7)).title == "Solaris"
+    assert run(state.get_state()) is None
+    assert run(state.get_data()) == {}
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from aiogram.utils.exceptions import BadRequest, MessageNotModified
+
+from database import AsyncBroadcasts, AsyncSubscribitions
+from handlers import broadcast
+
+ADMIN = 1000
+
+
+class FakeBot:
+    def __init__(self, fail_admin: Exception | None = None, fail_users=None):
+        self.fail_admin = fail_admin
+        self.fail_users = fail_users
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if chat_id == ADMIN:
+            if self.fail_admin is not None:
+                raise self.fail_admin
+            return FakeReport()
+        if self.fail_users is not None:
+            raise self.fail_users
+        self.sent.append(chat_id)
+
+
+class FakeReport:
+    async def edit_text(self, text):
+        raise MessageNotModified("Message is not modified")
+
+
+@pytest.fixture
+def jobs(run, tmp_path, monkeypatch):
+    path = str(tmp_path / "subscriptions.db")
+    users_db, jobs_db = AsyncSubscribitions(path), AsyncBroadcasts(path)
+    for user_id in range(1, 6):
+        run(users_db._update_subscription_status(user_id, False))
+    run(users_db.flush())
+    monkeypatch.setattr(broadcast, "users_db", users_db)
+    monkeypatch.setattr(broadcast, "jobs_db", jobs_db)
+    monkeypatch.setattr(broadcast.Broadcaster, "current", None)
+    return jobs_db
+
+
+async def broadcast_text(jobs_db: AsyncBroadcasts) -> dict:
+    job_id = await jobs_db.create_job("Hello", ADMIN)
+    broadcast.Broadcaster._start(
+        {
+            "id": job_id,
+            "text": "Hello",
+            "admin_chat": ADMIN,
+            "last_user_id": 0,
+            "sent": 0,
+            "failed": 0,
+        }
+    )
+    await asyncio.wait([broadcast.Broadcaster._task])
+    # status of a failed job is saved by a task of the done callback
+    await asyncio.sleep(0)
+    await broadcast.Broadcaster._task
+    return await jobs_db.get_job(job_id)
+
+
+@pytest.mark.parametrize(
+    "error", [None, BadRequest("Chat not found"), MessageNotModified("Not modified")]
+)
+def test_unreported_job_is_sent(run, jobs, monkeypatch, error):
+    bot = FakeBot(fail_admin=error)
+    monkeypatch.setattr(broadcast, "bot", bot)
+
+    job = run(broadcast_text(jobs))
+    assert bot.sent == [1, 2, 3, 4, 5]
+    assert (job["status"], job["sent"], job["failed"]) == ("done", 5, 0)
+
+
+def test_crashed_job_is_failed(run, jobs, monkeypatch):
+    monkeypatch.setattr(broadcast, "bot", FakeBot(fail_users=RuntimeError("bug")))
+
+    job = run(broadcast_text(jobs))
+    assert job["status"] == "failed"
+    assert run(jobs.create_job("Again", ADMIN)) is not None
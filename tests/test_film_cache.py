@@ -0,0 +1,27 @@
+import time
+
+from database import AsyncFilmDatabase
+
+
+def test_expired_miss_is_looked_up_again(run, tmp_path):
+    path = str(tmp_path / "films.db")
+    films_db, other_worker = AsyncFilmDatabase(path, cache=True), AsyncFilmDatabase(
+        path
+    )
+    run(films_db.preload())
+    assert run(films_db.get_film(5)) is None
+
+    run(other_worker.add_film(5, "Mirror", "Tarkovsky", 1975, "Memories"))
+    # remembered miss hides the film until it expires
+    assert run(films_db.get_film(5)) is None
+    films_db._catalog.missing[5] = time.monotonic()
+    assert run(films_db.get_film(5)).title == "Mirror"
+
+
+def test_removed_film_is_not_served(run, tmp_path):
+    films_db = AsyncFilmDatabase(str(tmp_path / "films.db"), cache=True)
+    run(films_db.add_film(5, "Mirror", "Tarkovsky", 1975, "Memories"))
+    assert run(films_db.get_film(5)) is not None
+
+    run(films_db.remove_film("5"))
+    assert run(films_db.get_film(5)) is None
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+from aiogram import types
+from aiogram.utils.exceptions import (
+    BadRequest,
+    InvalidHTTPUrlContent,
+    MessageToReplyNotFound,
+    NetworkError,
+    WrongFileIdentifier,
+)
+
+from database import AsyncFilmDatabase
+from handlers import film_code
+
+URL = "https://example.com/poster.jpg"
+
+
+class MediaMessage:
+    """Message whose reply_photo fails with the given errors in turn"""
+
+    def __init__(self, *errors: Exception) -> None:
+        self.errors = list(errors)
+        self.sent = []
+
+    async def reply_photo(self, photo, caption=None):
+        self.sent.append(photo)
+        # let other lookups of the film run
+        await asyncio.sleep(0.01)
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None:
+                raise error
+        return types.Message(photo=[{"file_id": "uploaded", "file_unique_id": "u"}])
+
+
+@pytest.fixture
+def films_db(run, tmp_path, monkeypatch):
+    films_db = AsyncFilmDatabase(str(tmp_path / "films.db"))
+    monkeypatch.setattr(film_code, "films_db", films_db)
+    return films_db
+
+
+def add_film(run, films_db, file_id=None, source=None):
+    run(
+        films_db.add_film(
+            1, "Solaris", "Tarkovsky", 1972, "Ocean", "photo", file_id, source
+        )
+    )
+    return run(films_db.get_film(1))
+
+
+def test_file_id_is_sent(run, films_db):
+    film = add_film(run, films_db, file_id="saved")
+    message = MediaMessage()
+
+    assert run(film_code.send_media(message, film))
+    assert message.sent == ["saved"]
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        MessageToReplyNotFound("Reply message not found"),
+        BadRequest("Not enough rights to send photos to the chat"),
+        NetworkError("Connection reset"),
+    ],
+)
+def test_request_error_keeps_media(run, films_db, error):
+    film = add_film(run, films_db, file_id="saved", source=URL)
+    message = MediaMessage(error)
+
+    assert not run(film_code.send_media(message, film))
+    assert message.sent == ["saved"]
+    assert run(films_db.get_film(1)) == film
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        WrongFileIdentifier("Wrong file identifier/http url specified"),
+        BadRequest("Invalid file_id"),
+    ],
+)
+def test_rejected_file_id_without_source_is_detached(run, films_db, error):
+    film = add_film(run, films_db, file_id="foreign")
+
+    assert not run(film_code.send_media(MediaMessage(error), film))
+    assert run(films_db.get_film(1)).media_type is None
+
+
+def test_rejected_file_id_is_uploaded_again(run, films_db):
+    film = add_film(run, films_db, file_id="foreign", source=URL)
+    message = MediaMessage(WrongFileIdentifier("Wrong file identifier"), None)
+
+    assert run(film_code.send_media(message, film))
+    assert message.sent == ["foreign", URL]
+    assert run(films_db.get_film(1)).media_file_id == "uploaded"
+
+
+@pytest.mark.parametrize(
+    "source, error",
+    [
+        (URL, InvalidHTTPUrlContent("Failed to get http url content")),
+        (URL, BadRequest("Wrong type of the web page content")),
+        ("missing/poster.jpg", None),
+    ],
+)
+def test_broken_source_is_detached(run, films_db, tmp_path, source, error):
+    if not source.startswith("https://"):
+        source = str(tmp_path / source)
+    film = add_film(run, films_db, source=source)
+
+    assert not run(film_code.send_media(MediaMessage(error), film))
+    assert run(films_db.get_film(1)).media_type is None
+
+
+def test_failed_upload_keeps_source(run, films_db):
+    film = add_film(run, films_db, source=URL)
+    message = MediaMessage(BadRequest("Not enough rights to send photos to the chat"))
+
+    assert not run(film_code.send_media(message, film))
+    assert run(films_db.get_film(1)).media_source == URL
+
+
+def test_first_lookups_upload_once(run, films_db):
+    film = add_film(run, films_db, source=URL)
+    first, second = MediaMessage(), MediaMessage()
+
+    async def lookups():
+        return await asyncio.gather(
+            film_code.send_media(first, film), film_code.send_media(second, film)
+        )
+
+    assert run(lookups()) == [True, True]
+    assert first.sent == [URL]
+    assert second.sent == ["uploaded"]
+    assert not film_code._uploads
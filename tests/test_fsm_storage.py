@@ -0,0 +1,50 @@
+from database.base import Database
+from database.fsm_storage import SQLiteStorage
+
+
+def test_state_survives_restart(run, tmp_path):
+    path = str(tmp_path / "fsm.db")
+    storage = SQLiteStorage(path, flush_interval=60)
+    run(storage.set_state(chat=1, user=1, state="FilmStates:title"))
+    run(storage.update_data(chat=1, user=1, code=42))
+    run(storage.close())
+
+    restarted = SQLiteStorage(path)
+    assert run(restarted.get_state(chat=1, user=1)) == "FilmStates:title"
+    assert run(restarted.get_data(chat=1, user=1)) == {"code": 42}
+    assert run(restarted.get_state(chat=2, user=2)) is None
+
+
+def test_finished_session_is_deleted(run, tmp_path):
+    path = str(tmp_path / "fsm.db")
+    storage = SQLiteStorage(path, flush_interval=60)
+    run(storage.set_state(chat=1, user=1, state="FilmStates:title"))
+    run(storage.flush())
+    run(storage.finish(chat=1, user=1))
+    run(storage.close())
+
+    restarted = SQLiteStorage(path)
+    assert run(restarted.get_state(chat=1, user=1)) is None
+    assert run(restarted.get_data(chat=1, user=1)) == {}
+
+
+def test_expired_session_is_dropped(run, tmp_path):
+    path = str(tmp_path / "fsm.db")
+    storage = SQLiteStorage(path, flush_interval=60)
+    run(storage.set_state(chat=1, user=1, state="FilmStates:title"))
+    run(storage.close())
+
+    restarted = SQLiteStorage(path, ttl=0)
+    assert run(restarted.get_state(chat=1, user=1)) is None
+
+
+def test_close_after_close_all_does_not_reopen(run, tmp_path, monkeypatch):
+    storage = SQLiteStorage(str(tmp_path / "fsm.db"))
+    run(storage.set_state(chat=1, user=1, state="FilmStates:title"))
+    run(Database.close_all())
+
+    async def connect():
+        raise AssertionError("pool is opened again")
+
+    monkeypatch.setattr(storage, "connect", connect)
+    run(storage.close())
@@ -0,0 +1,62 @@
+import pytest
+from aiogram import Bot, Dispatcher, types
+
+from database import AsyncFilmDatabase
+from handlers.instrumentation import MetricsMiddleware, handler_name
+from metrics import db_query_seconds, handler_errors_total, handler_seconds
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "User"},
+        "text": "hi",
+    },
+}
+
+
+def count(histogram, *labels) -> int:
+    return sum(histogram._values.get(labels, [0, 0])[:-1])
+
+
+async def fail(message: types.Message) -> None:
+    raise RuntimeError("handler bug")
+
+
+def test_failed_handler_is_observed(run):
+    bot = Bot("123456:test")
+    dp = Dispatcher(bot)
+    dp.middleware.setup(MetricsMiddleware())
+    dp.register_message_handler(fail)
+    name = handler_name(fail)
+    observed, errors = count(handler_seconds, name), handler_errors_total.value(name)
+
+    with pytest.raises(RuntimeError):
+        run(dp.process_update(types.Update(**UPDATE)))
+    assert count(handler_seconds, name) == observed + 1
+    assert handler_errors_total.value(name) == errors + 1
+    session = run(bot.get_session())
+    run(session.close())
+
+
+def observations() -> dict:
+    return {
+        labels: count(db_query_seconds, *labels) for labels in db_query_seconds._values
+    }
+
+
+def test_query_is_observed_once(run, tmp_path):
+    films_db = AsyncFilmDatabase(str(tmp_path / "films.db"))
+    run(films_db.add_film(1, "Solaris", "Tarkovsky", 1972, "Ocean"))
+    before = {
+        labels: sum(counts[:-1]) for labels, counts in db_query_seconds._values.items()
+    }
+
+    run(films_db.remove_film(1))
+    after = {
+        labels: sum(counts[:-1]) for labels, counts in db_query_seconds._values.items()
+    }
+    changed = {labels for labels in after if after[labels] != before.get(labels, 0)}
+    assert changed == {("AsyncFilmDatabase.remove_film",)}
@@ -0,0 +1,67 @@
+import sqlite3
+
+from database.db_utils import AsyncFilmDatabase, AsyncSubscribitions
+
+
+def create_baseline(path: str) -> None:
+    """Create tables the way the bot did before versioned migrations"""
+    with sqlite3.connect(path) as db:
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS films (code INT PRIMARY KEY UNIQUE NOT NULL, "
+            "title VARCHAR(50) NOT NULL, director VARCHAR(50) NOT NULL, "
+            "year INT NOT NULL, description TEXT NOT NULL)"
+        )
+        db.execute(
+            "INSERT INTO films VALUES (1, 'Solaris', 'Tarkovsky', 1972, 'Ocean')"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS subscriptions "
+            "(user_id INTEGER NOT NULL PRIMARY KEY, subscribed BOOLEAN DEFAULT 0)"
+        )
+        db.execute("CREATE TABLE IF NOT EXISTS channels (channel_name TEXT NOT NULL)")
+        db.execute(
+            "CREATE TRIGGER IF NOT EXISTS insert_subscription_trigger "
+            "AFTER INSERT ON channels "
+            "BEGIN UPDATE subscriptions SET subscribed = 0; END"
+        )
+        db.execute("INSERT INTO channels VALUES ('@sponsor')")
+        db.executemany("INSERT INTO subscriptions VALUES (?, ?)", [(1, 1), (2, 0)])
+
+
+def test_films_upgrade(run, tmp_path):
+    path = str(tmp_path / "films.db")
+    create_baseline(path)
+    films_db = AsyncFilmDatabase(path)
+
+    film = run(films_db.get_film(1))
+    assert film.title == "Solaris"
+    assert film.media_type is None
+    films, more = run(films_db.search_films("tarkov"))
+    assert [film.code for film in films] == [1]
+    assert not more
+
+
+def test_subscriptions_upgrade_keeps_verified_users(run, tmp_path):
+    path = str(tmp_path / "subscriptions.db")
+    create_baseline(path)
+    subs_db = AsyncSubscribitions(path)
+
+    assert run(subs_db.is_subscribed_to_all(1))
+    assert not run(subs_db.is_subscribed_to_all(2))
+    run(subs_db.add_sponsor("@another"))
+    assert not run(subs_db.is_subscribed_to_all(1))
+
+
+def test_migrations_run_once(run, tmp_path):
+    path = str(tmp_path / "subscriptions.db")
+    create_baseline(path)
+    first = AsyncSubscribitions(path)
+    run(first.connect())
+    run(first.close())
+
+    subs_db = AsyncSubscribitions(path)
+    run(subs_db.connect())
+    assert run(subs_db.is_subscribed_to_all(1))
+    with sqlite3.connect(path) as db:
+        versions = dict(db.execute("SELECT name, version FROM schema_migrations"))
+    assert versions == {"subscriptions": len(subs_db.migrations())}
@@ -0,0 +1,92 @@
+import pytest
+
+from database import AsyncFilmDatabase, AsyncSubscribitions
+from handlers import admin
+
+PAGE = admin.LIST_PAGE_SIZE
+
+
+@pytest.fixture
+def films_db(run, tmp_path, monkeypatch):
+    films_db = AsyncFilmDatabase(str(tmp_path / "films.db"))
+    monkeypatch.setattr(admin, "films_db", films_db)
+    return films_db
+
+
+def add_films(run, films_db, count: int) -> None:
+    films = [
+        (code, f"Film {code}", "Director", 2000, "") for code in range(1, count + 1)
+    ]
+    run(films_db.add_films(films))
+
+
+def page(run, after=None, before=None):
+    """Get codes on the page and directions of its buttons"""
+    text, keyboard = run(admin.FilmList._render_page(after, before))
+    codes = [int(line.split(" — ")[0]) for line in text.splitlines()[2:]]
+    buttons = (
+        [button.callback_data.split(":")[1] for button in keyboard.inline_keyboard[0]]
+        if keyboard
+        else []
+    )
+    return codes, buttons
+
+
+def test_get_page_boundaries(run, films_db):
+    add_films(run, films_db, 5)
+
+    assert [row.code for row in run(films_db.list_films(limit=2))] == [1, 2]
+    assert [row.code for row in run(films_db.list_films(after=3))] == [4, 5]
+    assert run(films_db.list_films(after=5)) == []
+    assert [row.code for row in run(films_db.list_films(before=3))] == [1, 2]
+    assert [row.code for row in run(films_db.list_films(before=5, limit=2))] == [3, 4]
+    assert run(films_db.list_films(before=1)) == []
+
+
+@pytest.mark.parametrize("count", [PAGE, 2 * PAGE, 2 * PAGE + 5])
+def test_pages_forward_and_back(run, films_db, count):
+    add_films(run, films_db, count)
+    pages, after = [], None
+    while True:
+        codes, buttons = page(run, after=after)
+        pages.append((codes, buttons))
+        if "next" not in buttons:
+            break
+        after = codes[-1]
+
+    assert [code for codes, _ in pages for code in codes] == list(range(1, count + 1))
+    assert "prev" not in pages[0][1]
+    for codes, buttons in pages[1:]:
+        assert "prev" in buttons
+        assert page(run, before=codes[0]) == (
+            list(range(codes[0] - PAGE, codes[0])),
+            (["prev"] if codes[0] > PAGE + 1 else []) + ["next"],
+        )
+
+
+def test_empty_list(run, films_db):
+    assert run(admin.FilmList._render_page()) == ("There are no films", None)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 5, 100])
+def test_iteration_visits_every_row_once(run, films_db, chunk_size):
+    add_films(run, films_db, 20)
+
+    async def codes():
+        return [film.code async for film in films_db.iter_films(chunk_size)]
+
+    assert run(codes()) == list(range(1, 21))
+
+
+def test_iteration_resumes_after_key(run, tmp_path):
+    users_db = AsyncSubscribitions(str(tmp_path / "subscriptions.db"))
+    for user_id in (3, 1, 7, 5):
+        run(users_db._update_subscription_status(user_id, False))
+    run(users_db.flush())
+
+    async def chunks(after):
+        return [chunk async for chunk in users_db.iter_user_ids(after, chunk_size=2)]
+
+    assert run(chunks(0)) == [[1, 3], [5, 7]]
+    assert run(chunks(3)) == [[5, 7]]
+    assert run(chunks(7)) == []
@@ -0,0 +1,37 @@
+from conftest import FakeMessage
+from database import AsyncAnalytics, AsyncFilmDatabase
+from handlers import stats
+
+
+class StatsMessage(FakeMessage):
+    def get_args(self) -> str:
+        return self.text
+
+
+def test_report_fits_one_message(run, tmp_path, monkeypatch):
+    analytics = AsyncAnalytics(str(tmp_path / "analytics.db"))
+    films_db = AsyncFilmDatabase(str(tmp_path / "films.db"))
+    monkeypatch.setattr(stats, "analytics", analytics)
+    monkeypatch.setattr(stats, "films_db", films_db)
+    monkeypatch.setattr(stats, "STATS_TOP", 100)
+    message = StatsMessage(" ".join(["24h"] * 5))
+
+    async def report():
+        for event in ("gate_blocked", "gate_blocked", "gate_passed", "gate_failed"):
+            analytics.record(event)
+        for code in range(100):
+            analytics.record("film_miss", str(10**9 + code))
+        await stats.Stats.stats(message)
+
+    run(report())
+    (report,) = message.answers
+    assert "Gate: 2 blocked, 1 passed the check (50.0%), 1 failed it" in report
+    assert len(report) <= stats.MESSAGE_LIMIT
+    assert report.endswith("\n…")
+
+
+def test_truncate_keeps_whole_lines():
+    text = "\n".join(f"line {number}" for number in range(10))
+
+    assert stats.truncate(text, len(text)) == text
+    assert stats.truncate(text, 20) == "line 0\nline 1\n…"
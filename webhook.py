@@ -0,0 +1,96 @@
+import asyncio
+import ssl
+from typing import Awaitable, Callable
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY, WebhookRequestHandler
+from aiogram.utils.executor import Executor
+from aiohttp import web
+
+from config import (
+    ALLOWED_UPDATES,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBHOOK_HOST,
+    WEBHOOK_MAX_CONCURRENCY,
+    WEBHOOK_PATH,
+    WEBHOOK_SSL_CERT,
+    WEBHOOK_SSL_KEY,
+)
+
+Callback = Callable[[Dispatcher], Awaitable[None]]
+
+
+class LimitedWebhookRequestHandler(WebhookRequestHandler):
+    """Webhook handler that processes at most WEBHOOK_MAX_CONCURRENCY updates
+    at once. Other requests wait for a free slot.
+    """
+
+    semaphore = asyncio.Semaphore(WEBHOOK_MAX_CONCURRENCY)
+
+    async def process_update(self, update: types.Update):
+        async with self.semaphore:
+            return await super().process_update(update)
+
+
+def get_ssl_context() -> ssl.SSLContext | None:
+    if not (WEBHOOK_SSL_CERT and WEBHOOK_SSL_KEY):
+        return None
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(WEBHOOK_SSL_CERT, WEBHOOK_SSL_KEY)
+    return context
+
+
+async def register_webhook(bot: Bot) -> None:
+    """Tell Telegram where to send updates"""
+    await bot.set_webhook(
+        WEBHOOK_HOST + WEBHOOK_PATH,
+        certificate=types.InputFile(WEBHOOK_SSL_CERT) if WEBHOOK_SSL_CERT else None,
+        max_connections=min(WEBHOOK_MAX_CONCURRENCY, 100),
+        drop_pending_updates=True,
+        allowed_updates=ALLOWED_UPDATES,
+    )
+
+
+def start_webhook(
+    dispatcher: Dispatcher, on_startup: Callback, on_shutdown: Callback
+) -> None:
+    """Serve updates over webhook
+
+    Without WEBHOOK_HOST the webhook is not registered in Telegram and
+    Telegram is not contacted on startup, so updates can be posted to the
+    server locally (e.g. for load testing).
+    """
+    ssl_context = get_ssl_context()
+    if WEBHOOK_HOST:
+        executor = Executor(dispatcher)
+        executor.on_startup(
+            lambda dispatcher: register_webhook(dispatcher.bot), polling=False
+        )
+        executor.on_startup(on_startup, polling=False)
+        executor.on_shutdown(on_shutdown, polling=False)
+        executor.start_webhook(
+            webhook_path=WEBHOOK_PATH,
+            request_handler=LimitedWebhookRequestHandler,
+            host=WEBAPP_HOST,
+            port=WEBAPP_PORT,
+            ssl_context=ssl_context,
+        )
+        return
+
+    app = web.Application()
+    app.router.add_route("*", WEBHOOK_PATH, LimitedWebhookRequestHandler)
+    app[BOT_DISPATCHER_KEY] = dispatcher
+
+    async def _on_startup(_: web.Application) -> None:
+        await on_startup(dispatcher)
+
+    async def _on_shutdown(_: web.Application) -> None:
+        await on_shutdown(dispatcher)
+        await dispatcher.storage.close()
+        session = await dispatcher.bot.get_session()
+        await session.close()
+
+    app.on_startup.append(_on_startup)
+    app.on_shutdown.append(_on_shutdown)
+    web.run_app(app, host=WEBAPP_HOST, port=WEBAPP_PORT, ssl_context=ssl_context)